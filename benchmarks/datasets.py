@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from .stand_in import BODIES, FUELS, MAKES
+
+MODELS = [(make, model) for make in sorted(MAKES) for model in MAKES[make]]
+
+
+def synthetic_cars(rows: int, seed: int = 0):
+    """
+    Generate cars DataFrame with dataset_loader.CARS_DTYPES columns and plausible relations between year, mileage and
+    price, vectorized so 10M rows take seconds
+    :param rows: number of cars
+    :param seed: random generator seed, the same seed gives the same data
+    """
+    rng = np.random.default_rng(seed)
+    # a few popular models dominate listings, like on the real site
+    weights = 1 / np.arange(1, len(MODELS) + 1)
+    pairs = rng.choice(len(MODELS), size=rows, p=weights / weights.sum())
+    year = rng.integers(1998, 2020, size=rows, dtype=np.int16)
+    age = 2020 - year
+    mileage = np.clip(rng.normal(age * 15000, 20000), 0, None).astype(np.int32)
+    price = np.clip(150000 * 0.87 ** age - mileage * 0.05 + rng.normal(0, 5000, size=rows), 2000, None)
+
+    makes = sorted(MAKES)
+    models = sorted({model for _, model in MODELS})
+    make_codes = np.array([makes.index(make) for make, _ in MODELS])
+    model_codes = np.array([models.index(model) for _, model in MODELS])
+    return pd.DataFrame({
+        'make': pd.Categorical.from_codes(make_codes[pairs], categories=makes),
+        'model': pd.Categorical.from_codes(model_codes[pairs], categories=models),
+        'year': year,
+        'mileage': mileage,
+        'fuel': pd.Categorical.from_codes(rng.integers(0, len(FUELS), size=rows),
+                                          categories=[fuel.lower() for fuel in FUELS]),
+        'body': pd.Categorical.from_codes(rng.integers(0, len(BODIES), size=rows),
+                                          categories=[body.lower() for body in BODIES]),
+        'no_accidents': rng.random(rows) < 0.8,
+        'price': price.astype(np.int32),
+        'currency': pd.Categorical.from_codes(np.zeros(rows, dtype=np.int8), categories=['PLN']),
+    })
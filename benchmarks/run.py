@@ -0,0 +1,278 @@
+import argparse
+import contextlib
+import csv
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import types
+
+from bs4 import BeautifulSoup
+
+from src.car_ad_parser import CarParser
+from src.car_spider import CarSpider
+from src.csv_writer import BatchCsvWriter
+from src.parser_engines import ENGINES, get_engine
+
+from .datasets import MODELS, synthetic_cars
+from .stand_in import StandInServer, full_page, load_template, render_ad
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+CRAWL_METHODS = ('crawl', 'crawl_streaming', 'crawl_async', 'crawl_parallel')
+DATASET_SIZES = (10000, 100000, 1000000)
+
+
+def result(value: float, unit: str, better: str = 'lower') -> dict:
+    return dict(value=value, unit=unit, better=better)
+
+
+def time_call(func, repeat: int = 5) -> float:
+    """
+    :return: seconds per call, best of repeat runs of as many calls as fit in 0.2 s
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def median_ms(func, calls) -> float:
+    """
+    :return: median latency of func called with every argument tuple in calls, in milliseconds
+    """
+    latencies = []
+    for args in calls:
+        started = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies)
+
+
+def micro_benchmarks() -> dict:
+    """
+    Parsing helpers and csv writer on a generated ad page
+    """
+    html = render_ad(load_template(), 0)
+    content = full_page(html, 0).encode('windows-1250')
+    soup = BeautifulSoup(html, "html.parser")
+    tags = CarParser.get_offer_parameters(soup)
+    price_text = soup.find('span', {'class': 'offer-price__number'}).text
+
+    results = {
+        'micro.parse_price_tag': result(time_call(lambda: CarParser.parse_price_tag(price_text)) * 1e6, 'us'),
+        'micro.get_offer_parameters': result(time_call(lambda: CarParser.get_offer_parameters(soup)) * 1e6, 'us'),
+        'micro.parse_offer_parameters': result(time_call(lambda: CarParser.parse_offer_parameters(tags)) * 1e6,
+                                               'us'),
+    }
+    for name in ENGINES:
+        try:
+            engine = get_engine(name)
+            engine.extract(html)
+        except ImportError as e:
+            print("skipping {} engine: {}".format(name, e), file=sys.stderr)
+            continue
+        seconds = time_call(lambda: CarParser.parse_car_details(html, engine))
+        results['micro.parse_car_details.{}'.format(name)] = result(seconds * 1e6, 'us')
+        # whole offer page, with and without locating regions in raw bytes first
+        seconds = time_call(lambda: CarParser.parse_car_details(content.decode('windows-1250'), engine))
+        results['micro.parse_full_page.{}'.format(name)] = result(seconds * 1e6, 'us')
+        seconds = time_call(lambda: CarParser.parse_car_details_from_content(content, 'windows-1250', engine))
+        results['micro.parse_regions.{}'.format(name)] = result(seconds * 1e6, 'us')
+
+    row = CarParser.parse_car_details(html)
+    rows = 20000
+    with tempfile.TemporaryDirectory() as directory:
+        writer = BatchCsvWriter(os.path.join(directory, 'cars.csv'))
+        started = time.perf_counter()
+        for _ in range(rows):
+            writer.write(row)
+        writer.close()
+        elapsed = time.perf_counter() - started
+    results['micro.csv_writer'] = result(rows / elapsed, 'rows/s', 'higher')
+    return results
+
+
+def crawl_benchmarks(pages: int = 10, ads_per_page: int = 32, latency: float = 0.005) -> dict:
+    """
+    End-to-end crawl of the local stand-in with every CarSpider crawl method
+    """
+    results = dict()
+    for method in CRAWL_METHODS:
+        with tempfile.TemporaryDirectory() as directory, StandInServer(pages, ads_per_page, latency) as stand_in:
+            filename = os.path.join(directory, 'cars.csv')
+            spider = CarSpider(stand_in.starting_url, pages, filename)
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                getattr(spider, method)()
+                elapsed = time.perf_counter() - started
+            with open(filename, encoding='cp1250') as csv_file:
+                ads = len(list(csv.reader(csv_file))) - 1
+        if ads != pages * ads_per_page:
+            print("{}: {} of {} ads saved".format(method, ads, pages * ads_per_page))
+        results['crawl.{}'.format(method)] = result(ads / elapsed, 'ads/s', 'higher')
+    return results
+
+
+@contextlib.contextmanager
+def working_directory(path: str):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def plot_benchmarks(sizes=DATASET_SIZES) -> dict:
+    """
+    Latency of plot.py callbacks on synthetic datasets of given sizes
+    """
+    if SRC not in sys.path:
+        sys.path.append(SRC)
+    with working_directory(SRC), contextlib.redirect_stdout(io.StringIO()):
+        import plot  # data is loaded with the first callback, the synthetic snapshots are served instead
+    from dataset_cache import SnapshotCache
+    from dataset_reloader import DatasetReloader, DatasetSnapshot
+
+    results = dict()
+    filters = [(make, model, 2005, 2015) for make, model in MODELS[:5]]
+    for size in sizes:
+        df = synthetic_cars(size)
+        started = time.perf_counter()
+        snapshot = DatasetSnapshot(df)
+        results['plot.{}.snapshot_build'.format(size)] = result((time.perf_counter() - started) * 1000, 'ms')
+        # callbacks read the reloader's current snapshot, the synthetic one is published in its place
+        plot.reloader = types.SimpleNamespace(snapshot=snapshot)
+
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'cars.csv')
+            df.to_csv(csv_path, index=False, encoding='cp1250')
+            cache = SnapshotCache(os.path.join(directory, 'snapshot'))
+            for start in ('cold_start', 'warm_start'):
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    DatasetReloader(csv_path, snapshot_cache=cache)
+                results['plot.{}.{}'.format(size, start)] = result((time.perf_counter() - started) * 1000, 'ms')
+
+        def cold(callback):
+            def call(*args):
+                plot.callback_cache.clear()
+                return callback(*args)
+            return call
+
+        results['plot.{}.update_figure'.format(size)] = result(median_ms(cold(plot.update_figure), filters), 'ms')
+        for args in filters:
+            plot.update_figure(*args)
+        results['plot.{}.update_figure_cached'.format(size)] = result(median_ms(plot.update_figure, filters), 'ms')
+        results['plot.{}.update_price_summary'.format(size)] = result(
+            median_ms(cold(plot.update_price_summary), filters), 'ms')
+
+        hovers = []
+        for make, model, year_from, year_to in filters:
+            cars = snapshot.index.query(make, model, year_from, year_to)
+            point = {'customdata': int(cars.index[0])}
+            if len(cars) > 20000:
+                # aggregated figure, hovering a bin of the heatmap
+                point = {'customdata': [1, 10 ** 7, 0, 10 ** 7]}
+            hovers.append(({'points': [point]}, make, model, year_from, year_to))
+        results['plot.{}.display_hover_data'.format(size)] = result(
+            median_ms(cold(plot.display_hover_data), hovers), 'ms')
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def latest_results(directory: str = RESULTS_DIRECTORY):
+    files = sorted(glob.glob(os.path.join(directory, '*.json')))
+    return files[-1] if files else None
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1) -> list:
+    """
+    Compare results of two runs
+    :param baseline: results saved by an earlier run
+    :param current: results of this run
+    :param tolerance: relative change treated as noise
+    :return: list of (name, baseline value, current value, relative change, status) tuples, status is 'regression',
+    'improvement' or 'ok'; relative change is positive when the result got better
+    """
+    rows = []
+    for name, now in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None or not before['value']:
+            continue
+        change = (now['value'] - before['value']) / before['value']
+        if now['better'] == 'lower':
+            change = -change
+        status = 'ok'
+        if change < -tolerance:
+            status = 'regression'
+        elif change > tolerance:
+            status = 'improvement'
+        rows.append((name, before['value'], now['value'], change, status))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run crawler and dashboard benchmarks and save their results")
+    parser.add_argument('--suite', nargs='+', choices=['micro', 'crawl', 'plot'], default=['micro', 'crawl', 'plot'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DATASET_SIZES),
+                        help="synthetic dataset sizes of plot benchmarks, eg. 10000 100000 1000000 10000000")
+    parser.add_argument('--pages', type=int, default=10, help="listing pages crawled from the stand-in")
+    parser.add_argument('--latency', type=float, default=0.005, help="seconds every stand-in response is delayed by")
+    parser.add_argument('--output', default=None, help="results file, results/<timestamp>.json by default")
+    parser.add_argument('--baseline', default=None, help="results file to compare with, latest saved by default")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative change treated as noise")
+    args = parser.parse_args(argv)
+
+    baseline_path = args.baseline or latest_results()
+    results = dict()
+    if 'micro' in args.suite:
+        results.update(micro_benchmarks())
+    if 'crawl' in args.suite:
+        results.update(crawl_benchmarks(args.pages, latency=args.latency))
+    if 'plot' in args.suite:
+        results.update(plot_benchmarks(args.sizes))
+
+    run = dict(
+        meta=dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'), commit=git_commit(), python=platform.python_version(),
+                  platform=platform.platform(), cpus=os.cpu_count(), suite=args.suite),
+        results=results,
+    )
+    output = args.output or os.path.join(RESULTS_DIRECTORY, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(run, results_file, indent=2)
+
+    for name, value in sorted(results.items()):
+        print("{:45} {:>14.2f} {}".format(name, value['value'], value['unit']))
+    print("results saved to", output)
+
+    if baseline_path is not None and os.path.abspath(baseline_path) != os.path.abspath(output):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        print("\ncompared with {} (commit {}):".format(baseline_path, baseline['meta'].get('commit')))
+        rows = compare(baseline, run, args.tolerance)
+        for name, before, now, change, status in rows:
+            print("{:45} {:>14.2f} -> {:>14.2f} {:+7.1%} {}".format(name, before, now, change, status))
+        if any(status == 'regression' for *_, status in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
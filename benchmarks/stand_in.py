@@ -0,0 +1,160 @@
+import os.path
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'offer_params.html')
+
+MAKES = {
+    'audi': ['a3', 'a4', 'a6', 's3', 'q5'],
+    'bmw': ['seria_3', 'seria_5', 'x3', 'x5'],
+    'opel': ['astra', 'corsa', 'insignia'],
+    'skoda': ['fabia', 'octavia', 'superb'],
+    'volkswagen': ['golf', 'passat', 'polo', 'tiguan'],
+}
+FUELS = ['Benzyna', 'Diesel', 'Benzyna+LPG', 'Hybryda']
+BODIES = ['Kompakt', 'Sedan', 'Kombi', 'SUV']
+
+
+def load_template(path: str = TEMPLATE_PATH) -> str:
+    with open(path, encoding='cp1250') as html_file:
+        return html_file.read()
+
+
+def replace_value(html: str, label: str, value: str) -> str:
+    """
+    Replace text of offer parameter with given label, values wrapped in links keep their links
+    """
+    pattern = r'(<span class="offer-params__label">{}</span>\s*<div class="offer-params__value">\s*' \
+              r'(?:<a [^>]*>\s*)?)[^<\n]+'.format(re.escape(label))
+    return re.sub(pattern, lambda match: match.group(1) + value, html, count=1)
+
+
+def render_ad(template: str, ad_id: int) -> str:
+    """
+    Ad page modeled on tests/offer_params.html with car details drawn from a generator seeded with ad id, so the same
+    ad always has the same details
+    """
+    rng = random.Random(ad_id)
+    make = rng.choice(sorted(MAKES))
+    model = rng.choice(MAKES[make])
+    year = rng.randint(1998, 2019)
+    mileage = max(0, int(rng.gauss((2020 - year) * 15000, 20000)))
+    price = max(2000, int(150000 * 0.87 ** (2020 - year) - mileage * 0.05 + rng.gauss(0, 5000)))
+
+    html = template
+    for label, value in (("Marka pojazdu", make.capitalize()), ("Model pojazdu", model.replace('_', ' ').upper()),
+                         ("Rok produkcji", str(year)), ("Przebieg", "{:,} km".format(mileage).replace(',', ' ')),
+                         ("Rodzaj paliwa", rng.choice(FUELS)), ("Typ", rng.choice(BODIES))):
+        html = replace_value(html, label, value)
+    return html + """
+        <div class="offer-price" data-price="{0}">
+        <span class="offer-price__number">{0}        <span class="offer-price__currency">PLN</span>
+        </span></div>
+    """.format("{:,}".format(price).replace(',', ' '))
+
+
+def full_page(ad_html: str, ad_id: int, photos: int = 40) -> str:
+    """
+    Wrap ad details in the rest of an offer page - inline scripts with page state, photo gallery, description and
+    equipment list - so the page has the size and shape of a real one (around 100 kB)
+    """
+    rng = random.Random(ad_id)
+    state = ",".join('{{"id":{},"key":"{:032x}","value":"{}"}}'.format(i, rng.getrandbits(128), "x" * 40)
+                     for i in range(300))
+    gallery = "".join('<div class="photo-item"><img src="https://img.example/{}/{}.jpg" alt="photo {}"></div>'
+                      .format(ad_id, i, i) for i in range(photos))
+    description = "".join("<p>{}</p>".format(" ".join("opis{}".format(rng.randint(0, 999)) for _ in range(60)))
+                          for _ in range(20))
+    equipment = "".join('<li class="offer-features__item"><span>wyposazenie {}</span></li>'.format(i)
+                        for i in range(80))
+    return ('<!DOCTYPE html><html><head><meta charset="windows-1250"><title>ad {0}</title>'
+            '<script>window.__STATE__=[{1}];</script><script>if (a < b) {{ document.write("<div>"); }}</script>'
+            '</head><body><div class="offer-photos">{2}</div>{3}<div class="offer-description">{4}</div>'
+            '<ul class="offer-features">{5}</ul></body></html>').format(ad_id, state, gallery, ad_html, description,
+                                                                      equipment)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Otomoto stand-in serving generated listing pages (?page=N) and ad pages (/oferta/car-ID<n>.html)
+    """
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real site
+    ads_per_page = 32
+    pages = 10
+    latency = 0.0
+    template = None
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if "page=" in self.path:
+            body = self.listing_page(int(self.path.split("page=")[1]))
+        elif self.path.startswith("/oferta/"):
+            ad_id = int(self.path.split("-ID")[1].split(".")[0])
+            body = full_page(render_ad(self.template, ad_id), ad_id)
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode('cp1250', errors='replace')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=windows-1250")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def listing_page(self, page: int) -> str:
+        if page > self.pages:
+            return "<html><body></body></html>"
+        host = "http://{}:{}".format(*self.server.server_address)
+        first = (page - 1) * self.ads_per_page
+        links = ['<a class="offer-title__link" href="{}/oferta/car-ID{}.html">ad</a>'.format(host, ad_id)
+                 for ad_id in range(first, first + self.ads_per_page)]
+        pager = ['<li><a href="{}/osobowe/bench/car/?page={}">{}</a></li>'.format(host, number, number)
+                 for number in range(1, self.pages + 1)]
+        return '<html><body>{}<ul class="om-pager rel">{}</ul></body></html>'.format("".join(links), "".join(pager))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(object):
+
+    def __init__(self, pages: int = 10, ads_per_page: int = 32, latency: float = 0.0):
+        """
+        Local otomoto stand-in running in a background thread
+        :param pages: number of listing pages with ads, further pages are empty
+        :param ads_per_page: number of links on a listing page
+        :param latency: seconds every response is delayed by, simulates network round trip
+        """
+        handler = type('Handler', (StandInHandler,), dict(pages=pages, ads_per_page=ads_per_page, latency=latency,
+                                                          template=load_template()))
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def starting_url(self) -> str:
+        return "http://127.0.0.1:{}/osobowe/bench/car/".format(self.server.server_address[1])
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    with StandInServer(latency=0.01) as stand_in:
+        print("serving", stand_in.starting_url)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+
+class SeenAdIndex(object):
+
+    NEW = 'new'
+    UNCHANGED = 'unchanged'
+    UPDATED = 'updated'
+
+    AD_ID_PATTERN = re.compile(r'-ID(\w+)\.html')
+
+    def __init__(self, path: str = 'seen_ads.sqlite', max_age: float = None):
+        """
+        Persistent SQLite index of already crawled ads keyed by ad ID
+        :param path: database file, ':memory:' keeps the index only for lifetime of the object
+        :param max_age: ads seen less than max_age seconds ago are not requested again, None always requests them
+        """
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS ads (
+                    ad_id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    price INTEGER,
+                    currency TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    first_seen REAL NOT NULL,
+                    last_seen REAL NOT NULL
+                )""")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS price_updates (
+                    ad_id TEXT NOT NULL,
+                    old_price INTEGER,
+                    new_price INTEGER,
+                    currency TEXT,
+                    changed_at REAL NOT NULL
+                )""")
+
+    @staticmethod
+    def ad_id(url: str) -> str:
+        """
+        Method extract otomoto ad ID from its url (eg. ...-ID6B1aXz.html), falling back to the url without query
+        :param url: link to a car advertisement(offer)
+        :return: ad ID
+        """
+        match = SeenAdIndex.AD_ID_PATTERN.search(url)
+        if match:
+            return match.group(1)
+        return url.split('?')[0]
+
+    @staticmethod
+    def content_hash(car_details: dict) -> str:
+        return hashlib.sha256(json.dumps(car_details, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def should_fetch(self, url: str) -> bool:
+        """
+        Method check if ad was not seen within max_age seconds
+        :param url: link to a car advertisement(offer)
+        """
+        if self.max_age is None:
+            return True
+        row = self._fetch_one("SELECT last_seen FROM ads WHERE ad_id = ?", url)
+        return row is None or time.time() - row[0] > self.max_age
+
+    def conditional_headers(self, url: str) -> dict:
+        """
+        Method build If-None-Match/If-Modified-Since headers from validators returned by previous response
+        :param url: link to a car advertisement(offer)
+        :return: dict with conditional request headers, empty when ad was never seen
+        """
+        row = self._fetch_one("SELECT etag, last_modified FROM ads WHERE ad_id = ?", url)
+        headers = dict()
+        if row is not None:
+            if row[0]:
+                headers['If-None-Match'] = row[0]
+            if row[1]:
+                headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def touch(self, url: str):
+        """
+        Method mark ad as seen now without changes (eg. after 304 Not Modified response)
+        :param url: link to a car advertisement(offer)
+        """
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE ads SET last_seen = ? WHERE ad_id = ?", (time.time(), self.ad_id(url)))
+
+    def record(self, url: str, car_details: dict, headers=None) -> str:
+        """
+        Method save ad details hash and validators, price changes are kept in price_updates table
+        :param url: link to a car advertisement(offer)
+        :param car_details: dict with parsed car details
+        :param headers: response headers with ETag/Last-Modified validators
+        :return: SeenAdIndex.NEW, SeenAdIndex.UNCHANGED or SeenAdIndex.UPDATED
+        """
+        headers = headers or {}
+        ad_id = self.ad_id(url)
+        content_hash = self.content_hash(car_details)
+        price = car_details.get('price')
+        currency = car_details.get('currency')
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        now = time.time()
+
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT content_hash, price FROM ads WHERE ad_id = ?", (ad_id,)).fetchone()
+            if row is None:
+                self._connection.execute(
+                    "INSERT INTO ads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (ad_id, url, content_hash, price, currency, etag, last_modified, now, now))
+                return self.NEW
+
+            self._connection.execute(
+                "UPDATE ads SET url = ?, content_hash = ?, price = ?, currency = ?, etag = ?, last_modified = ?, "
+                "last_seen = ? WHERE ad_id = ?",
+                (url, content_hash, price, currency, etag, last_modified, now, ad_id))
+            if row[0] == content_hash:
+                return self.UNCHANGED
+            if row[1] != price:
+                self._connection.execute(
+                    "INSERT INTO price_updates VALUES (?, ?, ?, ?, ?)", (ad_id, row[1], price, currency, now))
+            return self.UPDATED
+
+    def forget(self, urls, since: float = 0) -> int:
+        """
+        Method remove ads first seen at or after given time, eg. ads recorded as new by a crawl whose rows were lost
+        :param urls: links to car advertisements(offers)
+        :param since: timestamp, ads seen before it are kept
+        :return: number of removed ads
+        """
+        with self._lock, self._connection:
+            return sum(self._connection.execute("DELETE FROM ads WHERE ad_id = ? AND first_seen >= ?",
+                                                (self.ad_id(url), since)).rowcount for url in urls)
+
+    def price_updates(self, url: str = None) -> list:
+        """
+        Method return recorded price changes
+        :param url: limit changes to single ad
+        :return: list of (ad_id, old_price, new_price, currency, changed_at) tuples
+        """
+        with self._lock:
+            if url is None:
+                return self._connection.execute("SELECT * FROM price_updates ORDER BY changed_at").fetchall()
+            return self._connection.execute(
+                "SELECT * FROM price_updates WHERE ad_id = ? ORDER BY changed_at", (self.ad_id(url),)).fetchall()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM ads").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def _fetch_one(self, query: str, url: str):
+        with self._lock:
+            return self._connection.execute(query, (self.ad_id(url),)).fetchone()
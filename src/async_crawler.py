@@ -0,0 +1,248 @@
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncCrawler(object):
+
+    def __init__(self, spider, concurrency: int = 20, per_host: int = 8, timeout: float = 30,
+                 buffer_size: int = 64):
+        """
+        :param spider: CarSpider instance which provides listing pages urls, extracts ad links and owns the parser
+        :param concurrency: maximum number of requests in flight
+        :param per_host: maximum number of simultaneous connections to a single host
+        :param timeout: total timeout of a single request in seconds
+        :param buffer_size: maximum number of links waiting for an ad worker
+        """
+        self.spider = spider
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self._semaphore = None
+
+    def run(self):
+        """
+        Method start event loop and block until all listing pages and ads are crawled
+        """
+        asyncio.run(self.crawl())
+
+    async def crawl(self):
+        """
+        Coroutine fetch listing pages concurrently and pass every found link through a bounded queue to ad workers,
+        which start fetching and saving ads while listing pages are still loading
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = {'User-agent': self.spider.session.user_agent}
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            links = asyncio.Queue(maxsize=self.buffer_size)
+            workers = [asyncio.create_task(self.ad_worker(session, links)) for _ in range(self.concurrency)]
+
+            # links pending in a checkpoint of resumed crawl go first
+            for link in self.spider.pending_links():
+                await links.put(link)
+
+            await self.crawl_listing(session, links)
+            print("cars list created")
+
+            await links.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def crawl_listing(self, session, links):
+        """
+        Coroutine crawl listing pages the way CarSpider.iter_car_ads does - the first page tells how many pages there
+        are, remaining ones are requested concurrently (all at once when the number is known, in windows of spider's
+        listing_workers pages otherwise) and their links are queued in page order until an empty page or a page
+        repeating an earlier one
+        :param session: aiohttp ClientSession
+        :param links: asyncio.Queue consumed by ad workers
+        """
+        urls = [] if self.spider._listing_done else self.spider.listing_page_urls()
+        seen_pages = set()
+        if urls:
+            page_links, page_count = await self.fetch_listing_page(session, urls[0])
+            if page_count is not None:
+                urls = urls[:max(page_count - self.spider._page_number + 1, 1)]
+            more = await self.queue_new_links(page_links, seen_pages, links)
+            position = 1
+            while more and position < len(urls):
+                size = len(urls) if page_count is not None else self.spider.listing_workers
+                window = urls[position:position + size]
+                results = await asyncio.gather(*[self.fetch_listing_page(session, url) for url in window])
+                for page_links, _ in results:
+                    more = await self.queue_new_links(page_links, seen_pages, links)
+                    if not more:
+                        break
+                position += len(window)
+        self.spider.record_listing_progress([], listing_done=True)
+
+    async def fetch_listing_page(self, session, url: str):
+        """
+        Coroutine fetch single listing page
+        :param session: aiohttp ClientSession
+        :param url: listing page url
+        :return: (links, page_count) tuple, see CarSpider.fetch_listing_page
+        """
+        html = await self.fetch(session, url)
+        if html is None:
+            return None, None
+
+        page_links, page_count = self.spider.parse_listing_page(html)
+        if 'page=' in url:
+            self.spider.metrics.inc('crawl_pages_total')
+            self.spider.metrics.inc('crawl_links_total', len(page_links))
+        return page_links, page_count
+
+    async def queue_new_links(self, page_links, seen_pages: set, links) -> bool:
+        """
+        Coroutine put links of a listing page not seen before into the queue
+        :param page_links: links from fetch_listing_page(), None when the page was not fetched
+        :param seen_pages: sets of links of listing pages crawled so far
+        :param links: asyncio.Queue consumed by ad workers
+        :return: False when the page is empty or repeats an earlier one - there are no more results
+        """
+        self.spider._page_number += 1
+        new_links = self.spider.new_links(page_links, seen_pages)
+        if new_links is None:
+            return False
+        self.spider.record_listing_progress(new_links)
+        for link in new_links:
+            await links.put(link)
+            self.spider.metrics.set_gauge('crawl_queue_depth', links.qsize(), queue='links')
+        return True
+
+    async def ad_worker(self, session, links):
+        """
+        Coroutine fetch ad pages taken from the queue and pass their HTML code to the spider's parser
+        :param session: aiohttp ClientSession
+        :param links: asyncio.Queue filled by listing pages
+        """
+        while True:
+            url = await links.get()
+            self.spider.metrics.set_gauge('crawl_queue_depth', links.qsize(), queue='links')
+            seen_index = self.spider.parser.seen_index
+            try:
+                headers = None
+                if seen_index is not None:
+                    if not seen_index.should_fetch(url):
+                        self.spider.metrics.inc('crawl_ads_total', result='seen_recently')
+                        continue
+                    headers = seen_index.conditional_headers(url)
+                status, content, encoding, response_headers = await self.fetch_response(session, url, headers)
+                if status == 304:
+                    self.spider.metrics.inc('crawl_ads_total', result='not_modified')
+                    seen_index.touch(url)
+                elif content is not None:
+                    self.spider.parser.save_car_details_from_content(content, encoding, url, response_headers)
+            except Exception as e:
+                # a dead worker would leave listing pages blocked on the full queue
+                self.spider.metrics.inc('crawl_failures_total', reason='unexpected_error')
+                print(url, e)
+            finally:
+                self.spider.ad_processed(url)
+                links.task_done()
+
+    async def fetch(self, session, url: str):
+        """
+        Coroutine request given url respecting concurrency limit
+        :param session: aiohttp ClientSession
+        :param url: url to request
+        :return: response text or None when request failed
+        """
+        status, content, encoding, _ = await self.fetch_response(session, url)
+        if content is None:
+            return None
+        return content.decode(encoding, errors='replace')
+
+    async def fetch_response(self, session, url: str, headers: dict = None):
+        """
+        Coroutine request given url respecting concurrency limit, response body is not decoded
+        :param session: aiohttp ClientSession
+        :param url: url to request
+        :param headers: additional request headers, eg. SeenAdIndex.conditional_headers()
+        :return: (status, content, encoding, headers) tuple, content is None when request failed (status is None
+        then) or ad was not modified (status 304)
+        """
+        cache = self.spider.session.cache
+        if cache is not None:
+            cached = cache.get(url)
+            if cached is not None:
+                return cached.status_code, cached.content, cached.encoding or 'utf-8', cached.headers
+
+        page = 'listing' if 'page=' in url else 'ad'
+        throttle = self.spider.session.throttle
+        with self.spider.metrics.timer('fetch_listing' if page == 'listing' else 'fetch'):
+            if throttle is None:
+                async with self._semaphore:
+                    try:
+                        async with session.get(url, headers=headers) as response:
+                            response.raise_for_status()
+                            content = await response.read()
+                            encoding = response.get_encoding() if response.status != 304 else None
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        self.failure(url, e)
+                        return None, None, None, None
+            else:
+                response, content, encoding = await self.throttled_fetch(session, url, throttle, headers)
+                if response is None:
+                    return None, None, None, None
+        if response.status == 304:
+            return response.status, None, None, response.headers
+        self.spider.metrics.inc('crawl_bytes_total', len(content), page=page)
+
+        if cache is not None:
+            cache.put(url, content, response.headers, response.status, encoding)
+        return response.status, content, encoding, response.headers
+
+    async def throttled_fetch(self, session, url: str, throttle, headers: dict = None):
+        """
+        Coroutine request given url within limits of spider session's AdaptiveThrottle (semaphore still bounds
+        concurrency from above), 429/503 responses are retried after throttle's pause
+        :return: (response, content, encoding) tuple, (None, None, None) when request failed
+        """
+        for attempt in range(self.spider.session.retries + 1):
+            async with self._semaphore:
+                started = await throttle.acquire_async()
+                try:
+                    async with session.get(url, headers=headers) as response:
+                        if response.status in throttle.BACKOFF_STATUSES:
+                            throttle.release(started, response.status, response.headers.get('Retry-After'))
+                            continue
+                        content = await response.read()
+                        encoding = response.get_encoding() if response.status != 304 else None
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    throttle.release(started, error=True)
+                    self.failure(url, e)
+                    return None, None, None
+                throttle.release(started, response.status)
+            if response.status >= 400:
+                self.failure(url, "{} {}".format(response.status, response.reason), "http_{}".format(response.status))
+                return None, None, None
+            return response, content, encoding
+        self.failure(url, "still throttled after {} attempts".format(attempt + 1), 'throttled')
+        return None, None, None
+
+    def failure(self, url: str, error, reason: str = None):
+        """
+        Method report failed request and count it in spider's metrics
+        :param url: requested url
+        :param error: exception or error message
+        :param reason: failure reason label, derived from exception type by default
+        """
+        if reason is None:
+            if isinstance(error, aiohttp.ClientResponseError):
+                reason = "http_{}".format(error.status)
+            elif isinstance(error, asyncio.TimeoutError):
+                reason = 'timeout'
+            else:
+                reason = 'connection_error'
+        self.spider.metrics.inc('crawl_failures_total', reason=reason)
+        print(url, error)
@@ -0,0 +1,164 @@
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def normalize(value):
+    """
+    Turn callback argument into hashable, canonical form - numpy scalars become python numbers, lists become tuples
+    and empty strings become None
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(item)) for key, item in value.items()))
+    if value == '':
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+class DiskCacheBackend(object):
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 ** 2):
+        """
+        Cache storage shared by several server workers through local disk, one file per key
+        :param directory: cache directory, created when missing
+        :param max_bytes: maximum size of cached values, least recently used files are removed above it
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + '.pickle')
+
+
+class CallbackCache(object):
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 ** 2, backend: DiskCacheBackend = None):
+        """
+        LRU cache of callback results bounded by number of entries and by size of pickled results
+        :param max_entries: maximum number of results kept in memory
+        :param max_bytes: maximum size of pickled results kept in memory
+        :param backend: optional shared storage (eg. DiskCacheBackend) checked on local misses
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key):
+        """
+        :return: (True, cached value) or (False, None) when key is not cached
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        if data is None and self.backend is not None:
+            data = self.backend.get(key)
+            if data is not None:
+                self._store(key, data)
+        if data is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, pickle.loads(data)
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._store(key, data)
+        if self.backend is not None:
+            self.backend.put(key, data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def memoize(self, version):
+        """
+        Decorator caching results of a callback by its normalized arguments and current dataset version
+        :param version: callable returning version of data the callback reads, results of older versions are not
+        returned after data changes
+        """
+        def decorator(callback):
+            @functools.wraps(callback)
+            def wrapper(*args):
+                key = (callback.__name__, version(), normalize(args))
+                found, value = self.get(key)
+                if found:
+                    return value
+                value = callback(*args)
+                self.put(key, value)
+                return value
+            return wrapper
+        return decorator
+
+    def _store(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = data
+            self._size += len(data)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
@@ -1,33 +1,213 @@
-import csv
+import threading
 
-from bs4 import BeautifulSoup
 import requests
 
+from .ad_index import SeenAdIndex
+from .crawl_metrics import CrawlMetrics, request_failure_reason
+from .csv_writer import BatchCsvWriter, normalize_row
+from .http_session import HttpSession
+from .parser_engines import BeautifulSoupEngine, MissingElement, get_engine
+from .region_extractor import extract_regions
+
 
 class CarParser(object):
 
-    def __init__(self, filename='cars.csv'):
-        self._file = open(filename, "a", newline='')
+    def __init__(self, filename='cars.csv', session: HttpSession = None, engine: str = 'bs4',
+                 seen_index: SeenAdIndex = None, batch_size: int = 100, flush_interval: float = 5.0,
+                 sinks: list = None, metrics: CrawlMetrics = None):
+        self._writer = BatchCsvWriter(filename, batch_size=batch_size, flush_interval=flush_interval)
+        self.sinks = list(sinks or [])
+        self._sinks_lock = threading.Lock()
+        self.session = session if session is not None else HttpSession()
+        self.engine = get_engine(engine)
+        self.seen_index = seen_index
+        self.metrics = metrics if metrics is not None else CrawlMetrics()
+
+    @property
+    def writer(self) -> BatchCsvWriter:
+        return self._writer
 
     def save_car_details_from_ad_page(self, url: str):
         """
         Method request given url and control process of parsing car data and saving it into .csv file
         :param url: link to a car advertisement(offer)
         """
-        r = requests.get(url)
-        soup = BeautifulSoup(r.text, "html.parser")
+        r = self.fetch_ad_page(url)
+        if r is not None:
+            self.save_car_details_from_content(r.content, r.encoding, url, r.headers)
+
+    def fetch_ad_page(self, url: str):
+        """
+        Method request given url. With seen_index ads seen recently are not requested at all and known ads are
+        requested conditionally with their ETag/Last-Modified validators.
+        :param url: link to a car advertisement(offer)
+        :return: requests Response object or None when request failed or ad did not change
+        """
+        headers = dict()
+        if self.seen_index is not None:
+            if not self.seen_index.should_fetch(url):
+                self.metrics.inc('crawl_ads_total', result='seen_recently')
+                return None
+            headers = self.seen_index.conditional_headers(url)
 
         try:
-            offer_parameters = CarParser.get_offer_parameters(soup)
-            price, currency = CarParser.get_price_and_currency(soup)
+            with self.metrics.timer('fetch'):
+                r = self.session.get(url, headers=headers)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            self.metrics.inc('crawl_failures_total', reason=request_failure_reason(e))
+            print(e)
+            return None
 
-            car_details = CarParser.parse_offer_parameters(offer_parameters)
-            car_details['price'] = price
-            car_details['currency'] = currency
+        if r.status_code == 304:
+            self.metrics.inc('crawl_ads_total', result='not_modified')
+            self.seen_index.touch(url)
+            return None
+        self.metrics.inc('crawl_bytes_total', len(r.content), page='ad')
+        return r
 
-            self.save_data_into_csv_file(car_details)
-        except (KeyError, AttributeError) as e:
+    def save_car_details_from_content(self, content: bytes, encoding: str = None, url: str = None, headers=None):
+        """
+        Method parse raw body of an offer page and save car data into .csv file. Only offer parameters and price
+        elements are decoded and parsed, the whole page is parsed only when they can't be located in raw bytes.
+        :param content: raw HTML code of a car advertisement(offer) page
+        :param encoding: response encoding, utf-8 when not known
+        :param url: link to the advertisement, needed to skip ads already present in seen_index
+        :param headers: response headers with validators stored in seen_index
+        """
+        with self.metrics.timer('locate'):
+            fragment = extract_regions(content)
+        car_details = None
+        if fragment is not None:
+            try:
+                with self.metrics.timer('parse'):
+                    document = self.engine.parse(fragment.decode(encoding or 'utf-8', errors='replace'))
+                with self.metrics.timer('extract'):
+                    car_details = CarParser.car_details_from_document(document, self.engine)
+            except (KeyError, AttributeError, ValueError):
+                car_details = None
+        if car_details is not None:
+            self.metrics.inc('crawl_extraction_total', path='regions')
+            self.save_car_details(car_details, url, headers)
+        else:
+            self.metrics.inc('crawl_extraction_total', path='full')
+            self.save_car_details_from_html(content.decode(encoding or 'utf-8', errors='replace'), url, headers)
+
+    def save_car_details_from_html(self, html: str, url: str = None, headers=None):
+        """
+        Method parse already fetched offer page and save car data into .csv file
+        :param html: HTML code of a car advertisement(offer) page
+        :param url: link to the advertisement, needed to skip ads already present in seen_index
+        :param headers: response headers with validators stored in seen_index
+        """
+        try:
+            with self.metrics.timer('parse'):
+                document = self.engine.parse(html)
+            with self.metrics.timer('extract'):
+                car_details = CarParser.car_details_from_document(document, self.engine)
+            self.save_car_details(car_details, url, headers)
+        except MissingElement as e:
+            self.metrics.inc('crawl_failures_total', reason='missing_' + e.region)
             print(e)
+        except KeyError as e:
+            self.metrics.inc('crawl_failures_total', reason='missing_details')
+            print(e)
+        except (AttributeError, ValueError) as e:
+            self.metrics.inc('crawl_failures_total', reason='malformed_offer')
+            print(e)
+
+    def save_car_details(self, car_details: dict, url: str = None, headers=None):
+        """
+        Method save parsed car details into .csv file and additional sinks (eg. parquet_sink.ParquetSink). When parser
+        has seen_index and url is given, only new ads are written - unchanged ads are skipped and changed ones
+        (eg. with new price) are recorded as updates in the index.
+        :param car_details: dict with parsed car details
+        :param url: link to the advertisement
+        :param headers: response headers with validators stored in seen_index
+        """
+        if self.seen_index is not None and url is not None:
+            status = self.seen_index.record(url, car_details, headers)
+            if status != SeenAdIndex.NEW:
+                self.metrics.inc('crawl_ads_total', result=status)
+                return
+        with self.metrics.timer('write'):
+            saved = self.save_data_into_csv_file(car_details, url)
+            if self.sinks:
+                row = normalize_row(car_details)
+                with self._sinks_lock:
+                    for sink in self.sinks:
+                        sink.write(row)
+        if saved:
+            self.metrics.inc('crawl_ads_total', result='saved')
+
+    def save_car_details_from_cache(self, cache):
+        """
+        Method rebuild car data from every ad page stored in a ResponseCache, without any network request.
+        Listing pages (urls with page= parameter) are skipped.
+        :param cache: ResponseCache filled during previous crawls
+        """
+        for response in cache.responses():
+            if 'page=' in response.url:
+                continue
+            self.save_car_details_from_content(response.content, response.encoding)
+
+    @staticmethod
+    def parse_car_details(html: str, engine=None) -> dict:
+        """
+        Method extract offer parameters and price from HTML code of an offer page using given parser engine
+        :param html: HTML code of a car advertisement(offer) page
+        :param engine: one of parser_engines engines, BeautifulSoupEngine by default
+        :return: dict with car details, price and currency
+        """
+        if engine is None:
+            engine = BeautifulSoupEngine()
+        return CarParser.car_details_from_document(engine.parse(html), engine)
+
+    @staticmethod
+    def parse_regions(content: bytes, encoding: str = None, engine=None):
+        """
+        Method extract car details from offer parameters and price elements cut out of raw offer page
+        :param content: raw HTML code of a car advertisement(offer) page
+        :param encoding: response encoding, utf-8 when not known
+        :param engine: one of parser_engines engines, BeautifulSoupEngine by default
+        :return: dict with car details, price and currency, None when regions were not found or are incomplete
+        """
+        fragment = extract_regions(content)
+        if fragment is None:
+            return None
+        try:
+            return CarParser.parse_car_details(fragment.decode(encoding or 'utf-8', errors='replace'), engine)
+        except (KeyError, AttributeError, ValueError):
+            return None
+
+    @staticmethod
+    def parse_car_details_from_content(content: bytes, encoding: str = None, engine=None) -> dict:
+        """
+        Method extract car details from raw offer page, parsing the whole page only when regions fast path fails
+        :param content: raw HTML code of a car advertisement(offer) page
+        :param encoding: response encoding, utf-8 when not known
+        :param engine: one of parser_engines engines, BeautifulSoupEngine by default
+        :return: dict with car details, price and currency
+        """
+        car_details = CarParser.parse_regions(content, encoding, engine)
+        if car_details is None:
+            car_details = CarParser.parse_car_details(content.decode(encoding or 'utf-8', errors='replace'), engine)
+        return car_details
+
+    @staticmethod
+    def car_details_from_document(document, engine) -> dict:
+        """
+        Method extract offer parameters and price from an offer page already parsed by given engine
+        :param document: tree returned by engine.parse()
+        :param engine: one of parser_engines engines
+        :return: dict with car details, price and currency
+        """
+        offer_parameters, price_tag, currency = engine.find(document)
+
+        car_details = CarParser.parse_offer_pairs(offer_parameters)
+        car_details['price'] = CarParser.parse_price_tag(price_tag)
+        car_details['currency'] = currency
+        return car_details
 
     @staticmethod
     def get_offer_parameters(soup):
@@ -81,6 +261,15 @@ class CarParser(object):
         :param offer_parameters: html tags containing car offer parameters
         :return: dict with car offer parameters
         """
+        return CarParser.parse_offer_pairs((param.span.text, param.div.text) for param in offer_parameters)
+
+    @staticmethod
+    def parse_offer_pairs(offer_parameters) -> dict:
+        """
+        Parse offer parameters texts into python dict
+        :param offer_parameters: iterable of (label, value) texts of offer parameters
+        :return: dict with car offer parameters
+        """
         car_details = dict()
         accepted_keys = [
             'marka_pojazdu',
@@ -91,11 +280,10 @@ class CarParser(object):
             'typ',
             'bezwypadkowy'
         ]
-        for param in offer_parameters:
-            label = CarParser.plain_text(param.span.text)
+        for label, value in offer_parameters:
+            label = CarParser.plain_text(label)
             if label in accepted_keys:
-                value = CarParser.plain_text(param.div.text)
-                car_details[label] = value
+                car_details[label] = CarParser.plain_text(value)
 
         car_details = CarParser.translate_dict_keys(car_details)
         return car_details
@@ -130,25 +318,33 @@ class CarParser(object):
 
         return car_details
 
-    def save_data_into_csv_file(self, car_details: dict):
+    def save_data_into_csv_file(self, car_details: dict, url: str = None):
         """
-        Write car_details dict as a row to a csv file
+        Write car_details dict as a row to a csv file. Rows are buffered and appended in batches, columns follow
+        csv_writer.FIELDNAMES.
         :param car_details:
+        :param url: link to the advertisement, reported with the row when it's flushed
+        :return: True when row was written
         """
         try:
-            fieldnames = list(car_details.keys())
-
-            writer = csv.DictWriter(self._file, fieldnames=fieldnames)
-            writer.writerow(car_details)
-        except (AttributeError, TypeError, FileNotFoundError) as e:
+            self._writer.write(car_details, url)
+            return True
+        except (AttributeError, TypeError, ValueError, OSError) as e:
+            self.metrics.inc('crawl_failures_total', reason='write_error')
             print(e)
+            return False
 
     @staticmethod
     def plain_text(text: str) -> str:
         return text.strip().replace(" ", "_").lower()
 
     def close_file(self):
+        """
+        Method flush buffered rows and close the file, data is fsynced to disk before returning
+        """
         try:
-            self._file.close()
+            self._writer.close()
+            for sink in self.sinks:
+                sink.close()
         except IOError:
             pass
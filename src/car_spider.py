@@ -1,20 +1,78 @@
+import argparse
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from bs4 import BeautifulSoup
 import requests
-from user_agent import generate_user_agent
 
+from .ad_index import SeenAdIndex
+from .async_crawler import AsyncCrawler, aiohttp
 from .car_ad_parser import CarParser
+from .crawl_checkpoint import CrawlCheckpoint
+from .crawl_metrics import CrawlMetrics, request_failure_reason
+from .http_session import HttpSession
+from .link_frontier import LinkFrontier
+from .parse_pool import ParsePoolCrawler
+from .rate_controller import AdaptiveThrottle
 
 
 class CarSpider(object):
+    PAGE_NUMBER = re.compile(r'[?&]page=(\d+)')
 
-    def __init__(self, starting_url: str, pages_limit: int):
+    def __init__(self, starting_url: str, pages_limit: int, filename: str = 'cars.csv', session: HttpSession = None,
+                 engine: str = 'bs4', seen_index: SeenAdIndex = None, metrics: CrawlMetrics = None,
+                 listing_workers: int = 4, checkpoint: CrawlCheckpoint = None):
         self.starting_url: str = self.parse_url(starting_url)
         self._car_name = None
         self._page_number = 1
         self._pages_limit = pages_limit
+        self._listing_done = False
+        self._pending = []
         self.set_car_name()
         self.car_ads_list = list()
-        self.parser = CarParser('cars.csv')
+        self.frontier = LinkFrontier()
+        self.listing_workers = listing_workers
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            # rows written after the last checkpoint are removed before the writer opens the file
+            checkpoint.start(self.starting_url, pages_limit, filename)
+            checkpoint.rollback_output()
+        self._owns_session = session is None
+        self.session = session if session is not None else HttpSession(throttle=AdaptiveThrottle())
+        self.metrics = metrics if metrics is not None else CrawlMetrics()
+        self.parser = CarParser(filename, self.session, engine, seen_index, metrics=self.metrics)
+        if checkpoint is not None:
+            self.restore(checkpoint)
+
+    @classmethod
+    def resume(cls, checkpoint: CrawlCheckpoint, **kwargs):
+        """
+        Method create spider continuing the crawl recorded in a checkpoint: listing pages are requested from the
+        first one not done, ads found but not completed are crawled first and ads completed are skipped
+        :param checkpoint: CrawlCheckpoint of an interrupted crawl
+        :param kwargs: other CarSpider arguments, eg. engine or session
+        :return: CarSpider instance
+        """
+        state = checkpoint.state()
+        if state is None:
+            raise ValueError("Checkpoint {} has no crawl to resume".format(checkpoint.path))
+        return cls(state['starting_url'], state['pages_limit'], state['filename'], checkpoint=checkpoint, **kwargs)
+
+    def restore(self, checkpoint: CrawlCheckpoint):
+        """
+        Method load crawl progress from a checkpoint and make parser's flushed rows complete their ads
+        """
+        state = checkpoint.state()
+        self._page_number = state['page_number']
+        self._listing_done = state['listing_done']
+        self._pending = checkpoint.pending()
+        if self.parser.seen_index is not None:
+            # pending ads recorded as new by this crawl had their rows rolled back, they have to be written again
+            self.parser.seen_index.forget(self._pending, since=state.get('started_at', 0))
+        self.frontier.add_new(checkpoint.known())
+        checkpoint.attach(self.parser.writer)
 
     def set_car_name(self):
         """
@@ -23,36 +81,164 @@ class CarSpider(object):
         chunks = self.starting_url.split('/')
         self.car_name = '_'.join(chunks[-3:-1])
 
-    def add_links_from_page_to_list(self, request):
+    def add_links_from_page_to_list(self, request, sink=None):
         """
         Method parse HTML code from starting page and extract link to listed offers and fill car_ads_list with them
         :param request: requests get object - request = requests.get(self.starting_url)
+        :param sink: callable receiving every extracted link, by default links are appended to car_ads_list
+        """
+        self.add_links_from_html(request.text, sink)
+
+    def add_links_from_html(self, html: str, sink=None):
+        """
+        Method extract links to listed offers from HTML code of a listing page and hand each of them to the sink
+        :param html: HTML code of a page listing car offers
+        :param sink: callable receiving every extracted link, by default links are appended to car_ads_list
         """
-        soup = BeautifulSoup(request.text, "html.parser")
-        tags = soup('a', {'class': 'offer-title__link'})
-        for tag in tags:
+        if sink is None:
+            sink = self.car_ads_list.append
+
+        links, _ = self.parse_listing_page(html)
+        for link in links:
             try:
-                self.car_ads_list.append(tag.get('href'))
+                sink(link)
             except Exception:
                 continue
 
-    def get_car_ads_list(self):
+    def parse_listing_page(self, html: str):
         """
-        Method send get request to a number (pages_limit variable) pages listing car offers and fetch requests object
-        which are passed to a add_links_from_page_to_list() method
+        Method extract links to listed offers and number of listing pages from HTML code of a listing page
+        :param html: HTML code of a page listing car offers
+        :return: list of links and the highest page number found in pagination links (None when page has no
+        pagination)
         """
-        base_url: str = self.starting_url[:-1]
-        while self._page_number <= self._pages_limit:
-            ad_url = base_url + str(self._page_number)
-            print("link: ", ad_url)
-            user_agent = str(generate_user_agent(os=('mac', 'linux', 'win')))
-            r = requests.get(ad_url, headers={'User-agent': user_agent})
+        soup = BeautifulSoup(html, "html.parser")
+        links = [tag.get('href') for tag in soup('a', {'class': 'offer-title__link'}) if tag.get('href')]
+        page_numbers = [int(self.PAGE_NUMBER.search(tag['href']).group(1)) for tag in soup('a', href=self.PAGE_NUMBER)]
+        return links, max(page_numbers, default=None)
 
-            self.add_links_from_page_to_list(r)
+    def fetch_listing_page(self, page: int):
+        """
+        Method request listing page with given number
+        :param page: listing page number
+        :return: list of links and number of listing pages as returned by parse_listing_page(), (None, None) when
+        request failed
+        """
+        url = self.starting_url[:-1] + str(page)
+        print("link: ", url)
+        try:
+            with self.metrics.timer('fetch_listing'):
+                r = self.session.get(url)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            self.metrics.inc('crawl_failures_total', reason=request_failure_reason(e))
+            print(e)
+            return None, None
+
+        self.metrics.inc('crawl_pages_total')
+        self.metrics.inc('crawl_bytes_total', len(r.content), page='listing')
+        links, page_count = self.parse_listing_page(r.text)
+        self.metrics.inc('crawl_links_total', len(links))
+        return links, page_count
 
-            self._page_number += 1
+    def new_links(self, links, seen_pages: set):
+        """
+        Method pass links found on a listing page through the frontier
+        :param links: links from fetch_listing_page(), None when the page was not fetched
+        :param seen_pages: sets of links of listing pages crawled so far
+        :return: links not seen before, None when the page is empty or repeats an earlier one - there are no more
+        results
+        """
+        if links is None:
+            return []
+        page = frozenset(links)
+        if not page or page in seen_pages:
+            return None
+        seen_pages.add(page)
+        new_links = self.frontier.add_new(links)
+        self.metrics.inc('crawl_duplicate_links_total', len(links) - len(new_links))
+        return new_links
+
+    def pending_links(self) -> list:
+        """
+        :return: links restored from a checkpoint which were not crawled yet, each of them is returned once
+        """
+        pending, self._pending = self._pending, []
+        return pending
+
+    def record_listing_progress(self, links: list, listing_done: bool = False):
+        """
+        Method store links found on listing pages in the checkpoint before they are crawled
+        :param links: new links to offers
+        :param listing_done: True when there are no more listing pages
+        """
+        self._listing_done = self._listing_done or listing_done
+        if self.checkpoint is not None:
+            self.checkpoint.pages_done(self._page_number, links, self._listing_done)
+
+    def ad_processed(self, link: str):
+        """
+        Method mark ad as crawled in the checkpoint, its row counts once it's flushed
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.processed(link)
+
+    def iter_car_ads(self):
+        """
+        Generator yielding links to offers as soon as listing pages are parsed. The first listing page tells how many
+        pages there are, remaining ones (up to pages_limit) are requested concurrently by listing_workers threads -
+        all at once when the number of pages is known, in windows of listing_workers pages otherwise. Links are
+        yielded in page order and only once; crawl stops at an empty page or a page repeating an earlier one.
+        Resumed crawl yields links pending in the checkpoint first.
+        """
+        yield from self.pending_links()
+        seen_pages = set()
+        last_page = self._pages_limit
+        if self._listing_done or self._page_number > last_page:
+            self.record_listing_progress([], listing_done=True)
+            return
+
+        links, page_count = self.fetch_listing_page(self._page_number)
+        self._page_number += 1
+        if page_count is not None:
+            last_page = min(last_page, page_count)
+        page_links = self.new_links(links, seen_pages)
+        self.record_listing_progress(page_links or [], page_links is None or self._page_number > last_page)
+        if page_links is None:
+            return
+        yield from page_links
+
+        with ThreadPoolExecutor(self.listing_workers) as executor:
+            while self._page_number <= last_page:
+                window_end = last_page
+                if page_count is None:
+                    window_end = min(last_page, self._page_number + self.listing_workers - 1)
+                pages = range(self._page_number, window_end + 1)
+                for links, _ in executor.map(self.fetch_listing_page, pages):
+                    self._page_number += 1
+                    page_links = self.new_links(links, seen_pages)
+                    self.record_listing_progress(page_links or [],
+                                                 page_links is None or self._page_number > last_page)
+                    if page_links is None:
+                        return
+                    yield from page_links
+
+    def get_car_ads_list(self):
+        """
+        Method request pages listing car offers (up to pages_limit, fewer when there are less results) and fill
+        car_ads_list with links to offers, each link is added once
+        """
+        self.car_ads_list.extend(self.iter_car_ads())
         print("cars list created")
 
+    def listing_page_urls(self) -> list:
+        """
+        Method build urls of listing pages which are left to crawl (from current page number up to pages_limit)
+        :return: list of listing pages urls
+        """
+        base_url: str = self.starting_url[:-1]
+        return [base_url + str(page) for page in range(self._page_number, self._pages_limit + 1)]
+
     def crawl(self):
         """
         Method crawl each site in car_ads_list collection
@@ -62,9 +248,88 @@ class CarSpider(object):
         if len(self.car_ads_list) > 0:
             for link in self.car_ads_list:
                 self.parser.save_car_details_from_ad_page(link)
+                self.ad_processed(link)
         else:
             print("You need to call method 'add_links_from_page_to_list' to collect list of links to crawl.")
-        self.parser.close_file()
+        self.finish_crawl()
+
+    def crawl_streaming(self, workers: int = 4, buffer_size: int = 64):
+        """
+        Method crawl ads while listing pages are still being requested. Links flow through a bounded queue, so the
+        listing thread waits whenever ad workers fall behind and car_ads_list is never built.
+        :param workers: number of threads fetching and parsing ads
+        :param buffer_size: maximum number of links waiting in the queue
+        """
+        links = queue.Queue(maxsize=buffer_size)
+
+        def produce_links():
+            try:
+                for link in self.iter_car_ads():
+                    links.put(link)
+                    self.metrics.set_gauge('crawl_queue_depth', links.qsize(), queue='links')
+            finally:
+                for _ in range(workers):
+                    links.put(None)
+
+        def consume_links():
+            while True:
+                link = links.get()
+                self.metrics.set_gauge('crawl_queue_depth', links.qsize(), queue='links')
+                if link is None:
+                    return
+                try:
+                    self.parser.save_car_details_from_ad_page(link)
+                except Exception as e:
+                    # a dead worker would leave the listing thread blocked on the full queue
+                    self.metrics.inc('crawl_failures_total', reason='unexpected_error')
+                    print(link, e)
+                self.ad_processed(link)
+
+        threads = [threading.Thread(target=produce_links)]
+        threads.extend(threading.Thread(target=consume_links) for _ in range(workers))
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.finish_crawl()
+
+    def crawl_parallel(self, parse_workers: int = None, fetch_workers: int = 8, buffer_size: int = 64):
+        """
+        Method crawl ads with HTML parsing moved to a pool of worker processes, so parsing throughput scales with the
+        number of cores while this process only fetches and writes rows
+        :param parse_workers: number of parsing processes, number of CPUs by default
+        :param fetch_workers: number of threads fetching ads
+        :param buffer_size: maximum number of ads being fetched or parsed at once
+        """
+        crawler = ParsePoolCrawler(self, parse_workers=parse_workers, fetch_workers=fetch_workers,
+                                   buffer_size=buffer_size)
+        try:
+            crawler.run()
+        finally:
+            self.finish_crawl()
+
+    def crawl_async(self, concurrency: int = 20, per_host: int = 8, timeout: float = 30, buffer_size: int = 64):
+        """
+        Method crawl listing pages and ads concurrently with asyncio. Falls back to sequential crawl() when aiohttp
+        is not installed.
+        :param concurrency: maximum number of requests in flight
+        :param per_host: maximum number of simultaneous connections to a single host
+        :param timeout: total timeout of a single request in seconds
+        :param buffer_size: maximum number of links waiting for an ad worker
+        """
+        if aiohttp is None:
+            print("aiohttp is not installed, falling back to sequential crawl")
+            self.crawl()
+            return
+
+        crawler = AsyncCrawler(self, concurrency=concurrency, per_host=per_host, timeout=timeout,
+                               buffer_size=buffer_size)
+        try:
+            crawler.run()
+        finally:
+            self.finish_crawl()
 
     @property
     def car_name(self):
@@ -81,6 +346,22 @@ class CarSpider(object):
     def close_csv_file_in_parser(self):
         self.parser.close_file()
 
+    def finish_crawl(self):
+        """
+        Method flush and close the csv file, write the final checkpoint and close the session
+        """
+        self.parser.close_file()
+        if self.checkpoint is not None:
+            self.checkpoint.save()
+        self.close_session()
+
+    def close_session(self):
+        """
+        Method close pooled connections of a session created by the spider, sessions passed in are left open
+        """
+        if self._owns_session:
+            self.session.close()
+
     @staticmethod
     def parse_url(car_type_url: str) -> str:
         try:
@@ -90,6 +371,40 @@ class CarSpider(object):
         except ValueError:
             return car_type_url + "?page=1"
 
-# for url in url_list:
-#     spider = CarSpider(url, 5)
-#     spider.crawl()
+
+CRAWL_METHODS = ('crawl', 'crawl_streaming', 'crawl_parallel', 'crawl_async')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl otomoto ads of a single car model into a csv file")
+    parser.add_argument('url', nargs='?', help="listing url, eg. https://www.otomoto.pl/osobowe/audi/s3/")
+    parser.add_argument('--pages', type=int, default=5, help="maximum number of listing pages")
+    parser.add_argument('--output', default='cars.csv', help="csv file rows are appended to")
+    parser.add_argument('--method', choices=CRAWL_METHODS, default='crawl_streaming', help="CarSpider crawl method")
+    parser.add_argument('--checkpoint', default=None, help="SQLite file crawl progress is saved to")
+    parser.add_argument('--resume', metavar='CHECKPOINT', default=None,
+                        help="continue crawl interrupted while saving progress to the checkpoint")
+    args = parser.parse_args(argv)
+
+    if args.resume is not None:
+        checkpoint = CrawlCheckpoint(args.resume)
+        spider = CarSpider.resume(checkpoint)
+    elif args.url is not None:
+        checkpoint = CrawlCheckpoint(args.checkpoint) if args.checkpoint else None
+        spider = CarSpider(args.url, args.pages, args.output, checkpoint=checkpoint)
+    else:
+        parser.error("url or --resume is required")
+
+    try:
+        getattr(spider, args.method)()
+        if checkpoint is not None and checkpoint.finished:
+            print("crawl finished, checkpoint {} is no longer needed".format(checkpoint.path))
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+if __name__ == '__main__':
+    main()
+
+# many car models are crawled in parallel by crawl_scheduler: python -m src.crawl_scheduler URL [URL ...]
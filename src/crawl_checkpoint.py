@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class CrawlCheckpoint(object):
+
+    PENDING = 'pending'
+    COMPLETED = 'completed'
+
+    def __init__(self, path: str = 'crawl_checkpoint.sqlite'):
+        """
+        Crash safe SQLite record of crawl progress - next listing page to request, links to ads waiting to be crawled
+        and ads already completed. An ad which produced a row is completed only when the row is flushed to the csv
+        file, together with the file size at that moment, so after a crash rows written past the last checkpoint
+        can be cut off and their ads crawled again without duplicates.
+        :param path: database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._processed = []
+        self._writer = None
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA synchronous = FULL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS crawl (
+                    key TEXT PRIMARY KEY,
+                    value
+                )""")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS ads (
+                    url TEXT PRIMARY KEY,
+                    state TEXT NOT NULL
+                )""")
+
+    def start(self, starting_url: str, pages_limit: int, filename: str):
+        """
+        Method record parameters of a new crawl, nothing changes when checkpoint already holds the same crawl
+        :raise ValueError: when checkpoint belongs to a crawl of another url or output file
+        """
+        state = self.state()
+        if state is not None:
+            if (state['starting_url'], os.path.abspath(state['filename'])) != (starting_url,
+                                                                               os.path.abspath(filename)):
+                raise ValueError("Checkpoint {} belongs to crawl of {} into {}".format(
+                    self.path, state['starting_url'], state['filename']))
+            return
+        output_size = os.path.getsize(filename) if os.path.isfile(filename) else 0
+        self._set(starting_url=starting_url, pages_limit=pages_limit, filename=filename, page_number=1,
+                  listing_done=0, output_size=output_size, started_at=time.time())
+
+    def state(self):
+        """
+        :return: dict with starting_url, pages_limit, filename, page_number (next listing page), listing_done,
+        output_size (csv file size covered by completed ads) and started_at timestamp, None when no crawl was started
+        """
+        with self._lock:
+            rows = dict(self._connection.execute("SELECT key, value FROM crawl").fetchall())
+        if not rows:
+            return None
+        rows['listing_done'] = bool(rows['listing_done'])
+        return rows
+
+    @property
+    def finished(self) -> bool:
+        state = self.state()
+        return state is not None and state['listing_done'] and not self.pending()
+
+    def attach(self, writer):
+        """
+        Method make rows flushed by the writer complete their ads
+        :param writer: csv_writer.BatchCsvWriter with ad urls passed as row keys
+        """
+        self._writer = writer
+        writer.on_flush = self.flushed
+
+    def pages_done(self, page_number: int, links, listing_done: bool = False):
+        """
+        Method record links found on listing pages up to page_number, they are stored before being crawled
+        :param page_number: next listing page to request
+        :param links: new links to ads
+        :param listing_done: True when there are no more listing pages
+        """
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO ads VALUES (?, ?)",
+                                         ((link, self.PENDING) for link in links))
+            self._connection.executemany("REPLACE INTO crawl VALUES (?, ?)",
+                                         (('page_number', page_number), ('listing_done', int(listing_done))))
+
+    def processed(self, url: str):
+        """
+        Method mark ad as crawled. Ads with a row waiting in the writer's buffer are completed by the flush, others
+        (failed, unchanged) are completed with the next checkpoint.
+        :param url: link to a car advertisement(offer)
+        """
+        if self._writer is not None and self._writer.is_buffered(url):
+            return
+        with self._lock:
+            self._processed.append(url)
+
+    def flushed(self, urls: list, output_size: int):
+        """
+        Writer's on_flush callback, called after buffered rows were written and synced to disk
+        :param urls: keys of flushed rows
+        :param output_size: csv file size after the flush
+        """
+        self.save(urls, output_size)
+
+    def save(self, urls=(), output_size: int = None):
+        """
+        Method write checkpoint - complete given ads and all ads processed without a row since the last checkpoint
+        """
+        with self._lock, self._connection:
+            completed = list(urls) + self._processed
+            self._processed = []
+            self._connection.executemany("REPLACE INTO ads VALUES (?, ?)",
+                                         ((url, self.COMPLETED) for url in completed if url is not None))
+            if output_size is not None:
+                self._connection.execute("REPLACE INTO crawl VALUES ('output_size', ?)", (output_size,))
+
+    def pending(self) -> list:
+        """
+        :return: links to ads found on listing pages and not completed yet, in order they were found
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT url FROM ads WHERE state = ? ORDER BY rowid",
+                                            (self.PENDING,)).fetchall()
+        return [url for url, in rows]
+
+    def known(self) -> list:
+        """
+        :return: all links to ads found so far, pending and completed
+        """
+        with self._lock:
+            return [url for url, in self._connection.execute("SELECT url FROM ads ORDER BY rowid")]
+
+    def rollback_output(self) -> int:
+        """
+        Method cut rows written after the last checkpoint off the csv file, their ads are still pending
+        :return: number of bytes removed
+        """
+        state = self.state()
+        if state is None or not os.path.isfile(state['filename']):
+            return 0
+        size = os.path.getsize(state['filename'])
+        if size <= state['output_size']:
+            return 0
+        with open(state['filename'], 'r+b') as csv_file:
+            csv_file.truncate(state['output_size'])
+            os.fsync(csv_file.fileno())
+        return size - state['output_size']
+
+    def close(self):
+        self.save()
+        self._connection.close()
+
+    def _set(self, **values):
+        with self._lock, self._connection:
+            self._connection.executemany("REPLACE INTO crawl VALUES (?, ?)", values.items())
@@ -0,0 +1,291 @@
+import collections
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+
+def metric_key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def render_key(key: tuple, suffix: str = '') -> str:
+    """
+    :return: metric name with labels in Prometheus notation, eg. crawl_failures_total{reason="missing_price"}
+    """
+    name, labels = key
+    if not labels:
+        return name + suffix
+    rendered = ",".join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for label, value in labels)
+    return "{}{}{{{}}}".format(name, suffix, rendered)
+
+
+def request_failure_reason(error) -> str:
+    """
+    :param error: requests.RequestException raised while fetching a page
+    :return: failure reason label, eg. 'http_404', 'timeout' or 'connection_error'
+    """
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return "http_{}".format(response.status_code)
+    if isinstance(error, requests.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.ConnectionError):
+        return 'connection_error'
+    return 'request_error'
+
+
+class CrawlMetrics(object):
+
+    def __init__(self):
+        """
+        Thread safe registry of crawl counters, gauges and stage timers, cheap enough to be always on
+        """
+        self.started = time.time()
+        self._counters = collections.defaultdict(float)
+        self._gauges = dict()
+        self._timers = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Method increase a counter, eg. metrics.inc('crawl_failures_total', reason='missing_price')
+        """
+        key = metric_key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[metric_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Method record duration of a single operation, timers keep count, sum and maximum
+        """
+        key = metric_key(name, labels)
+        with self._lock:
+            count, total, maximum = self._timers.get(key, (0, 0.0, 0.0))
+            self._timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        """
+        Context manager timing a crawl stage (fetch, parse, extract, write...), failed attempts are timed too
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('crawl_stage_seconds', time.perf_counter() - started, stage=stage)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(metric_key(name, labels), 0)
+
+    def gauge(self, name: str, **labels):
+        with self._lock:
+            return self._gauges.get(metric_key(name, labels))
+
+    def timing(self, name: str, **labels) -> tuple:
+        """
+        :return: (count, sum, max) of recorded durations
+        """
+        with self._lock:
+            return self._timers.get(metric_key(name, labels), (0, 0.0, 0.0))
+
+    def snapshot(self) -> dict:
+        """
+        :return: JSON serializable copy of all metrics keyed by names with labels
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timers = dict(self._timers)
+        return dict(
+            time=time.time(),
+            uptime=time.time() - self.started,
+            counters={render_key(key): value for key, value in sorted(counters.items())},
+            gauges={render_key(key): value for key, value in sorted(gauges.items())},
+            timers={render_key(key): dict(count=count, sum=total, max=maximum)
+                    for key, (count, total, maximum) in sorted(timers.items())},
+        )
+
+    def to_prometheus(self) -> str:
+        """
+        :return: metrics in Prometheus text exposition format, timers are exported as summaries
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            timers = sorted(self._timers.items())
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} {}".format(name, kind))
+
+        for key, value in counters:
+            declare(key[0], 'counter')
+            lines.append("{} {}".format(render_key(key), value))
+        for key, value in gauges:
+            declare(key[0], 'gauge')
+            lines.append("{} {}".format(render_key(key), value))
+        for key, (count, total, maximum) in timers:
+            declare(key[0], 'summary')
+            lines.append("{} {}".format(render_key(key, '_count'), count))
+            lines.append("{} {}".format(render_key(key, '_sum'), total))
+        for key, (count, total, maximum) in timers:
+            declare(key[0] + '_max', 'gauge')
+            lines.append("{} {}".format(render_key(key, '_max'), maximum))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, output_format: str = None):
+        """
+        Method atomically write metrics to a file, eg. for node_exporter textfile collector
+        :param path: output file
+        :param output_format: 'prometheus' or 'json', by default chosen by file extension (.json means json)
+        """
+        if output_format is None:
+            output_format = 'json' if path.endswith('.json') else 'prometheus'
+        text = json.dumps(self.snapshot(), indent=2) if output_format == 'json' else self.to_prometheus()
+        write_atomically(path, text)
+
+
+def write_atomically(path: str, text: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_path, path)
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, interval: float = 0.01):
+        """
+        Statistical profiler sampling stacks of all other threads every interval seconds, results are collapsed
+        stacks ready for flamegraph.pl or speedscope
+        :param interval: seconds between samples
+        """
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def collapsed(self) -> str:
+        """
+        :return: one "frame;frame;frame count" line per sampled stack, outermost frame first
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "".join("{} {}\n".format(stack, count) for stack, count in stacks)
+
+    def top(self, n: int = 10) -> list:
+        """
+        :return: n functions most often found on top of sampled stacks with their number of samples
+        """
+        leaves = collections.Counter()
+        with self._lock:
+            for stack, count in self._stacks.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                        frame = frame.f_back
+                    self._stacks[";".join(reversed(stack))] += 1
+
+
+class MetricsExporter(object):
+
+    def __init__(self, metrics: CrawlMetrics, path: str, interval: float = 10.0, output_format: str = None,
+                 profiler: SamplingProfiler = None):
+        """
+        Background thread writing metrics snapshots to a file every interval seconds during a crawl, and once more
+        when stopped. With a profiler, collapsed stacks are written next to metrics (path + '.stacks').
+        :param metrics: CrawlMetrics of a spider
+        :param path: output file, .json for JSON snapshots, Prometheus text otherwise
+        :param interval: seconds between snapshots
+        :param output_format: 'prometheus' or 'json', chosen by file extension by default
+        :param profiler: optional SamplingProfiler started and stopped with the exporter
+        """
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.output_format = output_format
+        self.profiler = profiler
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.profiler is not None:
+            self.profiler.start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.profiler is not None:
+            self.profiler.stop()
+        self.export()
+
+    def export(self):
+        try:
+            self.metrics.write(self.path, self.output_format)
+            if self.profiler is not None:
+                write_atomically(self.path + '.stacks', self.profiler.collapsed())
+        except OSError as e:
+            print(e)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
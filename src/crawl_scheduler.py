@@ -0,0 +1,200 @@
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+
+import requests
+
+from .ad_index import SeenAdIndex
+from .car_spider import CarSpider
+from .csv_writer import FIELDNAMES, BatchCsvWriter
+from .http_session import HttpSession
+from .rate_controller import AdaptiveThrottle
+
+
+def crawl_worker(tasks, shard: str, pages_limit: int, engine: str = 'bs4', crawl_method: str = 'crawl'):
+    """
+    Worker process loop - take starting urls from the queue until None arrives and crawl each of them into own shard
+    :param tasks: multiprocessing queue with starting urls
+    :param shard: csv file written only by this worker
+    :param pages_limit: number of listing pages crawled for every starting url
+    :param engine: parser_engines name used by spiders
+    :param crawl_method: name of CarSpider method crawling a single starting url, eg. 'crawl_streaming'
+    """
+    session = HttpSession(throttle=AdaptiveThrottle())
+    try:
+        while True:
+            url = tasks.get()
+            if url is None:
+                return
+            try:
+                spider = CarSpider(url, pages_limit, shard, session=session, engine=engine)
+                spider.parser.writer.on_flush = ad_ids_recorder(shard)
+                getattr(spider, crawl_method)()
+            except (requests.RequestException, OSError, ValueError) as e:
+                print(e)
+    finally:
+        session.close()
+
+
+class CrawlScheduler(object):
+
+    def __init__(self, starting_urls: list, pages_limit: int = 5, workers: int = None, output: str = 'cars.csv',
+                 shard_directory: str = 'shards', engine: str = 'bs4', crawl_method: str = 'crawl'):
+        """
+        Scheduler spreading starting urls (one per car make and model) over worker processes through a work queue.
+        Every worker writes its own csv shard, shards are merged into output file with duplicates removed.
+        :param starting_urls: urls of otomoto listings, eg. https://www.otomoto.pl/osobowe/audi/a4/
+        :param pages_limit: number of listing pages crawled for every starting url
+        :param workers: number of crawling processes, number of CPUs by default
+        :param output: canonical csv dataset, merged rows are appended to it
+        :param shard_directory: directory with worker shards
+        :param engine: parser_engines name used by spiders
+        :param crawl_method: name of CarSpider method crawling a single starting url
+        """
+        self.starting_urls = list(starting_urls)
+        self.pages_limit = pages_limit
+        self.workers = workers or os.cpu_count() or 1
+        self.output = output
+        self.shard_directory = shard_directory
+        self.engine = engine
+        self.crawl_method = crawl_method
+
+    def shard_path(self, worker: int) -> str:
+        return os.path.join(self.shard_directory, "cars-{}.csv".format(worker))
+
+    def run(self) -> int:
+        """
+        Method crawl all starting urls in worker processes and merge their shards
+        :return: number of rows added to output file
+        """
+        self.crawl()
+        return merge_shards(self.shards(), self.output, remove=True)
+
+    def crawl(self):
+        """
+        Method start worker processes, queue starting urls followed by one stop marker per worker and wait for them
+        """
+        os.makedirs(self.shard_directory, exist_ok=True)
+        workers = min(self.workers, len(self.starting_urls))
+        tasks = multiprocessing.Queue()
+        for url in self.starting_urls:
+            tasks.put(url)
+        for _ in range(workers):
+            tasks.put(None)
+
+        processes = [
+            multiprocessing.Process(target=crawl_worker, args=(tasks, self.shard_path(worker), self.pages_limit,
+                                                               self.engine, self.crawl_method))
+            for worker in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                print("crawl worker {} exited with code {}".format(process.pid, process.exitcode))
+
+    def shards(self) -> list:
+        return sorted(glob.glob(os.path.join(self.shard_directory, "cars-*.csv")))
+
+
+def ad_ids_path(csv_path: str) -> str:
+    """
+    :return: path of the file listing ad IDs of rows appended to given csv file, one per line in the same order
+    """
+    return csv_path + '.ids'
+
+
+def ad_ids_recorder(csv_path: str):
+    """
+    :return: BatchCsvWriter.on_flush callback appending ad IDs of flushed rows (written with ad urls as keys) to
+    ad_ids_path(csv_path), rows without url get an empty line
+    """
+    def record(keys: list, output_size: int):
+        with open(ad_ids_path(csv_path), 'a') as ids_file:
+            ids_file.writelines((SeenAdIndex.ad_id(key) if key else '') + '\n' for key in keys)
+    return record
+
+
+def read_ad_ids(csv_path: str, rows: int = None) -> list:
+    """
+    :param rows: number of csv rows, IDs are ignored when they don't match them
+    :return: ad ID of every row of csv file ('' when unknown), empty list when file has no IDs
+    """
+    try:
+        with open(ad_ids_path(csv_path)) as ids_file:
+            ad_ids = ids_file.read().splitlines()
+    except FileNotFoundError:
+        return []
+    if rows is not None and len(ad_ids) != rows:
+        print("ignoring {}: {} IDs for {} rows".format(ad_ids_path(csv_path), len(ad_ids), rows))
+        return []
+    return ad_ids
+
+
+def merge_shards(shards: list, output: str, encoding: str = 'cp1250', remove: bool = False) -> int:
+    """
+    Append rows of csv shards to output file skipping ads which are already there or repeated in shards (the same
+    ad is often listed under several starting urls). Ads are identified by IDs recorded next to every shard by
+    crawl workers and kept next to output file, so distinct ads with equal details are all kept. Rows with
+    unknown ID are always appended.
+    :param shards: csv files with FIELDNAMES header
+    :param output: canonical csv dataset, created when missing
+    :param encoding: encoding of shards and output file
+    :param remove: remove shards (and their IDs) after merging
+    :return: number of rows added to output file
+    """
+    seen = set(read_ad_ids(output))
+    seen.discard('')
+
+    writer = BatchCsvWriter(output, encoding=encoding, batch_size=1000)
+    # rows are written with their ad IDs as keys, SeenAdIndex.ad_id() returns an ID unchanged
+    writer.on_flush = ad_ids_recorder(output)
+    added = 0
+    merged = []
+    try:
+        for shard in shards:
+            with open(shard, newline='', encoding=encoding) as csv_file:
+                reader = csv.reader(csv_file)
+                header = next(reader, None)
+                if header != FIELDNAMES:
+                    print("skipping {}: unexpected header {}".format(shard, header))
+                    continue
+                rows = list(reader)
+            ad_ids = read_ad_ids(shard, len(rows)) or [''] * len(rows)
+            for row, ad_id in zip(rows, ad_ids):
+                if ad_id:
+                    if ad_id in seen:
+                        continue
+                    seen.add(ad_id)
+                writer.write(dict(zip(FIELDNAMES, row)), ad_id)
+                added += 1
+            merged.append(shard)
+    finally:
+        writer.close()
+
+    if remove:
+        for shard in merged:
+            os.remove(shard)
+            if os.path.exists(ad_ids_path(shard)):
+                os.remove(ad_ids_path(shard))
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl otomoto listings in several processes")
+    parser.add_argument('urls', nargs='+', help="starting urls, one per car make and model")
+    parser.add_argument('--pages', type=int, default=5, help="listing pages crawled for every url")
+    parser.add_argument('--workers', type=int, default=None, help="number of crawling processes")
+    parser.add_argument('--output', default='cars.csv', help="csv dataset merged rows are appended to")
+    parser.add_argument('--shards', default='shards', help="directory with worker shards")
+    args = parser.parse_args(argv)
+
+    scheduler = CrawlScheduler(args.urls, args.pages, args.workers, args.output, args.shards)
+    print("rows added:", scheduler.run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import csv
+import io
+import os
+import threading
+import time
+
+# columns of data/cars.csv, in order
+FIELDNAMES = ['make', 'model', 'year', 'mileage', 'fuel', 'body', 'no_accidents', 'price', 'currency']
+
+# CarParser.translate_dict_keys names mapped to csv columns
+FIELD_ALIASES = {
+    'petrol_type': 'fuel',
+    'type': 'body',
+}
+
+
+def normalize_row(row: dict) -> dict:
+    """
+    Rename CarParser keys to csv columns with FIELD_ALIASES
+    :param row: dict with car details
+    :return: dict keyed by csv columns
+    """
+    return {FIELD_ALIASES.get(key, key): value for key, value in row.items()}
+
+
+class BatchCsvWriter(object):
+
+    def __init__(self, filename: str, fieldnames: list = None, batch_size: int = 100, flush_interval: float = 5.0,
+                 encoding: str = 'cp1250'):
+        """
+        Csv writer with fixed columns buffering rows in memory and appending them to the file in batches
+        :param filename: csv file, header is written when the file is empty
+        :param fieldnames: csv columns, FIELDNAMES by default
+        :param batch_size: number of buffered rows which triggers flush
+        :param flush_interval: seconds since last flush after which next written row triggers flush
+        :param encoding: file encoding, data/cars.csv is Windows-1250 encoded
+        """
+        self.filename = filename
+        self.fieldnames = list(fieldnames or FIELDNAMES)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.encoding = encoding
+        self.rows_written = 0
+        # called with keys of flushed rows and file size once they are synced to disk, eg. CrawlCheckpoint.flushed
+        self.on_flush = None
+        self._rows = []
+        self._keys = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size == 0:
+            self._write(self.render([self.fieldnames]))
+
+    @property
+    def closed(self) -> bool:
+        return self._fd is None
+
+    def write(self, row: dict, key=None):
+        """
+        Method buffer a row, keys missing in the schema are ignored and missing columns are left empty
+        :param row: dict with car details, CarParser keys are renamed with FIELD_ALIASES
+        :param key: identifier of the row (eg. ad url) passed to on_flush callback
+        """
+        values = normalize_row(row)
+        with self._lock:
+            if self._fd is None:
+                raise ValueError("write to closed file {}".format(self.filename))
+            self._rows.append([values.get(field, '') for field in self.fieldnames])
+            self._keys.append(key)
+            if len(self._rows) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        """
+        Method append all buffered rows to the file with a single write
+        """
+        with self._lock:
+            self._flush()
+
+    def is_buffered(self, key) -> bool:
+        """
+        :return: True when a row written with given key waits in the buffer
+        """
+        with self._lock:
+            return key in self._keys
+
+    def close(self):
+        """
+        Method flush buffered rows, fsync and close the file
+        """
+        with self._lock:
+            if self._fd is None:
+                return
+            try:
+                self._flush()
+                os.fsync(self._fd)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+
+    @staticmethod
+    def render(rows: list) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def _flush(self):
+        if self._rows and self._fd is not None:
+            self._write(self.render(self._rows))
+            self.rows_written += len(self._rows)
+            keys = self._keys
+            self._rows = []
+            self._keys = []
+            if self.on_flush is not None:
+                os.fsync(self._fd)
+                self.on_flush(keys, os.fstat(self._fd).st_size)
+        self._last_flush = time.monotonic()
+
+    def _write(self, text: str):
+        # whole batch is encoded first and appended with O_APPEND, so rows are never interleaved or cut by encoding
+        data = text.encode(self.encoding, errors='replace')
+        while data:
+            written = os.write(self._fd, data)
+            data = data[written:]
@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+from shared_dataset import current_version, locked, open_snapshot, pa, publish, version_metadata
+
+HASH_CHUNK = 1024 ** 2
+
+
+def prefix_hash(path: str, size: int) -> str:
+    """
+    :return: blake2b hex digest of the first size bytes of the file
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as source:
+        left = size
+        while left > 0:
+            chunk = source.read(min(HASH_CHUNK, left))
+            if not chunk:
+                break
+            digest.update(chunk)
+            left -= len(chunk)
+    return digest.hexdigest()
+
+
+class SnapshotCache(object):
+
+    def __init__(self, directory: str):
+        """
+        Binary cache of a DatasetSnapshot parsed from csv file - typed frame, index with make/model/year lists and
+        price statistics - stored in shared_dataset format, so a warm start maps it instead of parsing the csv.
+        Cached snapshot is valid while the file starts with the same bytes it was parsed from: size and mtime are
+        compared first and the bytes are hashed only when they differ. Rows appended since are left to
+        DatasetReloader.refresh().
+        :param directory: cache directory, eg. '../data/.cars_snapshot'
+        """
+        if pa is None:
+            raise ImportError("snapshot cache requires pyarrow package")
+        self.directory = directory
+
+    def load(self, csv_path: str):
+        """
+        :return: cached DatasetSnapshot of csv file, None when there is none or the file changed
+        """
+        if not os.path.isfile(csv_path):
+            return None
+        with locked(self.directory, exclusive=False):
+            name = current_version(self.directory)
+            if name is None:
+                return None
+            try:
+                source = version_metadata(self.directory, name).get('source') or dict()
+                stat = os.stat(csv_path)
+                if source.get('path') != os.path.abspath(csv_path) or stat.st_size < source['offset']:
+                    return None
+                if (stat.st_size, stat.st_mtime_ns) != (source['size'], source['mtime_ns']):
+                    if prefix_hash(csv_path, source['offset']) != source['hash']:
+                        return None
+                return open_snapshot(self.directory, name)
+            except (OSError, KeyError, ValueError) as e:
+                print(e)
+                return None
+
+    def save(self, csv_path: str, snapshot):
+        """
+        Method replace cached snapshot, errors are printed and ignored - the cache only speeds up next start. When
+        several server workers save at once only one of them writes, the others skip it.
+        :param csv_path: csv file snapshot was parsed from
+        :param snapshot: DatasetSnapshot with offset of parsed csv bytes
+        """
+        try:
+            stat = os.stat(csv_path)
+            source = dict(path=os.path.abspath(csv_path), size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                          offset=snapshot.offset, hash=prefix_hash(csv_path, snapshot.offset))
+            publish(snapshot, self.directory, keep=1, source=source, blocking=False)
+        except (OSError, ValueError) as e:
+            print(e)
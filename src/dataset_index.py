@@ -0,0 +1,106 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+class DatasetIndex(object):
+
+    def __init__(self, df):
+        """
+        Lookup tables of make/model/year relationships computed once from cars DataFrame, so dropdown callbacks
+        don't have to scan the data. Rows are also kept grouped by (make, model) in contiguous year-sorted blocks,
+        which turns figure queries into a group lookup and two binary searches.
+        :param df: pandas DataFrame with make, model and year columns
+        """
+        self.makes = sorted(df['make'].unique())
+        self.models = sorted(df['model'].unique())
+        self.years = sorted(df['year'].unique().tolist())
+
+        self.models_by_make = dict()
+        self.makes_by_model = dict()
+        pairs = df[['make', 'model']].drop_duplicates()
+        for make, model in zip(pairs['make'], pairs['model']):
+            self.models_by_make.setdefault(make, []).append(model)
+            self.makes_by_model.setdefault(model, []).append(make)
+
+        # stable sort keeps original row order within a year, original index labels are kept for hover lookups
+        self.frame = df.sort_values(['make', 'model', 'year'], kind='stable')
+        self._years = self.frame['year'].to_numpy()
+        self.groups = dict()
+        for key, positions in self.frame.groupby(['make', 'model'], sort=False, observed=True).indices.items():
+            self.groups[key] = (positions[0], positions[-1] + 1)
+
+    def state(self) -> dict:
+        """
+        :return: JSON serializable lookup tables, restore() rebuilds the index from them and year-sorted frame
+        """
+        return dict(
+            makes=self.makes,
+            models=self.models,
+            years=self.years,
+            models_by_make=self.models_by_make,
+            makes_by_model=self.makes_by_model,
+            groups=[[make, model, int(start), int(stop)] for (make, model), (start, stop) in self.groups.items()],
+        )
+
+    @classmethod
+    def restore(cls, frame, state: dict):
+        """
+        Method rebuild index without sorting or grouping the data again, eg. from a memory-mapped shared_dataset
+        :param frame: DataFrame already sorted by make, model and year, as DatasetIndex.frame
+        :param state: lookup tables returned by state()
+        :return: DatasetIndex
+        """
+        index = cls.__new__(cls)
+        index.makes = state['makes']
+        index.models = state['models']
+        index.years = state['years']
+        index.models_by_make = state['models_by_make']
+        index.makes_by_model = state['makes_by_model']
+        index.frame = frame
+        index._years = frame['year'].to_numpy()
+        index.groups = {(make, model): (start, stop) for make, model, start, stop in state['groups']}
+        return index
+
+    def query(self, make, model, year_from=None, year_to=None):
+        """
+        Method select cars of given make and model produced between given years (inclusive)
+        :return: slice of year-sorted DataFrame, empty when make/model pair is unknown
+        """
+        start, stop = self.groups.get((make, model), (0, 0))
+        years = self._years[start:stop]
+        low = 0 if year_from is None else int(np.searchsorted(years, year_from, side='left'))
+        high = len(years) if year_to is None else int(np.searchsorted(years, year_to, side='right'))
+        return self.frame.iloc[start + low:start + max(low, high)]
+
+    def models_for_make(self, make) -> list:
+        """
+        :return: models of given make in order of their first appearance in data, all models when make is empty
+        """
+        if not make:
+            return self.models
+        return self.models_by_make.get(make, [])
+
+    def makes_for_model(self, model) -> list:
+        """
+        :return: makes selling given model in order of their first appearance in data, all makes when model is empty
+        """
+        if not model:
+            return self.makes
+        return self.makes_by_model.get(model, [])
+
+    def years_from(self, year) -> list:
+        """
+        :return: sorted production years not earlier than given year
+        """
+        if year is None:
+            return self.years
+        return self.years[bisect_left(self.years, year):]
+
+    def years_to(self, year) -> list:
+        """
+        :return: sorted production years not later than given year
+        """
+        if year is None:
+            return self.years
+        return self.years[:bisect_right(self.years, year)]
@@ -0,0 +1,90 @@
+import os.path
+
+import pandas as pd
+
+from parquet_sink import read_cars
+
+# explicit schema of data/cars.csv columns
+CARS_DTYPES = {
+    'make': 'category',
+    'model': 'category',
+    'year': 'int16',
+    'mileage': 'int32',
+    'fuel': 'category',
+    'body': 'category',
+    'no_accidents': 'bool',
+    'price': 'int32',
+    'currency': 'category',
+}
+NUMERIC_COLUMNS = [column for column, dtype in CARS_DTYPES.items() if dtype.startswith('int')]
+
+
+def load_cars_csv(path: str = '../data/cars.csv', encoding: str = 'cp1250', header: bool = True):
+    """
+    Read cars csv file into compact typed DataFrame - categoricals for text columns, small integers for numbers.
+    Malformed rows (eg. with empty price or too many fields) are skipped.
+    :param path: csv file (or file-like object) with csv_writer.FIELDNAMES columns
+    :param encoding: file encoding, csv_writer.BatchCsvWriter writes Windows-1250
+    :param header: False when data has no header row, eg. rows appended to the file
+    :return: pandas DataFrame with CARS_DTYPES columns
+    """
+    try:
+        return read_cars_csv(path, encoding, header, CARS_DTYPES)
+    except ValueError:
+        if hasattr(path, 'seek'):
+            path.seek(0)
+        return drop_malformed_rows(read_cars_csv(path, encoding, header, str))
+
+
+def read_cars_csv(path, encoding: str, header: bool, dtype):
+    options = dict(encoding=encoding, encoding_errors='replace', on_bad_lines='skip', dtype=dtype)
+    if not header:
+        return pd.read_csv(path, header=None, names=list(CARS_DTYPES), **options)
+    return pd.read_csv(path, usecols=list(CARS_DTYPES), **options)[list(CARS_DTYPES)]
+
+
+def drop_malformed_rows(cars):
+    """
+    :param cars: DataFrame with CARS_DTYPES columns read as text
+    :return: DataFrame with CARS_DTYPES columns without rows which can't be converted to them, indexed from 0
+    """
+    cars = cars.copy()
+    for column in NUMERIC_COLUMNS:
+        cars[column] = pd.to_numeric(cars[column], errors='coerce')
+    cars['no_accidents'] = cars['no_accidents'].map({'True': True, 'False': False})
+    valid = cars[NUMERIC_COLUMNS + ['no_accidents']].notna().all(axis=1)
+    print("skipping {} malformed rows".format(int((~valid).sum())))
+    return cars[valid].astype(CARS_DTYPES).reset_index(drop=True)
+
+
+def load_cars(csv_path: str = '../data/cars.csv', parquet_path: str = None, encoding: str = 'cp1250'):
+    """
+    Load cars dataset from parquet_sink dataset when it exists, from csv file otherwise
+    :param csv_path: csv file with cars details
+    :param parquet_path: directory written by parquet_sink.ParquetSink
+    :param encoding: csv file encoding
+    :return: pandas DataFrame with CARS_DTYPES columns
+    """
+    if parquet_path is not None and os.path.isdir(parquet_path):
+        return read_cars(parquet_path).astype(CARS_DTYPES)
+    return load_cars_csv(csv_path, encoding)
+
+
+def memory_usage(df) -> dict:
+    """
+    :return: dict with bytes used by every column (including index) and their total under 'total' key
+    """
+    usage = df.memory_usage(deep=True)
+    report = {str(column): int(size) for column, size in usage.items()}
+    report['total'] = int(usage.sum())
+    return report
+
+
+def memory_report(df) -> str:
+    """
+    :return: one line summary of DataFrame size, eg. "1650 rows, 61.4 KiB (make: 2.1 KiB, ...)"
+    """
+    usage = memory_usage(df)
+    total = usage.pop('total')
+    columns = ", ".join("{}: {:.1f} KiB".format(column, size / 1024) for column, size in usage.items())
+    return "{} rows, {:.1f} KiB ({})".format(len(df), total / 1024, columns)
@@ -0,0 +1,189 @@
+import hashlib
+import io
+import os.path
+import threading
+import time
+
+import pandas as pd
+
+from dataset_index import DatasetIndex
+from dataset_loader import CARS_DTYPES, load_cars, load_cars_csv
+from price_stats import PriceStatistics
+
+DATA_ID_WINDOW = 64 * 1024  # bytes at both ends of parsed csv data hashed into its identity
+
+
+class DatasetSnapshot(object):
+
+    def __init__(self, df, version: int = 0, offset: int = 0, previous=None, appended=None, index=None, stats=None,
+                 data_id: str = None):
+        """
+        Immutable view of cars data published by DatasetReloader. Callbacks should take a snapshot once and use only
+        its attributes, nothing in it is modified after publishing.
+        :param df: cars DataFrame
+        :param version: number increased with every published snapshot
+        :param offset: number of csv file bytes parsed into df
+        :param previous: snapshot df was appended to, its price statistics are updated instead of computed again
+        :param appended: rows appended to previous snapshot data
+        :param index: DatasetIndex of df when it's already built, eg. restored by shared_dataset
+        :param stats: PriceStatistics of df when they are already computed
+        :param data_id: identity of parsed csv data, the same in every process which parsed the same bytes - offset
+        alone may come back with other data after the file is truncated and written again
+        """
+        self.df = df
+        self.index = index if index is not None else DatasetIndex(df)
+        if stats is not None:
+            self.stats = stats
+        elif previous is None:
+            self.stats = PriceStatistics(self.index)
+        else:
+            self.stats = previous.stats.updated(self.index, appended)
+        self.version = version
+        self.offset = offset
+        self.data_id = data_id
+
+    @property
+    def makes(self) -> list:
+        return self.index.makes
+
+    @property
+    def models(self) -> list:
+        return self.index.models
+
+    @property
+    def years(self) -> list:
+        return self.index.years
+
+
+class DatasetReloader(object):
+
+    def __init__(self, csv_path: str = '../data/cars.csv', parquet_path: str = None, interval: float = 5.0,
+                 encoding: str = 'cp1250', snapshot_cache=None, cache_interval: float = 60.0):
+        """
+        Background reloader tailing cars csv file. Only rows appended since last read are parsed, then a new snapshot
+        with rebuilt indexes replaces the current one in a single assignment.
+        :param csv_path: csv file appended by CarParser
+        :param parquet_path: parquet_sink dataset, when it exists data is loaded from it once and not tailed
+        :param interval: seconds between checks of the csv file
+        :param encoding: csv file encoding
+        :param snapshot_cache: dataset_cache.SnapshotCache, csv file is parsed as a whole only when it has no valid
+        snapshot of it, rows appended since the cached snapshot was saved are parsed as by refresh()
+        :param cache_interval: minimum seconds between saving snapshots refreshed in background into snapshot_cache
+        """
+        self.csv_path = csv_path
+        self.interval = interval
+        self.encoding = encoding
+        self.snapshot_cache = snapshot_cache
+        self.cache_interval = cache_interval
+        self._cached_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._refresh_lock = threading.Lock()
+
+        if parquet_path is not None and os.path.isdir(parquet_path):
+            self._tail = False
+            self._snapshot = DatasetSnapshot(load_cars(csv_path, parquet_path))
+        else:
+            self._tail = True
+            self._snapshot = self._load_cached()
+
+    @property
+    def snapshot(self) -> DatasetSnapshot:
+        return self._snapshot
+
+    def refresh(self) -> bool:
+        """
+        Method parse rows appended to csv file since last read and publish new snapshot
+        :return: True when new snapshot was published
+        """
+        if not self._tail:
+            return False
+
+        with self._refresh_lock:
+            current = self._snapshot
+            size = os.path.getsize(self.csv_path)
+            if size < current.offset:
+                # file was truncated or replaced, start from scratch
+                self._snapshot = self._load_whole_file(current.version + 1)
+                return True
+            if size == current.offset:
+                return False
+
+            with open(self.csv_path, 'rb') as csv_file:
+                csv_file.seek(current.offset)
+                data = csv_file.read(size - current.offset)
+            # last row may be still being written, it is parsed with next refresh
+            complete = data.rfind(b'\n') + 1
+            if complete == 0:
+                return False
+
+            appended = load_cars_csv(io.BytesIO(data[:complete]), self.encoding, header=False)
+            appended.index = pd.RangeIndex(len(current.df), len(current.df) + len(appended))
+            df = pd.concat([current.df, appended]).astype(CARS_DTYPES)
+            offset = current.offset + complete
+            self._snapshot = DatasetSnapshot(df, current.version + 1, offset, current, appended,
+                                             data_id=self._data_id(offset))
+            return True
+
+    def start(self):
+        """
+        Method start daemon thread refreshing data every interval seconds
+        """
+        if self._thread is not None or not self._tail:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.refresh() and time.monotonic() - self._cached_at >= self.cache_interval:
+                    self._save_cached()
+            except (OSError, ValueError) as e:
+                print(e)
+
+    def _load_cached(self) -> DatasetSnapshot:
+        cached = self.snapshot_cache.load(self.csv_path) if self.snapshot_cache is not None else None
+        if cached is not None:
+            if cached.data_id is None:
+                cached.data_id = self._data_id(cached.offset)
+            self._snapshot = cached
+            self._cached_at = time.monotonic()
+            # rows appended since are saved too, otherwise every next start would parse them and hash the file again
+            if self.refresh():
+                self._save_cached()
+            return self._snapshot
+        self._snapshot = self._load_whole_file(version=0)
+        self._save_cached()
+        return self._snapshot
+
+    def _save_cached(self):
+        self._cached_at = time.monotonic()
+        if self.snapshot_cache is not None:
+            self.snapshot_cache.save(self.csv_path, self._snapshot)
+
+    def _load_whole_file(self, version: int) -> DatasetSnapshot:
+        with open(self.csv_path, 'rb') as csv_file:
+            data = csv_file.read()
+        complete = data.rfind(b'\n') + 1
+        df = load_cars_csv(io.BytesIO(data[:complete]), self.encoding)
+        return DatasetSnapshot(df, version, complete, data_id=self._data_id(complete))
+
+    def _data_id(self, offset: int) -> str:
+        """
+        :return: hash of offset and csv file bytes at both ends of its first offset bytes
+        """
+        digest = hashlib.blake2b(str(offset).encode('ascii'), digest_size=16)
+        start = max(offset - DATA_ID_WINDOW, 0)
+        with open(self.csv_path, 'rb') as csv_file:
+            digest.update(csv_file.read(min(offset, DATA_ID_WINDOW)))
+            csv_file.seek(start)
+            digest.update(csv_file.read(offset - start))
+        return digest.hexdigest()
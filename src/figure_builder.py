@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+
+SCATTERGL_THRESHOLD = 2000  # above this number of cars points are drawn with WebGL
+AGGREGATE_THRESHOLD = 20000  # above this number of cars only binned aggregates are sent to the browser
+MILEAGE_BINS = 40
+PRICE_BINS = 40
+PERCENTILES = (25, 50, 75)
+
+
+def build_traces(cars, name, scattergl_threshold: int = SCATTERGL_THRESHOLD,
+                 aggregate_threshold: int = AGGREGATE_THRESHOLD) -> list:
+    """
+    Build graph traces for selected cars choosing rendering mode by number of cars: SVG scatter for small selections,
+    WebGL scatter for bigger ones and server side aggregates (density heatmap with per bin price percentiles) above
+    aggregate_threshold
+    :param cars: DataFrame slice with mileage, price and body columns
+    :param name: trace name shown in legend
+    :return: list of plotly traces
+    """
+    if len(cars) == 0:
+        return []
+    if len(cars) > aggregate_threshold:
+        return aggregate_traces(cars)
+    return [scatter_trace(cars, name, webgl=len(cars) > scattergl_threshold)]
+
+
+def scatter_trace(cars, name, webgl: bool = False):
+    """
+    Scatter of every car, customdata keeps DataFrame index used by hover callback
+    """
+    scatter = go.Scattergl if webgl else go.Scatter
+    return scatter(
+        x=cars['mileage'],
+        y=cars['price'],
+        text=["body type: "+str(body) for body in cars['body']],
+        mode='markers',
+        opacity=0.7,
+        marker={
+            'size': 12,
+            'line': {'width': 0.5, 'color': 'white'}
+        },
+        name=name,
+        customdata=cars.index,
+    )
+
+
+def bin_edges(cars, mileage_bins: int = MILEAGE_BINS, price_bins: int = PRICE_BINS):
+    """
+    :return: log spaced mileage bin edges (mileage axis is logarithmic) and linear price bin edges
+    """
+    mileage = clipped_mileage(cars)
+    price = cars['price'].to_numpy()
+    # upper edges are moved by one, so maximal values fall into last bins of half-open ranges
+    mileage_edges = np.geomspace(mileage.min(), mileage.max() + 1, mileage_bins + 1)
+    price_edges = np.linspace(price.min(), price.max() + 1, price_bins + 1)
+    return mileage_edges, price_edges
+
+
+def aggregate_traces(cars, mileage_bins: int = MILEAGE_BINS, price_bins: int = PRICE_BINS) -> list:
+    """
+    Build density heatmap of cars binned by mileage and price and lines of price percentiles in every mileage bin.
+    Heatmap cells carry their bin bounds as customdata, so the hover callback can fetch cars of a single bin.
+    :param cars: DataFrame slice with mileage and price columns
+    :return: list of plotly traces
+    """
+    mileage_edges, price_edges = bin_edges(cars, mileage_bins, price_bins)
+    mileage = clipped_mileage(cars)
+    price = cars['price'].to_numpy()
+
+    counts, _, _ = np.histogram2d(mileage, price, bins=[mileage_edges, price_edges])
+    mileage_centers = np.sqrt(mileage_edges[:-1] * mileage_edges[1:])
+    price_centers = (price_edges[:-1] + price_edges[1:]) / 2
+
+    z = [[int(count) if count else None for count in row] for row in counts.T]
+    customdata = [[[mileage_edges[i], mileage_edges[i + 1], price_edges[j], price_edges[j + 1]]
+                   for i in range(mileage_bins)] for j in range(price_bins)]
+    traces = [go.Heatmap(
+        x=mileage_centers,
+        y=price_centers,
+        z=z,
+        customdata=customdata,
+        colorscale='Blues',
+        name='number of cars',
+        hovertemplate="mileage: %{x:.0f} km<br>price: %{y:.0f}<br>cars: %{z}<extra></extra>",
+    )]
+
+    bins = np.digitize(mileage, mileage_edges[1:-1])
+    quantiles = pd.Series(price).groupby(bins).quantile([percentile / 100 for percentile in PERCENTILES]).unstack()
+    for percentile in PERCENTILES:
+        by_bin = quantiles[percentile / 100]
+        values = [float(by_bin[i]) if i in by_bin.index else None for i in range(mileage_bins)]
+        traces.append(go.Scatter(
+            x=mileage_centers,
+            y=values,
+            mode='lines',
+            connectgaps=True,
+            name="price p{}".format(percentile),
+        ))
+    return traces
+
+
+def trend_trace(statistics, cars, year_from=None, year_to=None, points: int = 20):
+    """
+    Line of price against mileage regression precomputed in price_stats.ModelStatistics
+    :param statistics: ModelStatistics of selected make and model
+    :param cars: selected cars, line is drawn over their mileage range
+    :return: plotly trace, None when regression is undefined
+    """
+    if statistics is None or len(cars) == 0:
+        return None
+    fit = statistics.regression(year_from, year_to)
+    if fit is None:
+        return None
+    slope, intercept = fit
+    mileage = clipped_mileage(cars)
+    # mileage axis is logarithmic, evenly spaced points there keep the straight line smooth
+    x = np.geomspace(mileage.min(), mileage.max(), points)
+    return go.Scatter(
+        x=x,
+        y=intercept + slope * x,
+        mode='lines',
+        line={'dash': 'dash'},
+        name="price trend ({:,.0f} per 1000 km)".format(slope * 1000),
+        hoverinfo='skip',
+    )
+
+
+def rows_in_bin(cars, bounds):
+    """
+    :param cars: DataFrame slice used to build aggregate traces
+    :param bounds: heatmap cell customdata - [mileage from, mileage to, price from, price to]
+    :return: cars inside half-open mileage and price ranges
+    """
+    mileage_from, mileage_to, price_from, price_to = bounds
+    mileage = clipped_mileage(cars)
+    price = cars['price'].to_numpy()
+    mask = (mileage >= mileage_from) & (mileage < mileage_to) & (price >= price_from) & (price < price_to)
+    return cars[mask]
+
+
+def describe_bin(cars, bounds, sample_size: int = 10) -> dict:
+    """
+    Summary of a hovered heatmap cell with a sample of its cars
+    """
+    rows = rows_in_bin(cars, bounds)
+    summary = dict(
+        cars=len(rows),
+        mileage="{:,.0f} - {:,.0f} km".format(bounds[0], bounds[1]),
+        price="{:,.0f} - {:,.0f}".format(bounds[2], bounds[3]),
+        sample=[dict(year=int(car.year), mileage=int(car.mileage), price=int(car.price), body=str(car.body))
+                for car in rows.head(sample_size).itertuples()],
+    )
+    return summary
+
+
+def clipped_mileage(cars):
+    # brand new cars have 0 km, which logarithmic bins can't hold
+    return np.maximum(cars['mileage'].to_numpy(), 1)
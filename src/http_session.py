@@ -0,0 +1,94 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from user_agent import generate_user_agent
+
+from .rate_controller import AdaptiveThrottle
+from .response_cache import ResponseCache
+
+
+class HttpSession(object):
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.5, timeout: float = 30,
+                 cache: ResponseCache = None, offline: bool = False, throttle: AdaptiveThrottle = None):
+        """
+        Pooled keep-alive HTTP session shared by CarSpider and CarParser
+        :param pool_size: number of connections kept alive per host
+        :param retries: number of retries on connection errors and 5xx responses
+        :param backoff_factor: retries sleep backoff_factor * 2 ** (retry number - 1) seconds
+        :param timeout: default timeout of a single request in seconds
+        :param cache: ResponseCache answering repeated requests and storing successful responses
+        :param offline: serve requests from cache only, urls missing in cache raise requests.ConnectionError
+        :param throttle: AdaptiveThrottle limiting requests in flight, 429/503 responses are retried after its pause
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.throttle = throttle
+        self.cache = cache
+        self.offline = offline
+        self.user_agent = str(generate_user_agent(os=('mac', 'linux', 'win')))
+
+        # with a throttle 503 responses come back here, so their Retry-After pauses all requests
+        statuses = self.RETRY_STATUSES
+        if throttle is not None:
+            statuses = tuple(status for status in statuses if status not in throttle.BACKOFF_STATUSES)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=statuses,
+            respect_retry_after_header=throttle is None,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers.update({'User-agent': self.user_agent})
+
+    def get(self, url: str, **kwargs):
+        """
+        Method send GET request through pooled connections, or return cached response when session has a cache
+        :param url: url to request
+        :param kwargs: additional arguments passed to requests.Session.get
+        :return: requests Response object
+        """
+        if self.cache is not None:
+            response = self.cache.get(url)
+            if response is not None:
+                return response
+        if self.offline:
+            raise requests.ConnectionError("{} is not cached and session is offline".format(url))
+
+        kwargs.setdefault('timeout', self.timeout)
+        if self.throttle is None:
+            response = self._session.get(url, **kwargs)
+        else:
+            response = self._throttled_get(url, **kwargs)
+        if self.cache is not None and response.status_code == 200:
+            self.cache.put(url, response.content, response.headers, response.status_code, response.encoding)
+        return response
+
+    def _throttled_get(self, url: str, **kwargs):
+        for attempt in range(self.retries + 1):
+            started = self.throttle.acquire()
+            try:
+                response = self._session.get(url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError, requests.exceptions.RetryError):
+                self.throttle.release(started, error=True)
+                raise
+            except requests.RequestException:
+                self.throttle.release(started)
+                raise
+            self.throttle.release(started, response.status_code, response.headers.get('Retry-After'))
+            if response.status_code not in self.throttle.BACKOFF_STATUSES:
+                break
+        return response
+
+    def close(self):
+        self._session.close()
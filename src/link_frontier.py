@@ -0,0 +1,51 @@
+import threading
+
+
+class LinkFrontier(object):
+
+    def __init__(self):
+        """
+        Thread safe set of links to offers already handed to the crawl, so an ad which moves between listing pages
+        while they are being requested is fetched only once
+        """
+        self._links = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(link: str) -> str:
+        # the same ad is sometimes linked with different tracking fragments
+        return link.split('#', 1)[0]
+
+    def add(self, link: str) -> bool:
+        """
+        :return: True when link was not seen before
+        """
+        key = self.key(link)
+        with self._lock:
+            if key in self._links:
+                return False
+            self._links.add(key)
+            return True
+
+    def add_new(self, links) -> list:
+        """
+        Method add links to the frontier
+        :param links: iterable of links to offers
+        :return: links which were not seen before, in their original order
+        """
+        new_links = []
+        with self._lock:
+            for link in links:
+                key = self.key(link)
+                if key not in self._links:
+                    self._links.add(key)
+                    new_links.append(link)
+        return new_links
+
+    def __contains__(self, link: str) -> bool:
+        with self._lock:
+            return self.key(link) in self._links
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._links)
@@ -0,0 +1,180 @@
+import os
+import time
+import uuid
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARTITION_COLUMNS = ['make', 'model']
+
+
+def arrow_schema():
+    """
+    Typed schema of columns stored inside parquet files, make and model are encoded in partition directories
+    """
+    return pa.schema([
+        ('year', pa.int16()),
+        ('mileage', pa.int32()),
+        ('fuel', pa.string()),
+        ('body', pa.string()),
+        ('no_accidents', pa.bool_()),
+        ('price', pa.int32()),
+        ('currency', pa.string()),
+    ])
+
+
+def to_int(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value == 'True'
+    return bool(value)
+
+
+CONVERTERS = {
+    'year': to_int,
+    'mileage': to_int,
+    'price': to_int,
+    'no_accidents': to_bool,
+}
+
+
+class ParquetSink(object):
+
+    def __init__(self, root: str = 'cars_parquet', batch_size: int = 1000):
+        """
+        Output sink writing car details into parquet files partitioned by make and model
+        (root/make=audi/model=s3/part-*.parquet)
+        :param root: dataset directory
+        :param batch_size: number of buffered rows which triggers writing new files
+        """
+        if pa is None:
+            raise ImportError("ParquetSink requires pyarrow package")
+        self.root = root
+        self.batch_size = batch_size
+        self.schema = arrow_schema()
+        self._rows = []
+        os.makedirs(root, exist_ok=True)
+
+    def write(self, row: dict):
+        """
+        Method buffer a row keyed by csv_writer.FIELDNAMES columns
+        :param row: dict with car details
+        """
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Method write buffered rows, one new file per make/model partition
+        """
+        partitions = dict()
+        for row in self._rows:
+            partitions.setdefault((row['make'], row['model']), []).append(row)
+        self._rows = []
+
+        for (make, model), rows in partitions.items():
+            columns = dict()
+            for field in self.schema:
+                convert = CONVERTERS.get(field.name, lambda value: value)
+                columns[field.name] = [convert(row.get(field.name)) for row in rows]
+            table = pa.Table.from_pydict(columns, schema=self.schema)
+            self._write_table(table, partition_path(self.root, make, model))
+
+    def close(self):
+        self.flush()
+
+    def compact(self):
+        """
+        Method merge all files of every partition into a single file
+        """
+        for partition in partition_directories(self.root):
+            files = parquet_files(partition)
+            if len(files) < 2:
+                continue
+            table = pa.concat_tables([pq.read_table(path, schema=self.schema) for path in files])
+            self._write_table(table, partition)
+            for path in files:
+                os.remove(path)
+
+    @staticmethod
+    def _write_table(table, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        name = "part-{}-{}.parquet".format(int(time.time() * 1000), uuid.uuid4().hex)
+        tmp_path = os.path.join(directory, "." + name + ".tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(directory, name))
+
+
+def partition_path(root: str, make: str, model: str) -> str:
+    return os.path.join(root, "make=" + quote(str(make), safe=''), "model=" + quote(str(model), safe=''))
+
+
+def partition_directories(root: str) -> list:
+    directories = []
+    for make_dir in sorted(os.listdir(root)):
+        make_path = os.path.join(root, make_dir)
+        if not make_dir.startswith("make=") or not os.path.isdir(make_path):
+            continue
+        for model_dir in sorted(os.listdir(make_path)):
+            if model_dir.startswith("model="):
+                directories.append(os.path.join(make_path, model_dir))
+    return directories
+
+
+def parquet_files(directory: str) -> list:
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".parquet"))
+
+
+def read_cars(root: str, make: str = None, model: str = None, columns: list = None):
+    """
+    Load cars dataset written by ParquetSink into pandas DataFrame. When both make and model are given only their
+    partition is read, otherwise partitions are pruned with make/model filters.
+    :param root: dataset directory
+    :param make: car make
+    :param model: car model
+    :param columns: columns to load, all columns in csv_writer.FIELDNAMES order by default
+    :return: pandas DataFrame
+    """
+    if pa is None:
+        raise ImportError("read_cars requires pyarrow package")
+    schema = arrow_schema()
+    if columns is None:
+        columns = PARTITION_COLUMNS + schema.names
+    file_columns = [column for column in columns if column not in PARTITION_COLUMNS]
+    ordered = [column for column in ['make', 'model'] + schema.names if column in columns]
+
+    if make is not None and model is not None:
+        directory = partition_path(root, make, model)
+        files = parquet_files(directory) if os.path.isdir(directory) else []
+        if files:
+            table = pa.concat_tables([pq.read_table(path, columns=file_columns, schema=schema) for path in files])
+        else:
+            table = schema.empty_table().select(file_columns)
+        df = table.to_pandas()
+        if 'make' in columns:
+            df['make'] = make
+        if 'model' in columns:
+            df['model'] = model
+        return df[ordered]
+
+    partitioning = ds.partitioning(pa.schema([('make', pa.string()), ('model', pa.string())]), flavor='hive')
+    dataset = ds.dataset(root, format='parquet', partitioning=partitioning,
+                         schema=pa.unify_schemas([schema, partitioning.schema]))
+    expression = None
+    if make is not None:
+        expression = ds.field('make') == make
+    if model is not None:
+        model_expression = ds.field('model') == model
+        expression = model_expression if expression is None else expression & model_expression
+    return dataset.to_table(columns=ordered, filter=expression).to_pandas()
@@ -0,0 +1,103 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from .car_ad_parser import CarParser
+from .parser_engines import MissingElement
+
+
+class ParsePoolCrawler(object):
+
+    def __init__(self, spider, parse_workers: int = None, fetch_workers: int = 8, buffer_size: int = 64):
+        """
+        Crawler fetching ads in threads, parsing their HTML code in a pool of worker processes and writing parsed
+        car_details in the calling process only
+        :param spider: CarSpider instance which provides links to offers and owns the parser
+        :param parse_workers: number of parsing processes, number of CPUs by default
+        :param fetch_workers: number of threads fetching ads
+        :param buffer_size: maximum number of ads being fetched or parsed at once
+        """
+        self.spider = spider
+        self.parse_workers = parse_workers
+        self.fetch_workers = fetch_workers
+        self.buffer_size = buffer_size
+
+    def run(self):
+        """
+        Method feed links from spider.iter_car_ads() through fetch threads and parse processes and save results
+        """
+        parser = self.spider.parser
+        links = self.spider.iter_car_ads()
+        links_exhausted = False
+        fetching, parsing = set(), set()
+        requested, responses = dict(), dict()
+
+        with ThreadPoolExecutor(self.fetch_workers) as fetchers, ProcessPoolExecutor(self.parse_workers) as parsers:
+            while True:
+                while not links_exhausted and len(fetching) + len(parsing) < self.buffer_size:
+                    link = next(links, None)
+                    if link is None:
+                        links_exhausted = True
+                        break
+                    fetch_future = fetchers.submit(self.fetch, link)
+                    requested[fetch_future] = link
+                    fetching.add(fetch_future)
+
+                metrics = self.spider.metrics
+                metrics.set_gauge('crawl_queue_depth', len(fetching), queue='fetching')
+                metrics.set_gauge('crawl_queue_depth', len(parsing), queue='parsing')
+                if not fetching and not parsing:
+                    break
+
+                done, _ = wait(fetching | parsing, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        fetching.discard(future)
+                        link = requested.pop(future)
+                        r = future.result()
+                        if r is None:
+                            self.spider.ad_processed(link)
+                        else:
+                            parse_future = parsers.submit(CarParser.parse_car_details_from_content, r.content,
+                                                         r.encoding, parser.engine)
+                            responses[parse_future] = r
+                            parsing.add(parse_future)
+                    else:
+                        parsing.discard(future)
+                        r = responses.pop(future)
+                        try:
+                            self.save(future, r)
+                        finally:
+                            self.spider.ad_processed(r.url)
+
+    def save(self, future, r):
+        """
+        Method save car details parsed by a worker process, parsing failures are counted and skipped
+        :param future: finished parse future
+        :param r: response the details were parsed from
+        """
+        metrics = self.spider.metrics
+        try:
+            car_details = future.result()
+        except MissingElement as e:
+            metrics.inc('crawl_failures_total', reason='missing_' + e.region)
+            print(e)
+            return
+        except KeyError as e:
+            metrics.inc('crawl_failures_total', reason='missing_details')
+            print(e)
+            return
+        except (AttributeError, ValueError) as e:
+            metrics.inc('crawl_failures_total', reason='malformed_offer')
+            print(e)
+            return
+        self.spider.parser.save_car_details(car_details, r.url, r.headers)
+
+    def fetch(self, url: str):
+        """
+        Method request an ad page through the parser
+        :param url: link to a car advertisement(offer)
+        :return: requests Response object with url set to the requested link, None when ad was not fetched
+        """
+        r = self.spider.parser.fetch_ad_page(url)
+        if r is not None:
+            r.url = url
+        return r
@@ -0,0 +1,198 @@
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+
+class MissingElement(AttributeError):
+    """
+    Raised when offer page lacks a region the engine looks for
+    """
+
+    def __init__(self, region: str, message: str):
+        """
+        :param region: name of missing region - 'offer_params', 'price' or 'currency'
+        :param message: error description
+        """
+        super().__init__(message)
+        self.region = region
+
+    def __reduce__(self):
+        # raised in ParsePoolCrawler worker processes, so it must survive pickling
+        return MissingElement, (self.region, str(self))
+
+
+def has_class(class_name: str) -> str:
+    """
+    Build XPath predicate matching elements with given class among others in their class attribute
+    """
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(class_name)
+
+
+class BeautifulSoupEngine(object):
+    """
+    Reference engine - pure python html.parser tree searched with BeautifulSoup
+    """
+    name = 'bs4'
+    package = 'bs4'  # engine can be created whenever this package is installed
+
+    def extract(self, html: str):
+        """
+        Method find offer parameters and price in HTML code of an offer page
+        :param html: HTML code of a car advertisement(offer) page
+        :return: list of (label, value) texts of offer parameters, text of price tag and currency
+        """
+        return self.find(self.parse(html))
+
+    @staticmethod
+    def parse(html: str):
+        return BeautifulSoup(html, "html.parser")
+
+    def find(self, soup):
+        """
+        Method find offer parameters and price in a parsed offer page
+        :param soup: tree returned by parse()
+        :return: list of (label, value) texts of offer parameters, text of price tag and currency
+        """
+        div_with_offer_param = soup.find('div', class_="offer-params")
+        if div_with_offer_param is None:
+            raise MissingElement('offer_params', "Offer parameters not found.")
+        offer_params = div_with_offer_param.find_all('li', {'class': 'offer-params__item'})
+        params = [(param.span.text, param.div.text) for param in offer_params]
+
+        price_tag = soup.find('span', {'class': 'offer-price__number'})
+        if price_tag is None:
+            raise MissingElement('price', "Price not found.")
+        currency = price_tag.find('span', {'class': 'offer-price__currency'})
+        if currency is None:
+            raise MissingElement('currency', "Currency not found.")
+
+        return params, price_tag.text, currency.text
+
+
+class LxmlEngine(object):
+    """
+    libxml2 based engine searching the tree with XPath
+    """
+    name = 'lxml'
+    package = 'lxml'
+
+    OFFER_PARAMS_XPATH = "//div[{}]".format(has_class('offer-params'))
+    OFFER_PARAMS_ITEM_XPATH = ".//li[{}]".format(has_class('offer-params__item'))
+    PRICE_XPATH = "//span[{}]".format(has_class('offer-price__number'))
+    CURRENCY_XPATH = ".//span[{}]".format(has_class('offer-price__currency'))
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError("lxml engine requires lxml package")
+
+    def extract(self, html: str):
+        """
+        Method find offer parameters and price in HTML code of an offer page
+        :param html: HTML code of a car advertisement(offer) page
+        :return: list of (label, value) texts of offer parameters, text of price tag and currency
+        """
+        return self.find(self.parse(html))
+
+    @staticmethod
+    def parse(html: str):
+        return lxml.html.fromstring(html)
+
+    def find(self, tree):
+        """
+        Method find offer parameters and price in a parsed offer page
+        :param tree: tree returned by parse()
+        :return: list of (label, value) texts of offer parameters, text of price tag and currency
+        """
+        div_with_offer_param = self.first(tree, self.OFFER_PARAMS_XPATH, 'offer_params')
+        params = []
+        for param in div_with_offer_param.xpath(self.OFFER_PARAMS_ITEM_XPATH):
+            label = self.first(param, './/span', 'offer_params')
+            value = self.first(param, './/div', 'offer_params')
+            params.append((label.text_content(), value.text_content()))
+
+        price_tag = self.first(tree, self.PRICE_XPATH, 'price')
+        currency = self.first(price_tag, self.CURRENCY_XPATH, 'currency')
+
+        return params, price_tag.text_content(), currency.text_content()
+
+    @staticmethod
+    def first(element, xpath: str, region: str):
+        found = element.xpath(xpath)
+        if not found:
+            raise MissingElement(region, "Element matching {} not found.".format(xpath))
+        return found[0]
+
+
+class SelectolaxEngine(object):
+    """
+    Lexbor (C) based engine searching the tree with CSS selectors
+    """
+    name = 'selectolax'
+    package = 'selectolax'
+
+    def __init__(self):
+        if LexborHTMLParser is None:
+            raise ImportError("selectolax engine requires selectolax package")
+
+    def extract(self, html: str):
+        """
+        Method find offer parameters and price in HTML code of an offer page
+        :param html: HTML code of a car advertisement(offer) page
+        :return: list of (label, value) texts of offer parameters, text of price tag and currency
+        """
+        return self.find(self.parse(html))
+
+    @staticmethod
+    def parse(html: str):
+        return LexborHTMLParser(html)
+
+    def find(self, tree):
+        """
+        Method find offer parameters and price in a parsed offer page
+        :param tree: tree returned by parse()
+        :return: list of (label, value) texts of offer parameters, text of price tag and currency
+        """
+        div_with_offer_param = self.first(tree, 'div.offer-params', 'offer_params')
+        params = []
+        for param in div_with_offer_param.css('li.offer-params__item'):
+            params.append((self.first(param, 'span', 'offer_params').text(),
+                           self.first(param, 'div', 'offer_params').text()))
+
+        price_tag = self.first(tree, 'span.offer-price__number', 'price')
+        currency = self.first(price_tag, 'span.offer-price__currency', 'currency')
+
+        return params, price_tag.text(), currency.text()
+
+    @staticmethod
+    def first(node, selector: str, region: str):
+        found = node.css_first(selector)
+        if found is None:
+            raise MissingElement(region, "Element matching {} not found.".format(selector))
+        return found
+
+
+ENGINES = {
+    BeautifulSoupEngine.name: BeautifulSoupEngine,
+    LxmlEngine.name: LxmlEngine,
+    SelectolaxEngine.name: SelectolaxEngine,
+}
+
+
+def get_engine(name: str = 'bs4'):
+    """
+    Create parser engine by its name
+    :param name: one of ENGINES keys - 'bs4', 'lxml' or 'selectolax'
+    :return: parser engine instance
+    """
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError("Unknown parser engine '{}', choose one of: {}".format(name, ", ".join(ENGINES)))
@@ -1,83 +1,156 @@
 import json
+import os.path
+import threading
 
 import dash
+import flask
 import dash_core_components as dcc
 import dash_html_components as html
-import pandas as pd
 import plotly.graph_objs as go
 from textwrap import dedent as d
 
+from dataset_cache import SnapshotCache
+from dataset_loader import memory_report
+from figure_builder import build_traces, describe_bin, trend_trace
+from dataset_reloader import DatasetReloader
+from shared_dataset import CURRENT, SharedDatasetReader, pa
+from callback_cache import CallbackCache, DiskCacheBackend
+
 
 app = dash.Dash()
 app.title = "Car prices"
 app.css.append_css({"external_url": "https://codepen.io/chriddyp/pen/bWLwgP.css"})  # setting css
 
-df = pd.read_csv('../data/cars.csv', encoding='latin-1')  # reading csv file with cars details
-
-DROPDOWN_WIDTH = "15%"
-YEAR_DROPDOWN_WIDTH = "8%"
-AVAILABLE_MAKES = sorted(df['make'].unique())  # unique car makes
-AVAILABLE_MODELS = sorted(df['model'].unique())  # unique car models
-AVAILABLE_YEARS = sorted(df['year'].unique())  # unique car production years
-
-app.layout = html.Div([
-
-    html.Div([
-        dcc.Dropdown(
-            id='make-dropdown',
-            options=[{'label': i, 'value': i} for i in AVAILABLE_MAKES],
-            placeholder="Pick a car make"
-        )
-    ],
-        style={'width': DROPDOWN_WIDTH, 'display': 'inline-block'}),
-
-    html.Div([
-        dcc.Dropdown(
-            id='model-dropdown',
-            options=[{'label': i, 'value': i} for i in AVAILABLE_MODELS],
-            placeholder="Pick a car model"
-        )
-    ],
-        style={'width': DROPDOWN_WIDTH, 'display': 'inline-block'}),
-
-    html.Div(["production year:  "], style={'width': DROPDOWN_WIDTH, 'text-align': 'right',
-                                            'display': 'inline-block', 'vertical-align': 'middle'}),
-    html.Div([
-        dcc.Dropdown(
-            id='year-from-dropdown',
-            options=[{'label': i, 'value': i} for i in AVAILABLE_YEARS],
-            placeholder="from...",
-            value=min(AVAILABLE_YEARS)
-        )
-    ],
-        style={'width': YEAR_DROPDOWN_WIDTH, 'display': 'inline-block', 'margin-left': '10px'}),
-
-    html.Div([
-        dcc.Dropdown(
-            id='year-to-dropdown',
-            options=[{'label': i, 'value': i} for i in AVAILABLE_YEARS],
-            placeholder="to...",
-            value=max(AVAILABLE_YEARS)
-        )
-    ],
-        style={'width': YEAR_DROPDOWN_WIDTH, 'display': 'inline-block'}),
+PARQUET_DATASET = '../data/cars_parquet'  # written by parquet_sink.ParquetSink, used instead of csv when present
+# published by shared_dataset.py, server workers map it instead of loading their own copies when present
+SHARED_DATASET = '../data/cars_shared'
+
+# typed csv data with its index and statistics saved after the first parse, next starts map it instead of parsing
+SNAPSHOT_CACHE = '../data/cars_snapshot'
+
+# data is loaded with the first request (or server start), so importing callbacks stays cheap for tests and tools
+reloader = None
+_reloader_lock = threading.Lock()
+
+
+def open_reloader():
+    """
+    Method read cars details into compact typed DataFrame, rows appended to csv are picked up in background
+    """
+    if os.path.isfile(os.path.join(SHARED_DATASET, CURRENT)):
+        loaded = SharedDatasetReader(SHARED_DATASET)
+    else:
+        snapshot_cache = SnapshotCache(SNAPSHOT_CACHE) if pa is not None else None
+        loaded = DatasetReloader('../data/cars.csv', PARQUET_DATASET, snapshot_cache=snapshot_cache)
+    print("cars dataset loaded:", memory_report(loaded.snapshot.df))
+    return loaded
+
+
+def get_reloader():
+    """
+    :return: reloader opened on first use, with its refresh thread already running in every server worker (eg. under
+    gunicorn plot:app.server, where __main__ block is not executed)
+    """
+    global reloader
+    if reloader is None:
+        with _reloader_lock:
+            if reloader is None:
+                loaded = open_reloader()
+                loaded.start()
+                reloader = loaded
+    return reloader
+
+
+# results of figure and hover callbacks are reused until data changes, data identity is the same in every worker
+SHARED_CALLBACK_CACHE = None  # directory shared by server workers, eg. '../data/callback_cache'
+callback_cache = CallbackCache(
+    max_entries=256,
+    max_bytes=64 * 1024 ** 2,
+    backend=DiskCacheBackend(SHARED_CALLBACK_CACHE) if SHARED_CALLBACK_CACHE else None,
+)
 
 
-    dcc.Graph(id='graph'),
+def data_version():
+    # offset alone may come back with other data after the csv file is truncated and loaded again
+    snapshot = get_reloader().snapshot
+    return "{}:{}".format(snapshot.offset, snapshot.data_id)
 
-    html.Div([
-        dcc.Markdown(d("""
-         **Hover Data**
 
-         Mouse over values in the graph.
-     """)),
-    ], style={
-        'border': 'thin lightgrey solid',
-        'overflowX': 'scroll'
-    }, id='hover-data'),
+DROPDOWN_WIDTH = "15%"
+YEAR_DROPDOWN_WIDTH = "8%"
 
 
-], style={'marginLeft': 50, 'marginRight': 25})
+def serve_layout():
+    # dropdown lists are taken from current data on every page load, dash also calls this once without a request to
+    # validate callbacks, then the same components are built without loading data
+    if flask.has_request_context():
+        snapshot = get_reloader().snapshot
+        makes, models, years = snapshot.makes, snapshot.models, snapshot.years
+    else:
+        makes, models, years = [], [], []
+    return html.Div([
+
+        html.Div([
+            dcc.Dropdown(
+                id='make-dropdown',
+                options=[{'label': i, 'value': i} for i in makes],
+                placeholder="Pick a car make"
+            )
+        ],
+            style={'width': DROPDOWN_WIDTH, 'display': 'inline-block'}),
+
+        html.Div([
+            dcc.Dropdown(
+                id='model-dropdown',
+                options=[{'label': i, 'value': i} for i in models],
+                placeholder="Pick a car model"
+            )
+        ],
+            style={'width': DROPDOWN_WIDTH, 'display': 'inline-block'}),
+
+        html.Div(["production year:  "], style={'width': DROPDOWN_WIDTH, 'text-align': 'right',
+                                                'display': 'inline-block', 'vertical-align': 'middle'}),
+        html.Div([
+            dcc.Dropdown(
+                id='year-from-dropdown',
+                options=[{'label': i, 'value': i} for i in years],
+                placeholder="from...",
+                value=min(years, default=None)
+            )
+        ],
+            style={'width': YEAR_DROPDOWN_WIDTH, 'display': 'inline-block', 'margin-left': '10px'}),
+
+        html.Div([
+            dcc.Dropdown(
+                id='year-to-dropdown',
+                options=[{'label': i, 'value': i} for i in years],
+                placeholder="to...",
+                value=max(years, default=None)
+            )
+        ],
+            style={'width': YEAR_DROPDOWN_WIDTH, 'display': 'inline-block'}),
+
+
+        dcc.Graph(id='graph'),
+
+        html.Div([
+            dcc.Markdown(d("""
+             **Hover Data**
+
+             Mouse over values in the graph.
+         """)),
+        ], style={
+            'border': 'thin lightgrey solid',
+            'overflowX': 'scroll'
+        }, id='hover-data'),
+
+        html.Div(id='price-summary', style={'border': 'thin lightgrey solid', 'margin-top': '10px'}),
+
+
+    ], style={'marginLeft': 50, 'marginRight': 25})
+
+
+app.layout = serve_layout
 
 
 # show only car models from chosen make
@@ -85,15 +158,7 @@ app.layout = html.Div([
     dash.dependencies.Output('model-dropdown', 'options'),
     [dash.dependencies.Input('make-dropdown', 'value')])
 def set_model_options(selected_make):
-    if not selected_make:
-        return [{'label': i, 'value': i} for i in AVAILABLE_MODELS]
-
-    all_options = dict()
-    for make in df['make'].unique():
-        filtered_df = df[df['make'] == make]
-        all_options[make] = list(filtered_df.model.unique())
-
-    return [{'label': i, 'value': i} for i in all_options[selected_make]]
+    return [{'label': i, 'value': i} for i in get_reloader().snapshot.index.models_for_make(selected_make)]
 
 
 # show only car makes which sell chosen model
@@ -101,15 +166,7 @@ def set_model_options(selected_make):
     dash.dependencies.Output('make-dropdown', 'options'),
     [dash.dependencies.Input('model-dropdown', 'value')])
 def set_model_options(selected_model):
-    if not selected_model:
-        return [{'label': i, 'value': i} for i in AVAILABLE_MAKES]
-
-    all_options = dict()
-    for model in df['model'].unique():
-        filtered_df = df[df['model'] == model]
-        all_options[model] = list(filtered_df.make.unique())
-
-    return [{'label': i, 'value': i} for i in all_options[selected_model]]
+    return [{'label': i, 'value': i} for i in get_reloader().snapshot.index.makes_for_model(selected_model)]
 
 
 # do not choose any model with no chosen make
@@ -128,11 +185,7 @@ def set_model_value(available_options, selected_make):
     dash.dependencies.Output('year-to-dropdown', 'options'),
     [dash.dependencies.Input('year-from-dropdown', 'value')])
 def set_year_to_options(selected_year):
-    all_options = dict()
-    for year in df['year']:
-        filtered_df = df[(df.year >= selected_year)]
-        all_options[year] = list(filtered_df.year.unique())
-    return [{'label': i, 'value': i} for i in sorted(all_options[selected_year])]
+    return [{'label': i, 'value': i} for i in get_reloader().snapshot.index.years_from(selected_year)]
 
 
 # show only years earlier than 'to' chosen
@@ -140,29 +193,40 @@ def set_year_to_options(selected_year):
     dash.dependencies.Output('year-from-dropdown', 'options'),
     [dash.dependencies.Input('year-to-dropdown', 'value')])
 def set_year_to_options(selected_year):
-    all_options = dict()
-    for year in df['year']:
-        filtered_df = df[(df.year <= selected_year)]
-        all_options[year] = list(filtered_df.year.unique())
-    return [{'label': i, 'value': i} for i in sorted(all_options[selected_year])]
+    return [{'label': i, 'value': i} for i in get_reloader().snapshot.index.years_to(selected_year)]
 
 
 # show details on hover
 @app.callback(
     dash.dependencies.Output('hover-data', 'children'),
-    [dash.dependencies.Input('graph', 'hoverData')])
-def display_hover_data(hoverData):
+    [dash.dependencies.Input('graph', 'hoverData')],
+    [
+        dash.dependencies.State('make-dropdown', 'value'),
+        dash.dependencies.State('model-dropdown', 'value'),
+        dash.dependencies.State('year-from-dropdown', 'value'),
+        dash.dependencies.State('year-to-dropdown', 'value'),
+    ]
+)
+@callback_cache.memoize(data_version)
+def display_hover_data(hoverData, selected_make=None, selected_model=None, selected_from_year=None,
+                       selected_to_year=None):
     try:
+        snapshot = get_reloader().snapshot
         pd_index = hoverData['points'][0]['customdata']  # accessing customdata key which is a dataframe row index
-        car = df.loc[[pd_index]].values
+        if isinstance(pd_index, list):
+            # aggregated figure - customdata holds bounds of hovered bin, only its cars are fetched
+            filtered_df = snapshot.index.query(selected_make, selected_model, selected_from_year, selected_to_year)
+            return json.dumps(describe_bin(filtered_df, pd_index), indent=4)
+
+        car = snapshot.df.loc[[pd_index]].values
         make = car[0][0]
         model = car[0][1].replace('_', ' ')
-        year = car[0][2]
-        mileage = car[0][3] + " km"
+        year = int(car[0][2])
+        mileage = str(car[0][3]) + " km"
         fuel = car[0][4]
         body = car[0][5]
-        no_accidents = car[0][6]
-        price = car[0][7]
+        no_accidents = bool(car[0][6])
+        price = int(car[0][7])
         currency = car[0][8]
         price_with_currency = "{:,}".format(price) + " " + currency
 
@@ -193,31 +257,15 @@ def display_hover_data(hoverData):
             dash.dependencies.Input('year-to-dropdown', 'value'),
     ]
 )
+@callback_cache.memoize(data_version)
 def update_figure(selected_make, selected_model, selected_from_year, selected_to_year):
-    # filtered_df = df[df.year <= selected_year[1]]
-    filtered_df = df[
-        (df.make == selected_make)
-        & (df.model == selected_model)
-        & (df.year <= selected_to_year)
-        & (df.year >= selected_from_year)
-        # & (df.make.isin(selected_make))   # this is good option for multiple choices avaliable
-    ]
-    traces = []
-    for i in filtered_df.make.unique():
-        df_by_make = filtered_df[filtered_df['make'] == i]
-        traces.append(go.Scatter(
-            x=df_by_make['mileage'],
-            y=df_by_make['price'],
-            text=["body type: "+str(make) for make in df_by_make['body']],
-            mode='markers',
-            opacity=0.7,
-            marker={
-                'size': 12,
-                'line': {'width': 0.5, 'color': 'white'}
-            },
-            name=i,
-            customdata=df_by_make.index,
-        ))
+    snapshot = get_reloader().snapshot
+    filtered_df = snapshot.index.query(selected_make, selected_model, selected_from_year, selected_to_year)
+    traces = build_traces(filtered_df, selected_make)
+    trend = trend_trace(snapshot.stats.get(selected_make, selected_model), filtered_df, selected_from_year,
+                        selected_to_year)
+    if trend is not None:
+        traces.append(trend)
 
     return {
         'data': traces,
@@ -231,5 +279,38 @@ def update_figure(selected_make, selected_model, selected_from_year, selected_to
     }
 
 
+# price statistics of chosen model, looked up in statistics precomputed for every data snapshot
+@app.callback(
+    dash.dependencies.Output('price-summary', 'children'),
+    [
+            dash.dependencies.Input('make-dropdown', 'value'),
+            dash.dependencies.Input('model-dropdown', 'value'),
+            dash.dependencies.Input('year-from-dropdown', 'value'),
+            dash.dependencies.Input('year-to-dropdown', 'value'),
+    ]
+)
+@callback_cache.memoize(data_version)
+def update_price_summary(selected_make, selected_model, selected_from_year, selected_to_year):
+    statistics = get_reloader().snapshot.stats.get(selected_make, selected_model)
+    if statistics is None:
+        return dcc.Markdown("**Price statistics**\n\nPick a car make and model.")
+    summary = statistics.summary(selected_from_year, selected_to_year)
+
+    currency = statistics.currency or "PLN"
+    lines = ["**Price statistics** (cars listed in {})".format(currency), "",
+             "| year | cars | 25% | median | 75% | of newest year price |",
+             "|---|---|---|---|---|---|"]
+    for row in summary['years']:
+        depreciation = "" if row['depreciation'] is None else "{:.0%}".format(row['depreciation'])
+        lines.append("| {} | {} | {:,.0f} | {:,.0f} | {:,.0f} | {} |".format(
+            row['year'], row['cars'], row['p25'], row['p50'], row['p75'], depreciation))
+    if summary['regression'] is not None:
+        slope, intercept = summary['regression']
+        lines += ["", "Price changes by {:,.0f} {} every 1000 km (price at 0 km: {:,.0f} {})".format(
+            slope * 1000, currency, intercept, currency)]
+    return dcc.Markdown("\n".join(lines))
+
+
 if __name__ == '__main__':
+    get_reloader()
     app.run_server()
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+QUANTILES = (0.25, 0.5, 0.75)
+GROUP_COLUMNS = ['make', 'model', 'year']
+# sufficient statistics of least squares fit of price against mileage, they can be summed over years
+SUM_COLUMNS = ['n', 'x', 'y', 'xx', 'xy']
+# names of quantile columns in flat tables, eg. p50 for median
+QUANTILE_COLUMNS = ["p{:.0f}".format(q * 100) for q in QUANTILES]
+
+
+class ModelStatistics(object):
+
+    def __init__(self, years, quantiles, counts, sums, currency: str = None):
+        """
+        Precomputed price statistics of one (make, model) pair, rows are sorted by production year
+        :param years: production years
+        :param quantiles: array of QUANTILES of price in every year, shape (len(years), len(QUANTILES))
+        :param counts: number of cars in every year
+        :param sums: regression sums (SUM_COLUMNS) in every year, shape (len(years), len(SUM_COLUMNS))
+        :param currency: currency of all prices, cars listed in other currencies are not included
+        """
+        self.years = years
+        self.quantiles = quantiles
+        self.counts = counts
+        self.sums = sums
+        self.currency = currency
+
+    def year_range(self, year_from=None, year_to=None) -> slice:
+        low = 0 if year_from is None else int(np.searchsorted(self.years, year_from, side='left'))
+        high = len(self.years) if year_to is None else int(np.searchsorted(self.years, year_to, side='right'))
+        return slice(low, max(low, high))
+
+    def regression(self, year_from=None, year_to=None):
+        """
+        Least squares fit price = intercept + slope * mileage of cars produced between given years
+        :return: (slope, intercept) tuple, None when fit is undefined (less than two distinct mileages)
+        """
+        n, x, y, xx, xy = self.sums[self.year_range(year_from, year_to)].sum(axis=0)
+        denominator = n * xx - x * x
+        if n < 2 or denominator <= 0:
+            return None
+        slope = (n * xy - x * y) / denominator
+        return float(slope), float((y - slope * x) / n)
+
+    def depreciation(self, year_from=None, year_to=None):
+        """
+        Depreciation curve - median price of every production year relative to median price of newest year
+        :return: list of (year, ratio) tuples
+        """
+        selected = self.year_range(year_from, year_to)
+        medians = self.quantiles[selected, QUANTILES.index(0.5)]
+        if len(medians) == 0 or medians[-1] <= 0:
+            return []
+        return list(zip(self.years[selected].tolist(), (medians / medians[-1]).tolist()))
+
+    def summary(self, year_from=None, year_to=None) -> dict:
+        """
+        :return: price quantiles, depreciation and mileage regression of cars produced between given years
+        """
+        selected = self.year_range(year_from, year_to)
+        depreciation = dict(self.depreciation(year_from, year_to))
+        rows = []
+        for year, count, quantiles in zip(self.years[selected].tolist(), self.counts[selected].tolist(),
+                                          self.quantiles[selected].tolist()):
+            rows.append(dict(year=year, cars=count, depreciation=depreciation.get(year),
+                             **dict(zip(QUANTILE_COLUMNS, quantiles))))
+        return dict(years=rows, regression=self.regression(year_from, year_to))
+
+
+class PriceStatistics(object):
+
+    def __init__(self, index, models: dict = None):
+        """
+        Price quantiles per (make, model, year), price against mileage regressions and depreciation curves computed
+        in one vectorized pass, so callbacks only look them up
+        :param index: dataset_index.DatasetIndex of cars
+        :param models: already computed statistics, used by updated()
+        """
+        self.models = group_statistics(index.frame) if models is None else models
+
+    def updated(self, index, appended):
+        """
+        Method compute statistics after appending rows, only (make, model) pairs present in appended rows are computed
+        again (exact quantiles need all prices of a group)
+        :param index: DatasetIndex of whole data, including appended rows
+        :param appended: DataFrame with appended rows
+        :return: new PriceStatistics, this one is not modified
+        """
+        models = dict(self.models)
+        touched = set(zip(appended['make'].tolist(), appended['model'].tolist()))
+        positions = [np.arange(*index.groups[key]) for key in touched if key in index.groups]
+        if positions:
+            models.update(group_statistics(index.frame.iloc[np.concatenate(positions)]))
+        return PriceStatistics(index, models)
+
+    def to_frame(self):
+        """
+        :return: flat DataFrame with GROUP_COLUMNS, currency, QUANTILE_COLUMNS and SUM_COLUMNS, eg. to be stored in a
+        file
+        """
+        keys = list(self.models)
+        lengths = [len(self.models[key].years) for key in keys]
+        columns = {
+            'make': np.repeat(np.array([make for make, _ in keys], dtype=object), lengths),
+            'model': np.repeat(np.array([model for _, model in keys], dtype=object), lengths),
+            'year': np.concatenate([self.models[key].years for key in keys] or [np.array([], dtype='int16')]),
+            'currency': np.repeat(np.array([self.models[key].currency for key in keys], dtype=object), lengths),
+        }
+        quantiles = np.concatenate([self.models[key].quantiles for key in keys] or [np.empty((0, len(QUANTILES)))])
+        sums = np.concatenate([self.models[key].sums for key in keys] or [np.empty((0, len(SUM_COLUMNS)))])
+        columns.update(zip(QUANTILE_COLUMNS, quantiles.T))
+        columns.update(zip(SUM_COLUMNS, sums.T))
+        return pd.DataFrame(columns)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """
+        Method load statistics saved by to_frame() without computing them again
+        :param frame: DataFrame returned by to_frame()
+        :return: PriceStatistics
+        """
+        table = frame.set_index(GROUP_COLUMNS).rename(columns=dict(zip(QUANTILE_COLUMNS, QUANTILES))).sort_index()
+        return cls(None, models_from_table(table))
+
+    def __len__(self):
+        return len(self.models)
+
+    def get(self, make, model):
+        """
+        :return: ModelStatistics of given make and model, None when there are no such cars
+        """
+        return self.models.get((make, model))
+
+
+def group_statistics(cars) -> dict:
+    """
+    :param cars: DataFrame with dataset_loader.CARS_DTYPES columns
+    :return: dict mapping (make, model) to ModelStatistics
+    """
+    if len(cars) == 0:
+        return dict()
+    # prices in different currencies can't be aggregated, every model keeps only cars listed in its most common one
+    listings = cars.groupby(['make', 'model', 'currency'], observed=True).size().sort_values(ascending=False,
+                                                                                             kind='stable')
+    listings = listings[~listings.index.droplevel(2).duplicated()]
+    currencies = {(make, model): currency for make, model, currency in listings.index}
+    if cars['currency'].nunique() > 1:
+        chosen = pd.MultiIndex.from_arrays([cars['make'], cars['model'], cars['currency']]).isin(listings.index)
+        cars = cars[chosen]
+
+    keys = [cars[column] for column in GROUP_COLUMNS]
+    prices = cars['price'].astype('float64')
+    quantiles = prices.groupby(keys, observed=True).quantile(list(QUANTILES)).unstack()
+
+    mileage = cars['mileage'].astype('float64')
+    terms = pd.DataFrame({'n': 1.0, 'x': mileage, 'y': prices, 'xx': mileage * mileage, 'xy': mileage * prices})
+    sums = terms.groupby(keys, observed=True).sum()
+
+    table = sums.join(quantiles).sort_index()
+    table['currency'] = [currencies[make, model] for make, model, _ in table.index]
+    return models_from_table(table)
+
+
+def models_from_table(table) -> dict:
+    """
+    :param table: DataFrame indexed by sorted (make, model, year) with SUM_COLUMNS, QUANTILES and currency columns
+    :return: dict mapping (make, model) to ModelStatistics
+    """
+    if len(table) == 0:
+        return dict()
+    years = table.index.get_level_values(2).to_numpy()
+    currencies = table['currency'].tolist() if 'currency' in table else [None] * len(table)
+    quantile_values = table[list(QUANTILES)].to_numpy()
+    sum_values = table[SUM_COLUMNS].to_numpy()
+    counts = sum_values[:, 0].astype('int64')
+
+    models = dict()
+    pairs = list(zip(table.index.get_level_values(0), table.index.get_level_values(1)))
+    starts = [0] + [i for i in range(1, len(pairs)) if pairs[i] != pairs[i - 1]] + [len(pairs)]
+    for start, stop in zip(starts[:-1], starts[1:]):
+        models[pairs[start]] = ModelStatistics(years[start:stop], quantile_values[start:stop], counts[start:stop],
+                                               sum_values[start:stop], currencies[start])
+    return models
@@ -0,0 +1,172 @@
+import asyncio
+import email.utils
+import threading
+import time
+from collections import deque
+
+
+def parse_retry_after(value) -> float:
+    """
+    :param value: Retry-After header - number of seconds or HTTP date
+    :return: seconds to wait, None when header is missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def percentile(values: list, q: float):
+    """
+    :return: nearest-rank percentile q (0-100) of values, None for no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class AdaptiveThrottle(object):
+
+    BACKOFF_STATUSES = (429, 503)
+
+    def __init__(self, initial_limit: float = 4, min_limit: float = 1, max_limit: float = 64,
+                 decrease_factor: float = 0.5, latency_target: float = None, default_pause: float = 1.0,
+                 window: int = 200):
+        """
+        AIMD limiter of requests in flight. Limit grows by one after every limit successful responses and is cut by
+        decrease_factor on 429/503 responses, timeouts and connection errors, or when latency exceeds latency_target.
+        Retry-After of throttling responses pauses all requests.
+        :param initial_limit: number of requests allowed in flight at start
+        :param min_limit: lowest limit after backing off
+        :param max_limit: highest limit reached by growing
+        :param decrease_factor: limit multiplier applied on congestion
+        :param latency_target: seconds, slower responses are treated as congestion, None disables latency check
+        :param default_pause: seconds of pause after 429/503 responses without Retry-After header
+        :param window: number of recent responses used for latency percentiles and throughput
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.default_pause = default_pause
+        self.requests = 0
+        self.errors = 0
+        self.backoffs = 0
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latencies = deque(maxlen=window)
+        self._finished = deque(maxlen=window)
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self) -> float:
+        """
+        Method block until a request is allowed to start
+        :return: start time to be passed to release()
+        """
+        with self._condition:
+            while True:
+                started, wait = self._try_acquire()
+                if started is not None:
+                    return started
+                self._condition.wait(wait)
+
+    async def acquire_async(self, poll_interval: float = 0.01) -> float:
+        """
+        Coroutine version of acquire(), waits without blocking the event loop
+        """
+        while True:
+            with self._condition:
+                started, wait = self._try_acquire()
+            if started is not None:
+                return started
+            await asyncio.sleep(poll_interval if wait is None else min(wait, 1.0))
+
+    def release(self, started: float, status: int = None, retry_after=None, error: bool = False):
+        """
+        Method finish a request started with acquire() and adjust the limit
+        :param started: value returned by acquire()
+        :param status: response status code, None when request failed
+        :param retry_after: Retry-After header of the response
+        :param error: True for timeouts and connection errors
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._condition:
+            self._in_flight -= 1
+            self.requests += 1
+            self._latencies.append(latency)
+            self._finished.append(now)
+
+            if error or status in self.BACKOFF_STATUSES:
+                self.errors += 1
+                self._decrease(started, now)
+                pause = None
+                if status in self.BACKOFF_STATUSES:
+                    pause = parse_retry_after(retry_after)
+                    if pause is None:
+                        pause = self.default_pause
+                if pause:
+                    self._paused_until = max(self._paused_until, now + pause)
+            elif self.latency_target is not None and latency > self.latency_target:
+                self._decrease(started, now)
+            elif self._in_flight + 1 >= self.limit:
+                # limit grows only when it was actually used
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        :return: current limit and load, throughput (responses per second) and latency percentiles of recent responses
+        """
+        with self._condition:
+            latencies = list(self._latencies)
+            finished = list(self._finished)
+            now = time.monotonic()
+            stats = dict(
+                limit=self.limit,
+                in_flight=self._in_flight,
+                paused_for=max(0.0, self._paused_until - now),
+                requests=self.requests,
+                errors=self.errors,
+                backoffs=self.backoffs,
+            )
+        elapsed = now - finished[0] if len(finished) > 1 else 0
+        stats['throughput'] = (len(finished) - 1) / elapsed if elapsed > 0 else 0.0
+        for q in (50, 90, 99):
+            stats['latency_p{}'.format(q)] = percentile(latencies, q)
+        return stats
+
+    def _try_acquire(self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            return None, self._paused_until - now
+        if self._in_flight >= self.limit:
+            return None, None
+        self._in_flight += 1
+        return now, None
+
+    def _decrease(self, started: float, now: float):
+        # requests sent before last decrease saw the old limit, they must not cut it again
+        if started < self._last_decrease:
+            return
+        self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+        self._last_decrease = now
+        self.backoffs += 1
@@ -0,0 +1,67 @@
+import re
+
+# opening tags of the only page regions car details are taken from, located by their class names first since plain
+# bytes search is much faster than a regex scan of the whole page
+OFFER_PARAMS_MARKER = b'offer-params'
+PRICE_MARKER = b'offer-price__number'
+OFFER_PARAMS_START = re.compile(rb'<div\b[^>]*\bclass="(?:[^"]*\s)?offer-params(?:\s[^"]*)?"', re.IGNORECASE)
+PRICE_START = re.compile(rb'<span\b[^>]*\bclass="(?:[^"]*\s)?offer-price__number(?:\s[^"]*)?"', re.IGNORECASE)
+TAGS = {
+    b'div': re.compile(rb'<(/?)div[\s>/]', re.IGNORECASE),
+    b'span': re.compile(rb'<(/?)span[\s>/]', re.IGNORECASE),
+}
+
+
+def find_opening(content: bytes, marker: bytes, start_pattern):
+    """
+    :return: match of start_pattern at the first tag containing marker, None when there is no such tag
+    """
+    position = content.find(marker)
+    while position != -1:
+        tag_start = content.rfind(b'<', 0, position)
+        if tag_start != -1:
+            opening = start_pattern.match(content, tag_start)
+            if opening is not None:
+                return opening
+        position = content.find(marker, position + len(marker))
+    return None
+
+
+def element_range(content: bytes, marker: bytes, start_pattern, tag: bytes):
+    """
+    Method locate element in raw HTML bytes by its opening tag and find its matching closing tag by counting nested
+    tags of the same name
+    :param content: raw HTML code
+    :param marker: class name of the element
+    :param start_pattern: compiled regex matching opening tag of the element
+    :param tag: element tag name, b'div' or b'span'
+    :return: (start, end) byte offsets of the element, None when it's not found or not closed
+    """
+    opening = find_opening(content, marker, start_pattern)
+    if opening is None:
+        return None
+    depth = 0
+    for match in TAGS[tag].finditer(content, opening.start()):
+        if match.group(1):
+            depth -= 1
+            if depth == 0:
+                end = content.find(b'>', match.end() - 1)
+                return (opening.start(), end + 1) if end != -1 else None
+        else:
+            depth += 1
+    return None
+
+
+def extract_regions(content: bytes):
+    """
+    Method cut offer parameters and price elements out of an offer page without decoding or parsing the rest of it
+    :param content: raw HTML code of an offer page
+    :return: bytes with both elements, None when any of them can't be located
+    """
+    params = element_range(content, OFFER_PARAMS_MARKER, OFFER_PARAMS_START, b'div')
+    if params is None:
+        return None
+    price = element_range(content, PRICE_MARKER, PRICE_START, b'span')
+    if price is None:
+        return None
+    return content[params[0]:params[1]] + b'\n' + content[price[0]:price[1]]
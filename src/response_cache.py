@@ -0,0 +1,209 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class ResponseCache(object):
+
+    def __init__(self, directory: str = 'http_cache', ttl: float = 7 * 24 * 3600, max_size: int = 1024 ** 3):
+        """
+        On-disk cache of HTTP responses. Every url has a small JSON entry pointing to a gzip compressed body stored
+        under the hash of its content, so identical pages are kept only once.
+        :param directory: cache directory, created when missing
+        :param ttl: seconds after which an entry is expired, None keeps entries forever
+        :param max_size: maximum number of bytes of compressed bodies, least recently used entries are evicted above it
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries_dir = os.path.join(directory, 'entries')
+        self._blobs_dir = os.path.join(directory, 'blobs')
+        os.makedirs(self._entries_dir, exist_ok=True)
+        os.makedirs(self._blobs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(self._blob_sizes().values())
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, url: str):
+        """
+        Method return cached response for given url
+        :param url: requested url
+        :return: requests Response object rebuilt from cache or None when url is not cached or entry expired
+        """
+        entry_path = self._entry_path(url)
+        response = self._load(entry_path)
+        if response is not None:
+            # touching entry keeps track of recent use for size based eviction
+            try:
+                os.utime(entry_path)
+            except FileNotFoundError:
+                pass
+        return response
+
+    def put(self, url: str, content: bytes, headers=None, status_code: int = 200, encoding: str = None):
+        """
+        Method store response body and metadata for given url
+        :param url: requested url
+        :param content: raw response body
+        :param headers: response headers
+        :param status_code: response HTTP status
+        :param encoding: encoding used to decode body into text
+        """
+        blob = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(blob)
+        entry = {
+            'url': url,
+            'status_code': status_code,
+            'headers': dict(headers or {}),
+            'encoding': encoding,
+            'blob': blob,
+            'stored_at': time.time(),
+        }
+        with self._lock:
+            if not os.path.exists(blob_path):
+                self._write_atomic(blob_path, gzip.compress(content))
+                self._size += os.path.getsize(blob_path)
+            self._write_atomic(self._entry_path(url), json.dumps(entry).encode('utf-8'))
+
+        if self.max_size is not None and self._size > self.max_size:
+            self.evict()
+
+    def responses(self):
+        """
+        Generator yielding every fresh cached response
+        """
+        for entry_path in self._entry_paths():
+            response = self._load(entry_path)
+            if response is not None:
+                yield response
+
+    def evict(self):
+        """
+        Method remove expired entries, then least recently used entries until compressed bodies fit in max_size,
+        and finally bodies no entry points to
+        """
+        with self._lock:
+            entries = []
+            for entry_path in self._entry_paths():
+                entry = self._read_entry(entry_path)
+                if entry is None:
+                    continue
+                if self._is_expired(entry):
+                    self._remove_entry(entry_path)
+                    continue
+                entries.append((os.path.getmtime(entry_path), entry_path, entry['blob']))
+
+            blob_sizes = self._blob_sizes()
+            referenced = dict()
+            for _, _, blob in entries:
+                referenced[blob] = referenced.get(blob, 0) + 1
+            size = sum(blob_sizes.get(blob, 0) for blob in referenced)
+
+            entries.sort()
+            for _, entry_path, blob in entries:
+                if self.max_size is None or size <= self.max_size:
+                    break
+                self._remove_entry(entry_path)
+                referenced[blob] -= 1
+                if referenced[blob] == 0:
+                    del referenced[blob]
+                    size -= blob_sizes.get(blob, 0)
+
+            for blob in blob_sizes:
+                if blob not in referenced:
+                    try:
+                        os.remove(self._blob_path(blob))
+                    except FileNotFoundError:
+                        pass
+            self._size = size
+
+    def clear(self):
+        for entry_path in self._entry_paths():
+            self._remove_entry(entry_path)
+        self.evict()
+
+    def _load(self, entry_path: str):
+        entry = self._read_entry(entry_path)
+        if entry is None:
+            return None
+        if self._is_expired(entry):
+            self._remove_entry(entry_path)
+            return None
+
+        try:
+            with gzip.open(self._blob_path(entry['blob']), 'rb') as blob:
+                content = blob.read()
+        except (OSError, EOFError):
+            self._remove_entry(entry_path)
+            return None
+        return self.build_response(entry, content)
+
+    def _entry_paths(self) -> list:
+        return [os.path.join(self._entries_dir, name) for name in os.listdir(self._entries_dir)
+                if name.endswith('.json')]
+
+    def _blob_sizes(self) -> dict:
+        blob_sizes = dict()
+        for name in os.listdir(self._blobs_dir):
+            if name.endswith('.gz'):
+                blob_sizes[name[:-len('.gz')]] = os.path.getsize(os.path.join(self._blobs_dir, name))
+        return blob_sizes
+
+    @staticmethod
+    def build_response(entry: dict, content: bytes):
+        response = requests.Response()
+        response.url = entry['url']
+        response.status_code = entry['status_code']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = entry['encoding']
+        response._content = content
+        return response
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _is_expired(self, entry: dict) -> bool:
+        return self.ttl is not None and time.time() - entry['stored_at'] > self.ttl
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self._entries_dir, self.key(url) + '.json')
+
+    def _blob_path(self, blob: str) -> str:
+        return os.path.join(self._blobs_dir, blob + '.gz')
+
+    @staticmethod
+    def _read_entry(entry_path: str):
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                return json.loads(entry_file.read().decode('utf-8'))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _remove_entry(entry_path: str):
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+from dataset_index import DatasetIndex
+from dataset_reloader import DatasetReloader, DatasetSnapshot
+from price_stats import PriceStatistics
+
+CURRENT = 'CURRENT'  # file with name of the current version, replaced atomically when a new one is published
+LOCK = 'LOCK'  # flock file serializing publishing processes
+METADATA_KEY = b'car_prices'
+ROW_ID = 'row_id'  # original row labels, customdata of figure points refers to them
+
+
+def version_names(directory: str) -> list:
+    """
+    :return: names of versions published in directory, oldest first
+    """
+    paths = glob.glob(os.path.join(directory, 'cars-*.arrow'))
+    return sorted(os.path.basename(path)[:-len('.arrow')] for path in paths if not path.endswith('.stats.arrow'))
+
+
+def current_version(directory: str):
+    """
+    :return: name of the current version, None when nothing was published yet
+    """
+    try:
+        with open(os.path.join(directory, CURRENT)) as current_file:
+            return current_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+@contextlib.contextmanager
+def locked(directory: str, exclusive: bool = True, blocking: bool = True):
+    """
+    Context manager holding flock of directory's LOCK file - exclusive while publishing, shared while mapping the
+    current version, so versions are numbered, written and removed by one process at a time
+    :param blocking: False to give up immediately when the lock is held by someone else
+    :return: True when the lock is held, False when it's taken (only when not blocking)
+    """
+    if fcntl is None or not os.path.isdir(directory):
+        yield True
+        return
+    with open(os.path.join(directory, LOCK), 'a') as lock_file:
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(lock_file, flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_atomically(path: str, write):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_table(path: str, frame, metadata: dict = None):
+    """
+    Method write DataFrame to an uncompressed Arrow IPC file, which can be memory-mapped without copying
+    """
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    if metadata is not None:
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[METADATA_KEY] = json.dumps(metadata).encode('utf-8')
+        table = table.replace_schema_metadata(schema_metadata)
+
+    def write(tmp_path):
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    write_atomically(path, write)
+
+
+def read_table(path: str):
+    """
+    :return: Arrow table with buffers pointing into read-only memory mapping of the file
+    """
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def publish(snapshot: DatasetSnapshot, directory: str, keep: int = 3, source: dict = None, blocking: bool = True):
+    """
+    Method write snapshot data (sorted the way DatasetIndex keeps it), its index and price statistics as a new version
+    and make it current. Old versions are removed, those still mapped by readers stay readable until unmapped.
+    Processes publishing into the same directory wait for each other.
+    :param snapshot: DatasetSnapshot, eg. DatasetReloader.snapshot
+    :param directory: shared dataset directory
+    :param keep: number of newest versions kept
+    :param source: JSON serializable description of data source saved with the version, see version_metadata()
+    :param blocking: False to publish nothing when another process is publishing at the moment
+    :return: name of the published version, None when nothing was published
+    """
+    if pa is None:
+        raise ImportError("shared dataset requires pyarrow package")
+    os.makedirs(directory, exist_ok=True)
+    with locked(directory, blocking=blocking) as acquired:
+        if not acquired:
+            return None
+        names = version_names(directory)
+        number = int(names[-1].split('-')[1]) + 1 if names else 1
+        name = "cars-{:08d}".format(number)
+
+        metadata = dict(version=snapshot.version, offset=snapshot.offset, data_id=snapshot.data_id,
+                        index=snapshot.index.state(), source=source)
+        write_table(os.path.join(directory, name + '.stats.arrow'), snapshot.stats.to_frame())
+        write_table(os.path.join(directory, name + '.arrow'), snapshot.index.frame.reset_index(names=ROW_ID), metadata)
+
+        def write_current(tmp_path):
+            with open(tmp_path, 'w') as current_file:
+                current_file.write(name)
+        write_atomically(os.path.join(directory, CURRENT), write_current)
+
+        for old_name in version_names(directory)[:-keep]:
+            for suffix in ('.arrow', '.stats.arrow'):
+                try:
+                    os.remove(os.path.join(directory, old_name + suffix))
+                except FileNotFoundError:
+                    pass
+        return name
+
+
+def version_metadata(directory: str, name: str) -> dict:
+    """
+    :return: version, offset, data_id, index and source metadata of a published version, data is not read
+    """
+    with pa.memory_map(os.path.join(directory, name + '.arrow'), 'r') as source:
+        return json.loads(pa.ipc.open_file(source).schema.metadata[METADATA_KEY])
+
+
+def open_snapshot(directory: str, name: str) -> DatasetSnapshot:
+    """
+    Method map published version into a DatasetSnapshot. Numeric columns and categorical codes are views of the
+    mapping shared through the page cache, neither the data nor its index and statistics are computed again.
+    :param directory: shared dataset directory
+    :param name: version name
+    :return: DatasetSnapshot with df sorted by make, model and year and indexed by original row labels
+    """
+    table = read_table(os.path.join(directory, name + '.arrow'))
+    metadata = json.loads(table.schema.metadata[METADATA_KEY])
+    frame = table.drop_columns([ROW_ID]).to_pandas(split_blocks=True)
+    frame.index = pd.Index(table.column(ROW_ID).to_numpy())
+    index = DatasetIndex.restore(frame, metadata['index'])
+    stats = PriceStatistics.from_frame(read_table(os.path.join(directory, name + '.stats.arrow')).to_pandas())
+    return DatasetSnapshot(frame, metadata['version'], metadata['offset'], index=index, stats=stats,
+                           data_id=metadata.get('data_id'))
+
+
+class SharedDatasetReader(object):
+
+    def __init__(self, directory: str, interval: float = 5.0):
+        """
+        Read-only view of a dataset published with publish(), for every server worker. Current version is mapped
+        at start and the reader switches to a newer one with a single assignment when it's published.
+        :param directory: shared dataset directory
+        :param interval: seconds between checks for a new version
+        """
+        if pa is None:
+            raise ImportError("shared dataset requires pyarrow package")
+        self.directory = directory
+        self.interval = interval
+        self.name = None
+        self._snapshot = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._refresh_lock = threading.Lock()
+        if not self.refresh():
+            raise FileNotFoundError("No dataset published in {}".format(directory))
+
+    @property
+    def snapshot(self) -> DatasetSnapshot:
+        return self._snapshot
+
+    def refresh(self) -> bool:
+        """
+        Method map the current version when it changed
+        :return: True when a new snapshot was published
+        """
+        with self._refresh_lock, locked(self.directory, exclusive=False):
+            name = current_version(self.directory)
+            if name is None or name == self.name:
+                return False
+            snapshot = open_snapshot(self.directory, name)
+            if snapshot.data_id is None:
+                # version names are the same in every worker
+                snapshot.data_id = name
+            self._snapshot = snapshot
+            self.name = name
+            return True
+
+    def start(self):
+        """
+        Method start daemon thread checking for new versions every interval seconds
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except (OSError, ValueError) as e:
+                print(e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish cars dataset as memory-mapped files shared by plot.py "
+                                                 "server workers")
+    parser.add_argument('csv', nargs='?', default='../data/cars.csv', help="csv file appended by the crawler")
+    parser.add_argument('directory', nargs='?', default='../data/cars_shared', help="shared dataset directory")
+    parser.add_argument('--parquet', default=None, help="parquet_sink dataset used instead of csv when present")
+    parser.add_argument('--watch', action='store_true', help="keep publishing rows appended to the csv file")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between checks of the csv file")
+    parser.add_argument('--keep', type=int, default=3, help="number of newest versions kept")
+    args = parser.parse_args(argv)
+
+    reloader = DatasetReloader(args.csv, args.parquet, args.interval)
+    print("published", publish(reloader.snapshot, args.directory, args.keep))
+    while args.watch:
+        time.sleep(args.interval)
+        if reloader.refresh():
+            print("published", publish(reloader.snapshot, args.directory, args.keep))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,188 @@
 import unittest
+import contextlib
+import io
 import os.path
 import sys
 import csv
+import hashlib
+import importlib.util
+import json
+import tempfile
+import threading
+import time
+import warnings
+from http.server import HTTPServer, BaseHTTPRequestHandler
 
 import requests
 from bs4 import BeautifulSoup
 
 sys.path.append('..')
-from src.car_spider import CarSpider
+sys.path.append('../src')  # plot.py helpers are imported like plot.py does, as top level modules
+from src.car_spider import CarSpider, main as car_spider_main
 from src.car_ad_parser import CarParser
+from src import async_crawler
+from src.http_session import HttpSession
+from src.rate_controller import AdaptiveThrottle, parse_retry_after
+from src import parser_engines
+from src import region_extractor
+from src.response_cache import ResponseCache
+from src.ad_index import SeenAdIndex
+from src.csv_writer import BatchCsvWriter, FIELDNAMES
+from src import parquet_sink
+from src import crawl_scheduler
+from src.crawl_metrics import CrawlMetrics, MetricsExporter, SamplingProfiler
+from src.link_frontier import LinkFrontier
+from src.crawl_checkpoint import CrawlCheckpoint
+from callback_cache import CallbackCache, DiskCacheBackend
+
+try:
+    import numpy as np
+    import pandas as pd
+    from dataset_index import DatasetIndex
+    import dataset_loader
+    from dataset_reloader import DatasetReloader, DatasetSnapshot
+    from price_stats import PriceStatistics
+except ImportError:
+    pd = None
+
+try:
+    import shared_dataset
+    from dataset_cache import SnapshotCache
+except ImportError:
+    shared_dataset = None
+
+try:
+    import figure_builder
+except ImportError:
+    figure_builder = None
+
+try:
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        import plot  # importing callbacks does not load data
+except ImportError:
+    plot = None
+
+try:
+    from benchmarks import run as benchmarks
+    from benchmarks.stand_in import StandInServer, load_template, render_ad
+except ImportError:
+    benchmarks = None
+
+
+class OtomotoStandInHandler(BaseHTTPRequestHandler):
+    """
+    Minimal local stand-in for otomoto serving listing pages and ad pages built from offer_params.html
+    """
+    ads_per_page = 3
+    pages = 2
+    price_html = """
+        <div class="offer-price" data-price="130 000">
+        <span class="offer-price__number">130 000        <span class="offer-price__currency">PLN</span>
+        </span></div>
+    """
+
+    pager = False  # render pagination links up to the last page
+    repeat_last_page = False  # pages past the last one repeat it instead of being empty
+    overlap = 0  # number of ads moved from the end of a listing page to the beginning of the next one
+
+    flaky_failures = {}
+    throttled_requests = {}
+    missing_ads = set()
+    unpriced_ads = set()  # ads with a price text without digits, eg. "Zapytaj o cenę"
+    not_modified = 0
+
+    def do_GET(self):
+        if self.path.startswith("/flaky/"):
+            # fail requested number of times before answering
+            failures_left = self.flaky_failures.get(self.path, int(self.path.split("/")[-1]))
+            self.flaky_failures[self.path] = failures_left - 1
+            if failures_left > 0:
+                self.send_error(503)
+                return
+            body = b"ok"
+        elif self.path.startswith("/throttled/"):
+            # answer 429 with Retry-After requested number of times
+            requests_left = self.throttled_requests.get(self.path, int(self.path.split("/")[-1]))
+            self.throttled_requests[self.path] = requests_left - 1
+            if requests_left > 0:
+                self.send_response(429)
+                self.send_header("Retry-After", "0.2")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = b"ok"
+        elif "page=" in self.path:
+            page = int(self.path.split("page=")[1])
+            body = self.listing_page(page).encode('cp1250')
+        elif self.path.startswith("/oferta/"):
+            if int(self.path.split("-ID")[1].split(".")[0]) in self.missing_ads:
+                self.send_error(404)
+                return
+            price_html = self.price_html
+            if int(self.path.split("-ID")[1].split(".")[0]) in self.unpriced_ads:
+                price_html = price_html.replace("130 000", "Zapytaj o cenę")
+            with open("offer_params.html", encoding='cp1250') as html_file:
+                body = (html_file.read() + price_html).encode('cp1250')
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                OtomotoStandInHandler.not_modified += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        if self.path.startswith("/oferta/"):
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html; charset=windows-1250")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def listing_page(self, page: int) -> str:
+        if page > self.pages:
+            if not self.repeat_last_page:
+                return "<html><body></body></html>"
+            page = self.pages
+        host = "http://{}:{}".format(*self.server.server_address)
+        links = []
+        for i in range(self.ads_per_page):
+            ad_id = (page - 1) * (self.ads_per_page - self.overlap) + i
+            links.append('<a class="offer-title__link" href="{}/oferta/audi-s3-ID{}.html">ad</a>'.format(host, ad_id))
+        if self.pager:
+            links.append('<ul class="om-pager rel">')
+            links.extend('<li><a href="{}/osobowe/audi/s3/?page={}"><span class="page">{}</span></a></li>'
+                         .format(host, number, number) for number in range(1, self.pages + 1))
+            links.append('</ul>')
+        return "<html><body>" + "".join(links) + "</body></html>"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), OtomotoStandInHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.starting_page = "http://127.0.0.1:{}/osobowe/audi/s3/".format(self.server.server_address[1])
+        self.filename = 'test_crawl.csv'
+
+    def read_rows(self):
+        with open(self.filename, "r", encoding='cp1250') as csvfile:
+            rows = list(csv.reader(csvfile, delimiter=','))
+        self.assertEqual(rows[0], FIELDNAMES)
+        return rows[1:]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
 
 
 class CarParserTestCase(unittest.TestCase):
@@ -96,12 +270,13 @@ class CarParserTestCase(unittest.TestCase):
             'type': "sedan",
             'no_accidents': 'True'
         }
-        dict_values = list(car_details.values())
+        dict_values = list(car_details.values()) + ['', '']
         self.car_parser.save_data_into_csv_file(car_details)
         self.car_parser.close_file()
 
         with open(self.filename, "r") as csvfile:
             read_csv = csv.reader(csvfile, delimiter=',')
+            self.assertListEqual(next(read_csv), FIELDNAMES, "header is written once, at the top of the file")
 
             counter = 0
             for row in read_csv:
@@ -163,6 +338,957 @@ class CarParserTestCase(unittest.TestCase):
         self.car_parser.close_file()
 
 
+class CrawlSchedulerTestCase(LocalServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'cars.csv')
+        self.shards = os.path.join(self.directory.name, 'shards')
+
+    def write_shard(self, name, rows, urls):
+        path = os.path.join(self.directory.name, name)
+        writer = BatchCsvWriter(path)
+        writer.on_flush = crawl_scheduler.ad_ids_recorder(path)
+        for row, url in zip(rows, urls):
+            writer.write(dict(zip(FIELDNAMES, row)), url)
+        writer.close()
+        return path
+
+    def test_crawl_in_worker_processes(self):
+        urls = [self.starting_page, self.starting_page.replace("/s3/", "/a4/")]
+        scheduler = crawl_scheduler.CrawlScheduler(urls, pages_limit=2, workers=2, output=self.filename,
+                                                   shard_directory=self.shards)
+        scheduler.crawl()
+        shards = scheduler.shards()
+        self.assertTrue(1 <= len(shards) <= 2)
+        shard_rows = 0
+        for shard in shards:
+            with open(shard, encoding='cp1250') as csv_file:
+                shard_rows += len(list(csv.reader(csv_file))) - 1
+        self.assertEqual(shard_rows, 12)
+
+        # both starting urls list the same 6 ads, all of them with equal details
+        self.assertEqual(crawl_scheduler.merge_shards(shards, self.filename, remove=True), 6)
+        self.assertEqual(len(self.read_rows()), 6)
+        self.assertEqual(sorted(crawl_scheduler.read_ad_ids(self.filename)), [str(ad_id) for ad_id in range(6)])
+        self.assertEqual(scheduler.shards(), [])
+        self.assertEqual(os.listdir(self.shards), [])
+
+    def test_merge_removes_duplicates(self):
+        audi = ["audi", "a4", "2010", "150000", "diesel", "sedan", "True", "30000", "PLN"]
+        bmw = ["bmw", "x5", "2018", "20000", "diesel", "suv", "True", "250000", "PLN"]
+        first = self.write_shard('first.csv', [audi, bmw], ["/oferta/audi-a4-ID1.html", "/oferta/bmw-x5-ID2.html"])
+        second = self.write_shard('second.csv', [bmw, audi, audi[:2] + ["2011"] + audi[3:], audi],
+                                  ["/oferta/bmw-x5-ID2.html#x", "/oferta/audi-a4-ID1.html", "/oferta/audi-a4-ID3.html",
+                                   "/oferta/audi-a4-ID4.html"])
+
+        self.assertEqual(crawl_scheduler.merge_shards([first, second], self.filename), 4,
+                         "another ad with the same details is kept")
+        self.assertEqual(crawl_scheduler.merge_shards([second], self.filename), 0, "ads already in output")
+        self.assertEqual(self.read_rows(), [audi, bmw, audi[:2] + ["2011"] + audi[3:], audi])
+        third = self.write_shard('third.csv', [audi], ["/oferta/audi-a4-ID5.html"])
+        self.assertEqual(crawl_scheduler.merge_shards([third], self.filename), 1, "new ad equal to an old row")
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+
+class ResponseCacheTestCase(LocalServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def test_put_and_get(self):
+        cache = ResponseCache(self.cache_dir.name)
+        cache.put("http://a/1", b"same body", {'Content-Type': 'text/html'}, encoding='utf-8')
+        cache.put("http://a/2", b"same body")
+        response = cache.get("http://a/1")
+
+        self.assertEqual(response.text, "same body")
+        self.assertEqual(response.headers['content-type'], 'text/html')
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir.name, 'blobs'))), 1, "identical bodies shared")
+        self.assertIsNone(cache.get("http://a/3"))
+
+    def test_ttl_eviction(self):
+        cache = ResponseCache(self.cache_dir.name, ttl=0.05)
+        cache.put("http://a/1", b"body")
+        time.sleep(0.1)
+
+        self.assertIsNone(cache.get("http://a/1"))
+        cache.evict()
+        self.assertEqual(cache.size, 0)
+
+    def test_size_eviction(self):
+        cache = ResponseCache(self.cache_dir.name, ttl=None, max_size=None)
+        cache.put("http://a/old", os.urandom(1000))
+        old_entry = cache._entry_path("http://a/old")
+        os.utime(old_entry, (time.time() - 60, time.time() - 60))
+        cache.put("http://a/new", os.urandom(1000))
+
+        cache.max_size = 1500
+        cache.evict()
+        self.assertIsNone(cache.get("http://a/old"))
+        self.assertIsNotNone(cache.get("http://a/new"))
+        self.assertLessEqual(cache.size, 1500)
+
+    def test_reparse_from_cache_offline(self):
+        cache = ResponseCache(self.cache_dir.name)
+        spider = CarSpider(self.starting_page, 2, self.filename, session=HttpSession(cache=cache))
+        spider.crawl()
+        crawled_rows = self.read_rows()
+        os.remove(self.filename)
+        self.server.shutdown()
+
+        parser = CarParser(self.filename, HttpSession(cache=cache, offline=True))
+        parser.save_car_details_from_cache(cache)
+        parser.close_file()
+
+        self.assertEqual(len(crawled_rows), 6)
+        self.assertEqual(sorted(self.read_rows()), sorted(crawled_rows))
+        with self.assertRaises(requests.ConnectionError):
+            parser.session.get(self.starting_page + "?page=9")
+
+    def tearDown(self):
+        super().tearDown()
+        self.cache_dir.cleanup()
+
+
+class SeenAdIndexTestCase(LocalServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.index = SeenAdIndex(':memory:')
+        OtomotoStandInHandler.not_modified = 0
+
+    def crawl(self):
+        spider = CarSpider(self.starting_page, 2, self.filename, seen_index=self.index)
+        spider.crawl()
+
+    def test_ad_id(self):
+        self.assertEqual(SeenAdIndex.ad_id("https://www.otomoto.pl/oferta/audi-s3-ID6A1bC2.html#abc"), "6A1bC2")
+        self.assertEqual(SeenAdIndex.ad_id("https://example.com/ad?x=1"), "https://example.com/ad")
+
+    def test_unchanged_ads_are_not_written_again(self):
+        self.crawl()
+        self.crawl()
+
+        self.assertEqual(len(self.read_rows()), 6)
+        self.assertEqual(len(self.index), 6)
+        self.assertEqual(OtomotoStandInHandler.not_modified, 6, "second crawl sends conditional requests")
+
+    def test_price_change_is_recorded_as_update(self):
+        self.crawl()
+        original_price_html = OtomotoStandInHandler.price_html
+        OtomotoStandInHandler.price_html = original_price_html.replace("130 000", "125 000")
+        try:
+            self.crawl()
+        finally:
+            OtomotoStandInHandler.price_html = original_price_html
+
+        self.assertEqual(len(self.read_rows()), 6)
+        updates = self.index.price_updates()
+        self.assertEqual(len(updates), 6)
+        self.assertEqual(updates[0][1:4], (130000, 125000, "PLN"))
+
+    def test_recently_seen_ads_are_not_requested(self):
+        self.index.max_age = 3600
+        self.crawl()
+        self.crawl()
+
+        self.assertEqual(len(self.read_rows()), 6)
+        self.assertEqual(OtomotoStandInHandler.not_modified, 0)
+
+    @unittest.skipIf(async_crawler.aiohttp is None, "aiohttp is not installed")
+    def test_async_crawl_sends_conditional_requests(self):
+        for _ in range(2):
+            spider = CarSpider(self.starting_page, 2, self.filename, seen_index=self.index)
+            spider.crawl_async(concurrency=2, per_host=2, timeout=10)
+
+        self.assertEqual(len(self.read_rows()), 6)
+        self.assertEqual(OtomotoStandInHandler.not_modified, 6, "validators of async responses are stored")
+        self.assertEqual(spider.metrics.counter('crawl_ads_total', result='not_modified'), 6)
+
+        self.index.max_age = 3600
+        spider = CarSpider(self.starting_page, 2, self.filename, seen_index=self.index)
+        spider.crawl_async(concurrency=2, per_host=2, timeout=10)
+        self.assertEqual(spider.metrics.counter('crawl_ads_total', result='seen_recently'), 6)
+
+    def tearDown(self):
+        super().tearDown()
+        self.index.close()
+
+
+class ParsePoolCrawlTestCase(LocalServerTestCase):
+
+    def test_crawl_parallel(self):
+        OtomotoStandInHandler.missing_ads = {4}
+        try:
+            spider = CarSpider(self.starting_page, 2, self.filename, engine='bs4')
+            spider.crawl_parallel(parse_workers=2, fetch_workers=2, buffer_size=2)
+        finally:
+            OtomotoStandInHandler.missing_ads = set()
+        rows = self.read_rows()
+
+        self.assertEqual(len(rows), 5)
+        for row in rows:
+            self.assertEqual(row, ["audi", "s3", "2014", "52000", "benzyna", "kompakt", "True", "130000", "PLN"])
+
+
+class BatchCsvWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'cars.csv')
+        self.car_details = {
+            'make': "audi", 'model': "s3", 'year': "2014", 'mileage': "52000", 'petrol_type': "benzyna",
+            'type': "kompakt", 'no_accidents': True, 'price': 130000, 'currency': "PLN",
+        }
+
+    def read_lines(self):
+        with open(self.filename, newline='') as csvfile:
+            return csvfile.read().splitlines()
+
+    def test_rows_are_flushed_in_batches(self):
+        writer = BatchCsvWriter(self.filename, batch_size=2, flush_interval=3600)
+        writer.write(self.car_details)
+        self.assertEqual(self.read_lines(), [",".join(FIELDNAMES)])
+
+        writer.write(self.car_details)
+        self.assertEqual(len(self.read_lines()), 3)
+        writer.write(self.car_details)
+        self.assertEqual(len(self.read_lines()), 3)
+
+        writer.close()
+        self.assertEqual(len(self.read_lines()), 4)
+        self.assertEqual(self.read_lines()[1], "audi,s3,2014,52000,benzyna,kompakt,True,130000,PLN")
+        self.assertEqual(writer.rows_written, 3)
+
+    def test_flush_interval(self):
+        writer = BatchCsvWriter(self.filename, batch_size=1000, flush_interval=0)
+        writer.write(self.car_details)
+        self.assertEqual(len(self.read_lines()), 2)
+        writer.close()
+
+    def test_header_written_once_and_schema_fixed(self):
+        BatchCsvWriter(self.filename).close()
+        writer = BatchCsvWriter(self.filename)
+        reordered = dict(reversed(list(self.car_details.items())))
+        reordered['unknown_column'] = "ignored"
+        writer.write(reordered)
+        writer.close()
+
+        self.assertEqual(self.read_lines(), [",".join(FIELDNAMES), "audi,s3,2014,52000,benzyna,kompakt,True,130000,PLN"])
+        with self.assertRaises(ValueError):
+            writer.write(self.car_details)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+@unittest.skipIf(parquet_sink.pa is None, "pyarrow is not installed")
+class ParquetSinkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, 'cars_parquet')
+        self.rows = [
+            {'make': "audi", 'model': "s3", 'year': "2014", 'mileage': "52000", 'fuel': "benzyna",
+             'body': "kompakt", 'no_accidents': True, 'price': 130000, 'currency': "PLN"},
+            {'make': "audi", 'model': "a4", 'year': "2010", 'mileage': "180000", 'fuel': "diesel",
+             'body': "kombi", 'no_accidents': False, 'price': 32000, 'currency': "PLN"},
+            {'make': "citroën", 'model': "c3_pluriel", 'year': "2003", 'mileage': "98000", 'fuel': "benzyna",
+             'body': "kabriolet", 'no_accidents': "True", 'price': 3200, 'currency': "PLN"},
+        ]
+
+    def write_rows(self, batch_size=2):
+        sink = parquet_sink.ParquetSink(self.root, batch_size=batch_size)
+        for row in self.rows:
+            sink.write(row)
+        sink.close()
+        return sink
+
+    def test_read_whole_dataset_typed(self):
+        self.write_rows()
+        df = parquet_sink.read_cars(self.root)
+
+        self.assertEqual(list(df.columns), FIELDNAMES)
+        self.assertEqual(len(df), 3)
+        self.assertEqual(str(df['year'].dtype), 'int16')
+        self.assertEqual(str(df['price'].dtype), 'int32')
+        self.assertEqual(str(df['no_accidents'].dtype), 'bool')
+        self.assertEqual(sorted(df['make'].astype(str).unique()), ["audi", "citroën"])
+
+    def test_read_single_partition_and_columns(self):
+        self.write_rows()
+        df = parquet_sink.read_cars(self.root, make="citroën", model="c3_pluriel", columns=['make', 'price'])
+        self.assertEqual(list(df.columns), ['make', 'price'])
+        self.assertEqual(df.values.tolist(), [["citroën", 3200]])
+
+        df = parquet_sink.read_cars(self.root, make="audi", columns=['model', 'mileage'])
+        self.assertEqual(sorted(df.values.tolist()), [["a4", 180000], ["s3", 52000]])
+
+        df = parquet_sink.read_cars(self.root, make="bmw", model="x5")
+        self.assertEqual(len(df), 0)
+
+    def test_compact(self):
+        sink = self.write_rows(batch_size=1)
+        for row in self.rows:
+            sink.write(row)
+        sink.close()
+        partition = parquet_sink.partition_path(self.root, "audi", "s3")
+        self.assertEqual(len(parquet_sink.parquet_files(partition)), 2)
+
+        sink.compact()
+        self.assertEqual(len(parquet_sink.parquet_files(partition)), 1)
+        self.assertEqual(len(parquet_sink.read_cars(self.root)), 6)
+
+    def test_parser_writes_to_sink(self):
+        filename = os.path.join(self.directory.name, 'cars.csv')
+        car_parser = CarParser(filename, sinks=[parquet_sink.ParquetSink(self.root)])
+        car_parser.save_car_details({
+            'make': "audi", 'model': "s3", 'year': "2014", 'mileage': "52000", 'petrol_type': "benzyna",
+            'type': "kompakt", 'no_accidents': True, 'price': 130000, 'currency': "PLN"})
+        car_parser.close_file()
+
+        df = parquet_sink.read_cars(self.root, make="audi", model="s3")
+        self.assertEqual(df.iloc[0]['fuel'], "benzyna")
+        self.assertEqual(df.iloc[0]['body'], "kompakt")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+@unittest.skipIf(pd is None, "pandas is not installed")
+class DatasetIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_csv('../data/cars.csv', encoding='latin-1')
+        self.index = DatasetIndex(self.df)
+
+    def test_lookups_match_dataframe_scans(self):
+        df = self.df
+        for make in df['make'].unique():
+            self.assertEqual(self.index.models_for_make(make), list(df[df['make'] == make].model.unique()))
+        for model in df['model'].unique():
+            self.assertEqual(self.index.makes_for_model(model), list(df[df['model'] == model].make.unique()))
+        for year in df['year'].unique():
+            self.assertEqual(self.index.years_from(year), sorted(df[df.year >= year].year.unique()))
+            self.assertEqual(self.index.years_to(year), sorted(df[df.year <= year].year.unique()))
+
+    def test_query_matches_boolean_masks(self):
+        df = self.df
+        for make, model in df[['make', 'model']].drop_duplicates().values[:10]:
+            for year_from, year_to in [(1990, 2020), (2005, 2010), (2010, 2005), (2012, 2012)]:
+                expected = df[(df.make == make) & (df.model == model) & (df.year <= year_to) & (df.year >= year_from)]
+                result = self.index.query(make, model, year_from, year_to)
+                self.assertEqual(sorted(result.index), sorted(expected.index))
+                self.assertTrue(result['year'].is_monotonic_increasing)
+
+        self.assertEqual(len(self.index.query("unknown", "model", 2000, 2010)), 0)
+        self.assertEqual(len(self.index.query("volkswagen", "golf")), len(df[(df.make == "volkswagen")
+                                                                             & (df.model == "golf")]))
+
+    def test_empty_selection(self):
+        self.assertEqual(self.index.models_for_make(None), sorted(self.df['model'].unique()))
+        self.assertEqual(self.index.makes_for_model(None), sorted(self.df['make'].unique()))
+        self.assertEqual(self.index.years_from(None), self.index.years)
+        self.assertEqual(self.index.models_for_make("unknown"), [])
+
+
+@unittest.skipIf(pd is None, "pandas is not installed")
+class DatasetLoaderTestCase(unittest.TestCase):
+
+    def test_typed_columns(self):
+        df = dataset_loader.load_cars_csv('../data/cars.csv')
+
+        self.assertEqual(list(df.columns), FIELDNAMES)
+        for column, dtype in dataset_loader.CARS_DTYPES.items():
+            self.assertEqual(str(df[column].dtype), dtype)
+        self.assertEqual(len(df), 1650)
+
+    def test_memory_usage_is_smaller(self):
+        typed = dataset_loader.memory_usage(dataset_loader.load_cars_csv('../data/cars.csv'))
+        default = dataset_loader.memory_usage(pd.read_csv('../data/cars.csv', encoding='latin-1'))
+
+        self.assertLess(typed['total'] * 3, default['total'])
+        self.assertIn("1650 rows", dataset_loader.memory_report(dataset_loader.load_cars_csv('../data/cars.csv')))
+
+    def test_index_on_typed_frame(self):
+        df = pd.read_csv('../data/cars.csv', encoding='latin-1')
+        typed_index = DatasetIndex(dataset_loader.load_cars_csv('../data/cars.csv'))
+        index = DatasetIndex(df)
+
+        self.assertEqual(typed_index.makes, index.makes)
+        self.assertEqual(typed_index.years, index.years)
+        self.assertEqual(typed_index.models_for_make("audi"), index.models_for_make("audi"))
+        self.assertEqual(sorted(typed_index.query("audi", "a4", 2005, 2015).index),
+                         sorted(index.query("audi", "a4", 2005, 2015).index))
+
+
+@unittest.skipIf(pd is None, "pandas is not installed")
+class DatasetReloaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'cars.csv')
+        self.row = {'make': "audi", 'model': "s3", 'year': "2014", 'mileage': "52000", 'fuel': "benzyna",
+                    'body': "kompakt", 'no_accidents': True, 'price': 130000, 'currency': "PLN"}
+        self.write_rows([self.row, dict(self.row, model="a4", year="2010")])
+
+    def write_rows(self, rows):
+        writer = BatchCsvWriter(self.filename)
+        for row in rows:
+            writer.write(row)
+        writer.close()
+
+    def test_appended_rows_are_published_in_new_snapshot(self):
+        reloader = DatasetReloader(self.filename)
+        first = reloader.snapshot
+        self.assertFalse(reloader.refresh())
+
+        self.write_rows([dict(self.row, make="bmw", model="x5", year="2018")])
+        self.assertTrue(reloader.refresh())
+        second = reloader.snapshot
+
+        self.assertEqual((first.version, second.version), (0, 1))
+        self.assertEqual(len(first.df), 2, "published snapshot is never modified")
+        self.assertEqual(len(second.df), 3)
+        self.assertEqual(second.makes, ["audi", "bmw"])
+        self.assertEqual(second.index.models_for_make("bmw"), ["x5"])
+        self.assertEqual(list(second.index.query("bmw", "x5").index), [2])
+        self.assertEqual(str(second.df['make'].dtype), 'category')
+        self.assertEqual(second.offset, os.path.getsize(self.filename))
+
+    def test_malformed_rows_are_skipped(self):
+        with open(self.filename, 'ab') as csv_file:
+            csv_file.write(b"bmw,x5,2018,10000,diesel,suv,True,,PLN\r\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            reloader = DatasetReloader(self.filename)
+        self.assertEqual(len(reloader.snapshot.df), 2)
+
+        with open(self.filename, 'ab') as csv_file:
+            csv_file.write(b"bmw,x5,2018,many,diesel,suv,True,250000,PLN\r\n"
+                           b"bmw,x3,2017,20000,diesel,suv,False,150000,PLN\r\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(reloader.refresh())
+        self.assertEqual(reloader.snapshot.df['model'].tolist()[-1], "x3")
+        self.assertEqual(list(reloader.snapshot.df.index), [0, 1, 2])
+        self.assertEqual(reloader.snapshot.offset, os.path.getsize(self.filename))
+        self.assertEqual(str(reloader.snapshot.df['price'].dtype), 'int32')
+
+    def test_partial_row_waits_for_next_refresh(self):
+        reloader = DatasetReloader(self.filename)
+        with open(self.filename, 'ab') as csv_file:
+            csv_file.write(b"bmw,x5,2018,10000,diesel,suv,True,")
+        self.assertFalse(reloader.refresh())
+
+        with open(self.filename, 'ab') as csv_file:
+            csv_file.write(b"250000,PLN\r\n")
+        self.assertTrue(reloader.refresh())
+        self.assertEqual(int(reloader.snapshot.df.iloc[-1]['price']), 250000)
+
+    def test_truncated_file_is_loaded_again(self):
+        reloader = DatasetReloader(self.filename)
+        os.remove(self.filename)
+        self.write_rows([self.row])
+
+        self.assertTrue(reloader.refresh())
+        self.assertEqual(len(reloader.snapshot.df), 1)
+
+    def test_data_id_changes_with_data_at_same_offset(self):
+        first = DatasetReloader(self.filename).snapshot
+        self.assertEqual(DatasetReloader(self.filename).snapshot.data_id, first.data_id,
+                         "the same data has the same identity in every worker")
+
+        os.remove(self.filename)
+        self.write_rows([dict(self.row, year="2010"), dict(self.row, model="a4", year="2014")])
+        second = DatasetReloader(self.filename).snapshot
+        self.assertEqual(second.offset, first.offset)
+        self.assertNotEqual(second.data_id, first.data_id)
+
+    def test_background_thread(self):
+        reloader = DatasetReloader(self.filename, interval=0.01)
+        reloader.start()
+        try:
+            self.write_rows([self.row])
+            for _ in range(200):
+                if len(reloader.snapshot.df) == 3:
+                    break
+                time.sleep(0.01)
+        finally:
+            reloader.stop()
+        self.assertEqual(len(reloader.snapshot.df), 3)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+@unittest.skipIf(pd is None, "pandas is not installed")
+class PriceStatisticsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cars = dataset_loader.load_cars_csv('../data/cars.csv')
+        self.stats = PriceStatistics(DatasetIndex(self.cars))
+
+    def test_statistics_match_raw_rows(self):
+        cars = self.cars[(self.cars['make'] == "audi") & (self.cars['model'] == "a4")]
+        statistics = self.stats.get("audi", "a4")
+        for row in statistics.summary()['years']:
+            prices = cars[cars['year'] == row['year']]['price']
+            self.assertEqual(row['cars'], len(prices))
+            self.assertAlmostEqual(row['p50'], prices.median())
+            self.assertAlmostEqual(row['p25'], prices.quantile(0.25))
+
+        slope, intercept = statistics.regression()
+        expected_slope, expected_intercept = np.polyfit(cars['mileage'].astype(float), cars['price'].astype(float), 1)
+        self.assertAlmostEqual(slope, expected_slope)
+        self.assertAlmostEqual(intercept, expected_intercept, places=3)
+
+        depreciation = statistics.depreciation()
+        self.assertEqual(depreciation[-1], (max(cars['year']), 1.0))
+        self.assertIsNone(self.stats.get("audi", "unknown"))
+
+    def test_currencies_are_not_mixed(self):
+        cars = self.cars[(self.cars['make'] == "mazda") & (self.cars['model'] == "cx-5")]
+        self.assertEqual(set(cars['currency']), {"PLN", "EUR"})
+        statistics = self.stats.get("mazda", "cx-5")
+
+        self.assertEqual(statistics.currency, "PLN")
+        self.assertEqual(int(statistics.counts.sum()), int((cars['currency'] == "PLN").sum()))
+        newest = cars[(cars['currency'] == "PLN") & (cars['year'] == statistics.years[-1])]['price']
+        self.assertAlmostEqual(statistics.summary()['years'][-1]['p50'], newest.median())
+        restored = PriceStatistics.from_frame(self.stats.to_frame())
+        self.assertEqual(restored.get("mazda", "cx-5").currency, "PLN")
+
+    def test_year_range(self):
+        statistics = self.stats.get("audi", "a4")
+        newest = int(statistics.years[-1])
+        self.assertEqual([row['year'] for row in statistics.summary(newest)['years']], [newest])
+        self.assertEqual(statistics.summary(newest + 1)['years'], [])
+        self.assertIsNone(statistics.regression(newest + 1))
+
+    def test_update_with_appended_rows(self):
+        appended = self.cars.iloc[:5].copy()
+        appended['price'] = appended['price'] * 2
+        appended.index = pd.RangeIndex(len(self.cars), len(self.cars) + len(appended))
+        df = pd.concat([self.cars, appended])
+        index = DatasetIndex(df)
+
+        updated = self.stats.updated(index, appended)
+        full = PriceStatistics(index)
+        self.assertEqual(len(updated), len(full))
+        for key, statistics in full.models.items():
+            self.assertEqual(updated.get(*key).summary(), statistics.summary())
+        key = (appended['make'].iloc[0], appended['model'].iloc[0])
+        self.assertNotEqual(updated.get(*key).summary(), self.stats.get(*key).summary())
+
+
+@unittest.skipIf(shared_dataset is None or shared_dataset.pa is None, "pyarrow is not installed")
+class SharedDatasetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.shared = os.path.join(self.directory.name, 'shared')
+        self.source = DatasetSnapshot(dataset_loader.load_cars_csv('../data/cars.csv'), version=3, offset=1234)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_mapped_snapshot_matches_source(self):
+        shared_dataset.publish(self.source, self.shared)
+        snapshot = shared_dataset.SharedDatasetReader(self.shared).snapshot
+
+        self.assertEqual((snapshot.version, snapshot.offset), (3, 1234))
+        self.assertEqual((snapshot.makes, snapshot.models, snapshot.years),
+                         (self.source.makes, self.source.models, self.source.years))
+        self.assertEqual(snapshot.index.groups, self.source.index.groups)
+        self.assertEqual(snapshot.index.models_for_make("audi"), self.source.index.models_for_make("audi"))
+        pd.testing.assert_frame_equal(snapshot.index.query("audi", "a4", 2005, 2012),
+                                      self.source.index.query("audi", "a4", 2005, 2012), check_index_type=False)
+        label = int(self.source.df.index[7])
+        self.assertEqual(snapshot.df.loc[[label]].values.tolist(), self.source.df.loc[[label]].values.tolist())
+        for key, statistics in self.source.stats.models.items():
+            self.assertEqual(snapshot.stats.get(*key).summary(), statistics.summary())
+        self.assertFalse(snapshot.df['price'].to_numpy().flags.writeable, "columns are views of the mapping")
+
+    def test_readers_attach_to_new_version(self):
+        first = shared_dataset.publish(self.source, self.shared, keep=2)
+        reader = shared_dataset.SharedDatasetReader(self.shared)
+        old_snapshot = reader.snapshot
+        self.assertFalse(reader.refresh())
+
+        appended = DatasetSnapshot(self.source.df.iloc[:10], version=4, offset=99)
+        for _ in range(3):
+            shared_dataset.publish(appended, self.shared, keep=2)
+        self.assertTrue(reader.refresh())
+        self.assertEqual(len(reader.snapshot.df), 10)
+        self.assertEqual(len(old_snapshot.df), len(self.source.df), "old mapping stays readable after removal")
+        self.assertEqual(int(old_snapshot.df['price'].sum()), int(self.source.df['price'].sum()))
+        self.assertNotIn(first, shared_dataset.version_names(self.shared))
+        self.assertEqual(len(shared_dataset.version_names(self.shared)), 2)
+
+        with self.assertRaises(FileNotFoundError):
+            shared_dataset.SharedDatasetReader(os.path.join(self.directory.name, 'empty'))
+
+    def test_concurrent_publishers_are_serialized(self):
+        names = []
+
+        def publish():
+            for _ in range(3):
+                names.append(shared_dataset.publish(self.source, self.shared, keep=1))
+        publishers = [threading.Thread(target=publish) for _ in range(4)]
+        for publisher in publishers:
+            publisher.start()
+        for publisher in publishers:
+            publisher.join()
+
+        self.assertEqual(len(set(names)), 12, "every version gets its own name")
+        self.assertEqual(shared_dataset.version_names(self.shared), [max(names)])
+        snapshot = shared_dataset.SharedDatasetReader(self.shared).snapshot
+        self.assertEqual(len(snapshot.df), len(self.source.df))
+        with shared_dataset.locked(self.shared):
+            self.assertIsNone(shared_dataset.publish(self.source, self.shared, blocking=False))
+
+
+@unittest.skipIf(shared_dataset is None or shared_dataset.pa is None, "pyarrow is not installed")
+class SnapshotCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'cars.csv')
+        self.row = {'make': "audi", 'model': "s3", 'year': "2014", 'mileage': "52000", 'fuel': "benzyna",
+                    'body': "kompakt", 'no_accidents': True, 'price': 130000, 'currency': "PLN"}
+        self.cache = SnapshotCache(os.path.join(self.directory.name, 'snapshot'))
+        self.write_rows([self.row, dict(self.row, model="a4", year="2010")])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_rows(self, rows):
+        writer = BatchCsvWriter(self.filename)
+        for row in rows:
+            writer.write(row)
+        writer.close()
+
+    def load(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return DatasetReloader(self.filename, snapshot_cache=self.cache).snapshot
+
+    def test_warm_start_maps_cached_snapshot(self):
+        self.assertIsNone(self.cache.load(self.filename))
+        cold = self.load()
+        cached = self.cache.load(self.filename)
+        warm = self.load()
+
+        self.assertEqual(cached.offset, cold.offset)
+        self.assertEqual((warm.offset, warm.data_id, warm.makes, warm.models, warm.years),
+                         (cold.offset, cold.data_id, cold.makes, cold.models, cold.years))
+        self.assertEqual(warm.stats.get("audi", "s3").summary(), cold.stats.get("audi", "s3").summary())
+        self.assertEqual(sorted(warm.df['model'].tolist()), ["a4", "s3"])
+
+    def test_rows_appended_since_cached_snapshot_are_parsed(self):
+        self.load()
+        self.write_rows([dict(self.row, make="bmw", model="x5", year="2018")])
+        self.assertIsNotNone(self.cache.load(self.filename), "appending keeps cached rows valid")
+        snapshot = self.load()
+
+        self.assertEqual(len(snapshot.df), 3)
+        self.assertEqual(snapshot.offset, os.path.getsize(self.filename))
+        self.assertEqual(list(snapshot.index.query("bmw", "x5").index), [2])
+        self.assertEqual(snapshot.stats.get("bmw", "x5").summary()['years'][0]['cars'], 1)
+        self.assertEqual(self.cache.load(self.filename).offset, snapshot.offset, "refreshed snapshot is cached again")
+
+    def test_background_refresh_updates_cache(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            reloader = DatasetReloader(self.filename, interval=0.01, snapshot_cache=self.cache, cache_interval=0)
+        reloader.start()
+        try:
+            self.write_rows([dict(self.row, make="bmw", model="x5", year="2018")])
+            for _ in range(200):
+                cached = self.cache.load(self.filename)
+                if cached is not None and len(cached.df) == 3:
+                    break
+                time.sleep(0.01)
+        finally:
+            reloader.stop()
+        self.assertEqual(cached.offset, os.path.getsize(self.filename))
+
+    def test_changed_file_invalidates_cache(self):
+        self.load()
+        with open(self.filename, 'rb') as csv_file:
+            data = csv_file.read()
+        with open(self.filename, 'wb') as csv_file:
+            csv_file.write(data.replace(b"130000", b"120000"))
+
+        self.assertIsNone(self.cache.load(self.filename))
+        self.assertEqual(self.load().df['price'].tolist(), [120000, 120000])
+        self.assertIsNotNone(self.cache.load(self.filename), "cache is saved again after parsing")
+
+    def test_only_one_worker_writes_cache(self):
+        self.load()
+        name = shared_dataset.current_version(self.cache.directory)
+        self.write_rows([dict(self.row, make="bmw", model="x5", year="2018")])
+        with shared_dataset.locked(self.cache.directory, exclusive=False):
+            self.load()
+        self.assertEqual(shared_dataset.current_version(self.cache.directory), name, "another worker is writing")
+        self.load()
+        self.assertNotEqual(shared_dataset.current_version(self.cache.directory), name)
+
+    def test_touched_file_with_same_content_hits_cache(self):
+        self.load()
+        os.utime(self.filename, ns=(0, 0))
+        self.assertIsNotNone(self.cache.load(self.filename))
+
+
+@unittest.skipIf(plot is None or shared_dataset is None or shared_dataset.pa is None, "dash or pyarrow missing")
+class PlotReloaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.shared_dataset = plot.SHARED_DATASET
+        plot.SHARED_DATASET = self.directory.name
+        shared_dataset.publish(DatasetSnapshot(dataset_loader.load_cars_csv('../data/cars.csv')), self.directory.name)
+
+    def tearDown(self):
+        if plot.reloader is not None:
+            plot.reloader.stop()
+        plot.reloader = None
+        plot.SHARED_DATASET = self.shared_dataset
+        self.directory.cleanup()
+
+    def test_reloader_is_opened_lazily_and_refreshed_in_background(self):
+        self.assertIsNone(plot.reloader)
+        with contextlib.redirect_stdout(io.StringIO()):
+            reloader = plot.get_reloader()
+        self.assertIs(plot.get_reloader(), reloader)
+        self.assertIsInstance(reloader, shared_dataset.SharedDatasetReader)
+        self.assertTrue(reloader._thread.is_alive(), "workers not started with __main__ poll for new versions too")
+
+
+@unittest.skipIf(figure_builder is None, "plotly is not installed")
+class FigureBuilderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cars = dataset_loader.load_cars_csv('../data/cars.csv')
+
+    def test_rendering_mode_depends_on_size(self):
+        self.assertEqual(figure_builder.build_traces(self.cars.iloc[:0], "audi"), [])
+        self.assertEqual(figure_builder.build_traces(self.cars, "all", 2000, 5000)[0].type, 'scatter')
+        self.assertEqual(figure_builder.build_traces(self.cars, "all", 1000, 5000)[0].type, 'scattergl')
+        traces = figure_builder.build_traces(self.cars, "all", 100, 1000)
+        self.assertEqual([trace.type for trace in traces], ['heatmap', 'scatter', 'scatter', 'scatter'])
+
+    def test_aggregates_match_raw_rows(self):
+        heatmap, *percentile_lines = figure_builder.aggregate_traces(self.cars, mileage_bins=8, price_bins=6)
+        total = 0
+        for z_row, bounds_row in zip(heatmap.z, heatmap.customdata):
+            for count, bounds in zip(z_row, bounds_row):
+                rows = figure_builder.rows_in_bin(self.cars, bounds)
+                self.assertEqual(len(rows), count or 0)
+                total += len(rows)
+        self.assertEqual(total, len(self.cars))
+
+        median = percentile_lines[1]
+        self.assertEqual(median.name, "price p50")
+        self.assertEqual(len(median.y), 8)
+
+    def test_describe_bin(self):
+        bounds = [1, 10 ** 7, 0, 10 ** 7]
+        summary = figure_builder.describe_bin(self.cars, bounds, sample_size=3)
+        self.assertEqual(summary['cars'], len(self.cars))
+        self.assertEqual(len(summary['sample']), 3)
+
+    def test_trend_trace(self):
+        stats = PriceStatistics(DatasetIndex(self.cars))
+        cars = self.cars[(self.cars['make'] == "audi") & (self.cars['model'] == "a4")]
+        trend = figure_builder.trend_trace(stats.get("audi", "a4"), cars)
+        self.assertEqual(trend.mode, 'lines')
+        self.assertAlmostEqual(trend.x[0], max(cars['mileage'].min(), 1))
+        self.assertIsNone(figure_builder.trend_trace(None, cars))
+
+
+class CallbackCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.version = 0
+
+    def callback(self, make, model, year_from=None):
+        self.calls.append((make, model, year_from))
+        return {'data': [make, model, year_from]}
+
+    def test_results_are_reused_until_version_changes(self):
+        cache = CallbackCache()
+        cached = cache.memoize(lambda: self.version)(self.callback)
+
+        self.assertEqual(cached("audi", "a4", ""), {'data': ["audi", "a4", ""]})
+        self.assertEqual(cached("audi", "a4", None), {'data': ["audi", "a4", ""]}, "empty value is same filter")
+        self.assertEqual(len(self.calls), 1)
+
+        self.version = 1
+        cached("audi", "a4", None)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = CallbackCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('a'), (True, 1))
+        self.assertEqual(len(cache), 2)
+
+        entry_size = cache.size // 2
+        cache = CallbackCache(max_bytes=entry_size * 2)
+        for key in 'abc':
+            cache.put(key, 1)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.size, entry_size * 2)
+        cache.put('big', b'x' * entry_size * 3)
+        self.assertEqual(cache.get('big'), (False, None), "results bigger than whole cache are not kept")
+
+    def test_disk_backend_is_shared_between_caches(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = CallbackCache(backend=DiskCacheBackend(directory))
+            second = CallbackCache(backend=DiskCacheBackend(directory))
+            first.memoize(lambda: self.version)(self.callback)("bmw", "x5")
+            self.assertEqual(second.memoize(lambda: self.version)(self.callback)("bmw", "x5"),
+                             {'data': ["bmw", "x5", None]})
+            self.assertEqual(len(self.calls), 1)
+
+            backend = DiskCacheBackend(directory, max_bytes=0)
+            backend.evict()
+            self.assertEqual(os.listdir(directory), [])
+
+
+@unittest.skipIf(benchmarks is None, "benchmark dependencies are not installed")
+class BenchmarksTestCase(unittest.TestCase):
+
+    def test_generated_ads_are_parsed(self):
+        template = load_template()
+        details = CarParser.parse_car_details(render_ad(template, 7))
+        self.assertEqual(details, CarParser.parse_car_details(render_ad(template, 7)))
+        self.assertNotEqual(details, CarParser.parse_car_details(render_ad(template, 8)))
+        self.assertEqual(set(details), {'make', 'model', 'year', 'mileage', 'petrol_type', 'type', 'no_accidents',
+                                        'price', 'currency'})
+
+    def test_stand_in_crawl(self):
+        with tempfile.TemporaryDirectory() as directory, StandInServer(pages=2, ads_per_page=4) as stand_in:
+            filename = os.path.join(directory, 'cars.csv')
+            CarSpider(stand_in.starting_url, 3, filename).crawl_streaming(workers=2)
+            with open(filename, encoding='cp1250') as csv_file:
+                self.assertEqual(len(list(csv.reader(csv_file))), 9)
+
+    def test_compare(self):
+        baseline = {'results': {'a': benchmarks.result(10, 'ms'), 'b': benchmarks.result(100, 'ads/s', 'higher'),
+                                'c': benchmarks.result(1, 'ms')}}
+        current = {'results': {'a': benchmarks.result(12, 'ms'), 'b': benchmarks.result(150, 'ads/s', 'higher'),
+                               'c': benchmarks.result(1.05, 'ms'), 'new': benchmarks.result(1, 'ms')}}
+        statuses = {name: status for name, *_, status in benchmarks.compare(baseline, current)}
+        self.assertEqual(statuses, {'a': 'regression', 'b': 'improvement', 'c': 'ok'})
+
+
+class ParserEnginesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        with open("offer_params.html", encoding='cp1250') as html_file:
+            self.html = html_file.read() + OtomotoStandInHandler.price_html
+        self.reference = parser_engines.BeautifulSoupEngine()
+
+    def available_engines(self):
+        # engines whose package is installed must work, they are not skipped when creating them fails
+        for name, engine in parser_engines.ENGINES.items():
+            if importlib.util.find_spec(engine.package) is not None:
+                yield parser_engines.get_engine(name)
+
+    def test_installed_engines_are_available(self):
+        self.assertIn('bs4', [engine.name for engine in self.available_engines()])
+        if importlib.util.find_spec('selectolax') is not None:
+            self.assertIsInstance(parser_engines.get_engine('selectolax'), parser_engines.SelectolaxEngine)
+
+    def test_engines_extract_same_fields_as_reference(self):
+        reference_params, reference_price, reference_currency = self.reference.extract(self.html)
+        reference_details = CarParser.parse_car_details(self.html, self.reference)
+        self.assertEqual(len(reference_params), 25)
+
+        for engine in self.available_engines():
+            with self.subTest(engine=engine.name):
+                params, price, currency = engine.extract(self.html)
+                self.assertEqual([CarParser.plain_text(label) for label, _ in params],
+                                 [CarParser.plain_text(label) for label, _ in reference_params])
+                self.assertEqual(CarParser.parse_price_tag(price), CarParser.parse_price_tag(reference_price))
+                self.assertEqual(currency, reference_currency)
+                self.assertEqual(CarParser.parse_car_details(self.html, engine), reference_details)
+
+        self.assertEqual(reference_details['make'], "audi")
+        self.assertEqual(reference_details['price'], 130000)
+
+    def test_engines_raise_on_missing_regions(self):
+        for engine in self.available_engines():
+            with self.subTest(engine=engine.name):
+                with self.assertRaises(AttributeError):
+                    engine.extract("<html><body><p>no offer</p></body></html>")
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            parser_engines.get_engine('regex')
+
+
+class RegionExtractorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        with open("offer_params.html", encoding='cp1250') as html_file:
+            self.html = html_file.read() + OtomotoStandInHandler.price_html
+        self.content = ("<html><head><script>var offer = '<div>';</script></head><body>" + self.html +
+                        "<div class=\"gallery\"><img src=\"a.jpg\"></div></body></html>").encode('cp1250')
+
+    def test_regions_contain_only_offer_params_and_price(self):
+        fragment = region_extractor.extract_regions(self.content)
+        self.assertLess(len(fragment), len(self.content))
+        self.assertNotIn(b'gallery', fragment)
+        self.assertTrue(fragment.startswith(b'<div class="offer-params'))
+        self.assertTrue(fragment.rstrip().endswith(b'</span>'))
+        self.assertEqual(fragment.count(b'<div'), fragment.count(b'</div>'))
+
+    def test_regions_give_same_details_as_full_parse(self):
+        expected = CarParser.parse_car_details(self.html)
+        for name in parser_engines.ENGINES:
+            try:
+                engine = parser_engines.get_engine(name)
+            except ImportError:
+                continue
+            with self.subTest(engine=name):
+                self.assertEqual(CarParser.parse_regions(self.content, 'cp1250', engine), expected)
+                self.assertEqual(CarParser.parse_car_details_from_content(self.content, 'cp1250', engine), expected)
+
+    def test_missing_or_unclosed_regions(self):
+        without_price = self.content.replace(b'offer-price__number', b'offer-price__other')
+        self.assertIsNone(region_extractor.extract_regions(without_price))
+        self.assertIsNone(region_extractor.extract_regions(self.content[:self.content.index(b'offer-price__number')]))
+        self.assertIsNone(region_extractor.extract_regions(b'<html><body><p>no offer</p></body></html>'))
+
+    def test_parser_falls_back_to_full_parse(self):
+        # single quoted class attribute is not matched by the byte locator, html parser still finds it
+        broken = self.content.replace(b'class="offer-params"', b"class='offer-params'")
+        self.assertIsNone(region_extractor.extract_regions(broken))
+        with tempfile.TemporaryDirectory() as directory:
+            parser = CarParser(os.path.join(directory, 'cars.csv'))
+            parser.save_car_details_from_content(self.content, 'cp1250')
+            parser.save_car_details_from_content(broken, 'cp1250')
+            parser.close_file()
+            with open(os.path.join(directory, 'cars.csv'), encoding='cp1250') as csv_file:
+                rows = list(csv.DictReader(csv_file))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0], rows[1])
+        self.assertEqual(parser.metrics.counter('crawl_extraction_total', path='regions'), 1)
+        self.assertEqual(parser.metrics.counter('crawl_extraction_total', path='full'), 1)
+
+
 class CarSpiderTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -193,6 +1319,399 @@ class CarSpiderTestCase(unittest.TestCase):
         self.spider.close_csv_file_in_parser()
 
 
+class HttpSessionTestCase(LocalServerTestCase):
+
+    def test_retry_on_server_error(self):
+        session = HttpSession(pool_size=2, retries=3, backoff_factor=0, timeout=5)
+        url = "http://127.0.0.1:{}/flaky/2".format(self.server.server_address[1])
+        r = session.get(url)
+        session.close()
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.text, "ok")
+
+    def test_session_shared_by_spider_and_parser(self):
+        spider = CarSpider(self.starting_page, 1, self.filename)
+        user_agent = spider.session.user_agent
+
+        self.assertIs(spider.session, spider.parser.session)
+        spider.crawl()
+        self.assertEqual(spider.session.user_agent, user_agent)
+        self.assertEqual(len(self.read_rows()), 3)
+
+
+class AdaptiveThrottleTestCase(LocalServerTestCase):
+
+    def test_additive_increase_multiplicative_decrease(self):
+        throttle = AdaptiveThrottle(initial_limit=2, max_limit=4)
+        for _ in range(20):
+            started = [throttle.acquire() for _ in range(throttle.limit)]
+            for start in started:
+                throttle.release(start, 200)
+        self.assertEqual(throttle.limit, 4, "limit grows while it is used, up to max_limit")
+
+        started = [throttle.acquire() for _ in range(4)]
+        for start in started:
+            throttle.release(start, error=True)
+        self.assertEqual(throttle.limit, 2, "requests sent with the old limit cut it only once")
+        self.assertEqual(throttle.backoffs, 1)
+
+        throttle.release(throttle.acquire(), 503, retry_after="0")
+        self.assertEqual(throttle.limit, 1)
+        throttle.release(throttle.acquire(), 503)
+        self.assertEqual(throttle.limit, 1, "limit never drops below min_limit")
+        self.assertGreater(throttle.stats()['paused_for'], 0.5, "default pause without Retry-After")
+
+        throttle = AdaptiveThrottle(initial_limit=2, max_limit=4)
+        for _ in range(20):
+            throttle.release(throttle.acquire(), 200)
+        self.assertEqual(throttle.limit, 2, "limit which is not reached does not grow")
+
+    def test_retry_after_pauses_requests(self):
+        throttle = AdaptiveThrottle()
+        throttle.release(throttle.acquire(), 429, retry_after="0.2")
+        started = time.monotonic()
+        throttle.release(throttle.acquire(), 200)
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertAlmostEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+
+    def test_stats(self):
+        throttle = AdaptiveThrottle()
+        self.assertIsNone(throttle.stats()['latency_p50'])
+        for _ in range(5):
+            throttle.release(throttle.acquire(), 200)
+        stats = throttle.stats()
+        self.assertEqual((stats['requests'], stats['errors'], stats['in_flight']), (5, 0, 0))
+        self.assertGreater(stats['throughput'], 0)
+        self.assertLessEqual(stats['latency_p50'], stats['latency_p99'])
+
+    def test_session_retries_throttled_response(self):
+        throttle = AdaptiveThrottle()
+        session = HttpSession(throttle=throttle)
+        url = self.starting_page.replace("/osobowe/audi/s3/", "/throttled/2")
+        started = time.monotonic()
+        r = session.get(url)
+        session.close()
+
+        self.assertEqual(r.status_code, 200)
+        self.assertGreaterEqual(time.monotonic() - started, 0.35, "Retry-After is honored")
+        self.assertEqual((throttle.requests, throttle.errors), (3, 2))
+
+
+class AsyncCrawlerTestCase(LocalServerTestCase):
+
+    def test_crawl_async_writes_same_rows_as_crawl(self):
+        spider = CarSpider(self.starting_page, 2, self.filename)
+        spider.crawl()
+        sequential_rows = self.read_rows()
+        os.remove(self.filename)
+
+        spider = CarSpider(self.starting_page, 2, self.filename)
+        spider.crawl_async(concurrency=4, per_host=2, timeout=10)
+        async_rows = self.read_rows()
+
+        self.assertEqual(len(sequential_rows), 6)
+        self.assertEqual(sorted(sequential_rows), sorted(async_rows))
+        self.assertEqual(spider._page_number, 3)
+
+    @unittest.skipIf(async_crawler.aiohttp is None, "aiohttp is not installed")
+    def test_fetch_failure_is_skipped(self):
+        OtomotoStandInHandler.missing_ads = {1}
+        try:
+            spider = CarSpider(self.starting_page, 2, self.filename)
+            crawler = async_crawler.AsyncCrawler(spider, concurrency=2, per_host=2, timeout=10, buffer_size=1)
+            crawler.run()
+            spider.close_csv_file_in_parser()
+        finally:
+            OtomotoStandInHandler.missing_ads = set()
+
+        self.assertEqual(len(self.read_rows()), 5)
+        self.assertEqual(spider.car_ads_list, [])
+
+
+class CrawlMetricsTestCase(LocalServerTestCase):
+
+    def test_crawl_is_instrumented(self):
+        OtomotoStandInHandler.missing_ads = {2}
+        try:
+            spider = CarSpider(self.starting_page, 3, self.filename)
+            spider.crawl_streaming(workers=2)
+        finally:
+            OtomotoStandInHandler.missing_ads = set()
+        metrics = spider.metrics
+
+        self.assertEqual(metrics.counter('crawl_pages_total'), 3)
+        self.assertEqual(metrics.counter('crawl_links_total'), 6)
+        self.assertEqual(metrics.counter('crawl_ads_total', result='saved'), 5)
+        self.assertEqual(metrics.counter('crawl_failures_total', reason='http_404'), 1)
+        self.assertGreater(metrics.counter('crawl_bytes_total', page='ad'), 5 * 8000)
+        for stage in ('fetch_listing', 'fetch', 'parse', 'extract', 'write'):
+            with self.subTest(stage=stage):
+                count, total, maximum = metrics.timing('crawl_stage_seconds', stage=stage)
+                self.assertGreater(count, 0)
+                self.assertGreaterEqual(total, maximum)
+        self.assertEqual(metrics.gauge('crawl_queue_depth', queue='links'), 0)
+
+    def test_failure_reasons(self):
+        with open("offer_params.html", encoding='cp1250') as html_file:
+            html = html_file.read()
+        parser = CarParser(self.filename)
+        parser.save_car_details_from_html(html)
+        parser.save_car_details_from_html("<html></html>")
+        parser.close_file()
+
+        self.assertEqual(parser.metrics.counter('crawl_failures_total', reason='missing_price'), 1)
+        self.assertEqual(parser.metrics.counter('crawl_failures_total', reason='missing_offer_params'), 1)
+        self.assertEqual(parser.metrics.counter('crawl_ads_total', result='saved'), 0)
+
+    def test_export(self):
+        metrics = CrawlMetrics()
+        metrics.inc('crawl_failures_total', reason='missing_price')
+        metrics.inc('crawl_pages_total', 2)
+        metrics.set_gauge('crawl_queue_depth', 3, queue='links')
+        metrics.observe('crawl_stage_seconds', 0.5, stage='fetch')
+        metrics.observe('crawl_stage_seconds', 1.5, stage='fetch')
+
+        text = metrics.to_prometheus()
+        self.assertIn("# TYPE crawl_failures_total counter", text)
+        self.assertIn('crawl_failures_total{reason="missing_price"} 1', text)
+        self.assertIn('crawl_queue_depth{queue="links"} 3', text)
+        self.assertIn('crawl_stage_seconds_count{stage="fetch"} 2', text)
+        self.assertIn('crawl_stage_seconds_sum{stage="fetch"} 2.0', text)
+        self.assertIn('crawl_stage_seconds_max{stage="fetch"} 1.5', text)
+        self.assertEqual(metrics.snapshot()['timers']['crawl_stage_seconds{stage="fetch"}'],
+                         dict(count=2, sum=2.0, max=1.5))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'crawl.json')
+            profiler = SamplingProfiler(interval=0.001)
+            with MetricsExporter(metrics, path, interval=0.01, profiler=profiler):
+                time.sleep(0.05)
+            with open(path) as metrics_file:
+                self.assertEqual(json.load(metrics_file)['counters']['crawl_pages_total'], 2)
+            self.assertGreater(profiler.samples, 0)
+            self.assertTrue(os.path.isfile(path + '.stacks'))
+            self.assertTrue(profiler.top(1))
+
+    def test_unparsable_price_is_counted_as_malformed_offer(self):
+        OtomotoStandInHandler.unpriced_ads = {1}
+        try:
+            spider = CarSpider(self.starting_page, 2, self.filename)
+            with contextlib.redirect_stdout(io.StringIO()):
+                spider.crawl_streaming(workers=2)
+        finally:
+            OtomotoStandInHandler.unpriced_ads = set()
+
+        self.assertEqual(spider.metrics.counter('crawl_failures_total', reason='malformed_offer'), 1)
+        self.assertEqual(spider.metrics.counter('crawl_failures_total', reason='unexpected_error'), 0)
+        self.assertEqual(spider.metrics.counter('crawl_ads_total', result='saved'), 5)
+
+
+class PaginationTestCase(LocalServerTestCase):
+
+    def tearDown(self):
+        OtomotoStandInHandler.pager = False
+        OtomotoStandInHandler.repeat_last_page = False
+        OtomotoStandInHandler.overlap = 0
+        super().tearDown()
+
+    def crawl_links(self, pages_limit: int, listing_workers: int = 4):
+        spider = CarSpider(self.starting_page, pages_limit, self.filename, listing_workers=listing_workers)
+        spider.get_car_ads_list()
+        spider.close_csv_file_in_parser()
+        return spider
+
+    def test_page_count_is_read_from_first_page(self):
+        OtomotoStandInHandler.pager = True
+        spider = CarSpider(self.starting_page, 10, self.filename)
+        self.assertEqual(spider.parse_listing_page(spider.session.get(self.starting_page + "?page=1").text)[1], 2)
+
+        spider = self.crawl_links(10)
+        self.assertEqual(len(spider.car_ads_list), 6)
+        self.assertEqual(spider.metrics.counter('crawl_pages_total'), 2, "pages past the last one are not requested")
+
+    def test_stops_at_empty_page(self):
+        spider = self.crawl_links(10, listing_workers=2)
+        self.assertEqual(len(spider.car_ads_list), 6)
+        # pages 2 and 3 are requested together, page 3 is empty
+        self.assertEqual(spider.metrics.counter('crawl_pages_total'), 3)
+        self.assertEqual(spider._page_number, 4)
+
+    def test_stops_at_repeated_page(self):
+        OtomotoStandInHandler.repeat_last_page = True
+        spider = self.crawl_links(10, listing_workers=3)
+        self.assertEqual(len(spider.car_ads_list), 6)
+        self.assertLessEqual(spider.metrics.counter('crawl_pages_total'), 4)
+
+    def test_moved_ads_are_crawled_once(self):
+        OtomotoStandInHandler.pager = True
+        OtomotoStandInHandler.overlap = 1
+        spider = self.crawl_links(2)
+        self.assertEqual([link.split("-ID")[1] for link in spider.car_ads_list],
+                         ["0.html", "1.html", "2.html", "3.html", "4.html"])
+        self.assertEqual(spider.metrics.counter('crawl_duplicate_links_total'), 1)
+
+    def test_crawl_async_uses_page_count(self):
+        OtomotoStandInHandler.pager = True
+        OtomotoStandInHandler.overlap = 1
+        spider = CarSpider(self.starting_page, 10, self.filename)
+        spider.crawl_async(concurrency=4, per_host=2, timeout=10)
+        self.assertEqual(len(self.read_rows()), 5)
+        if async_crawler.aiohttp is not None:
+            self.assertEqual(spider.metrics.counter('crawl_pages_total'), 2)
+
+    @unittest.skipIf(async_crawler.aiohttp is None, "aiohttp is not installed")
+    def test_crawl_async_stops_at_empty_or_repeated_page(self):
+        for repeat_last_page in (False, True):
+            with self.subTest(repeat_last_page=repeat_last_page):
+                OtomotoStandInHandler.repeat_last_page = repeat_last_page
+                spider = CarSpider(self.starting_page, 10, self.filename, listing_workers=2)
+                spider.crawl_async(concurrency=4, per_host=2, timeout=10)
+                self.assertEqual(len(self.read_rows()), 6)
+                # pages 2 and 3 are requested together, page 3 is empty or repeats page 2
+                self.assertEqual(spider.metrics.counter('crawl_pages_total'), 3)
+                self.assertEqual(spider._page_number, 4)
+                os.remove(self.filename)
+
+    def test_frontier(self):
+        frontier = LinkFrontier()
+        self.assertTrue(frontier.add("http://a/1.html"))
+        self.assertFalse(frontier.add("http://a/1.html#gallery"))
+        self.assertEqual(frontier.add_new(["http://a/2.html", "http://a/1.html", "http://a/2.html"]),
+                         ["http://a/2.html"])
+        self.assertIn("http://a/2.html", frontier)
+        self.assertEqual(len(frontier), 2)
+
+
+class CrawlCheckpointTestCase(LocalServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.checkpoint_path = os.path.join(self.directory.name, 'crawl.sqlite')
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def test_interrupted_crawl_resumes_without_duplicates(self):
+        checkpoint = CrawlCheckpoint(self.checkpoint_path)
+        spider = CarSpider(self.starting_page, 2, self.filename, checkpoint=checkpoint)
+        links = spider.iter_car_ads()
+        crawled = [next(links) for _ in range(4)]
+        for link in crawled[:3]:
+            spider.parser.save_car_details_from_ad_page(link)
+            spider.ad_processed(link)
+        spider.parser.writer.flush()
+        # the fourth row is lost in the buffer and another one is cut in half by the crash
+        spider.parser.save_car_details_from_ad_page(crawled[3])
+        with open(self.filename, 'a', encoding='cp1250') as csv_file:
+            csv_file.write("audi,s3,20")
+        spider.close_session()
+        checkpoint.close()
+
+        checkpoint = CrawlCheckpoint(self.checkpoint_path)
+        self.assertEqual(checkpoint.pending(), crawled[3:] + [link for link in links])
+        checkpoint.close()
+        with contextlib.redirect_stdout(io.StringIO()):
+            car_spider_main(['--resume', self.checkpoint_path, '--method', 'crawl'])
+
+        rows = self.read_rows()
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(all(len(row) == len(FIELDNAMES) for row in rows))
+
+        checkpoint = CrawlCheckpoint(self.checkpoint_path)
+        self.assertTrue(checkpoint.finished)
+        self.assertEqual(checkpoint.state()['output_size'], os.path.getsize(self.filename))
+        spider = CarSpider.resume(checkpoint)
+        spider.crawl_streaming(workers=2)
+        self.assertEqual(spider.metrics.counter('crawl_pages_total'), 0, "finished crawl is not repeated")
+        self.assertEqual(len(self.read_rows()), 6)
+        checkpoint.close()
+
+    def test_resumed_crawl_writes_rolled_back_ads_recorded_in_seen_index(self):
+        seen_index = SeenAdIndex(os.path.join(self.directory.name, 'seen.sqlite'))
+        checkpoint = CrawlCheckpoint(self.checkpoint_path)
+        spider = CarSpider(self.starting_page, 2, self.filename, seen_index=seen_index, checkpoint=checkpoint)
+        links = spider.iter_car_ads()
+        crawled = [next(links) for _ in range(3)]
+        for link in crawled[:2]:
+            spider.parser.save_car_details_from_ad_page(link)
+            spider.ad_processed(link)
+        spider.parser.writer.flush()
+        # the third ad is already in the index as new when its buffered row is lost by the crash
+        spider.parser.save_car_details_from_ad_page(crawled[2])
+        self.assertEqual(len(seen_index), 3)
+        spider.close_session()
+        checkpoint.close()
+
+        checkpoint = CrawlCheckpoint(self.checkpoint_path)
+        spider = CarSpider.resume(checkpoint, seen_index=seen_index)
+        spider.crawl()
+        checkpoint.close()
+
+        self.assertEqual(len(self.read_rows()), 6)
+        self.assertEqual(spider.metrics.counter('crawl_ads_total', result='saved'), 4)
+        self.assertEqual(len(seen_index), 6)
+        seen_index.close()
+
+    def test_streaming_crawl_completes_checkpoint(self):
+        checkpoint = CrawlCheckpoint(self.checkpoint_path)
+        spider = CarSpider(self.starting_page, 3, self.filename, checkpoint=checkpoint)
+        spider.crawl_streaming(workers=2)
+
+        self.assertTrue(checkpoint.finished)
+        self.assertEqual(len(checkpoint.known()), 6)
+        self.assertEqual(checkpoint.state()['page_number'], 4)
+        with self.assertRaises(ValueError):
+            CarSpider(self.starting_page.replace("s3", "a4"), 3, self.filename, checkpoint=checkpoint)
+        checkpoint.close()
+
+        with self.assertRaises(ValueError):
+            CarSpider.resume(CrawlCheckpoint(os.path.join(self.directory.name, 'empty.sqlite')))
+
+
+class StreamingCrawlTestCase(LocalServerTestCase):
+
+    def test_iter_car_ads(self):
+        spider = CarSpider(self.starting_page, 2, self.filename)
+        links = spider.iter_car_ads()
+        first_link = next(links)
+
+        self.assertTrue(first_link.endswith("-ID0.html"))
+        self.assertEqual(spider._page_number, 2, "second listing page is not requested before it is needed")
+        self.assertEqual(len(list(links)), 5)
+        spider.close_csv_file_in_parser()
+
+    def test_crawl_streaming(self):
+        spider = CarSpider(self.starting_page, 2, self.filename)
+        spider.crawl_streaming(workers=2, buffer_size=1)
+        rows = self.read_rows()
+
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(spider.car_ads_list, [])
+        self.assertEqual(rows[0][:2], ["audi", "s3"])
+
+    def test_broken_ads_do_not_stop_workers(self):
+        OtomotoStandInHandler.unpriced_ads = {0, 1, 2}
+        try:
+            for method in ('crawl_streaming', 'crawl_async'):
+                with self.subTest(method=method):
+                    spider = CarSpider(self.starting_page, 2, self.filename)
+                    crawl = threading.Thread(target=getattr(spider, method), kwargs=dict(workers=2) if
+                                             method == 'crawl_streaming' else dict(concurrency=2, timeout=10),
+                                             daemon=True)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        crawl.start()
+                        crawl.join(30)
+                    self.assertFalse(crawl.is_alive(), "crawl finished")
+                    self.assertEqual(len(self.read_rows()), 3)
+                    os.remove(self.filename)
+        finally:
+            OtomotoStandInHandler.unpriced_ads = set()
+
+
 
 
 